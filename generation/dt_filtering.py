@@ -1,8 +1,21 @@
 import os
-import json
+import random
+from itertools import tee
 import logging
-from utils.statistic_funcs import filter_by_modify_lines
-from utils.statistic_funcs import filter_data_by_hdp_topic_analysis
+import numpy as np
+from utils.columnar_io import is_parquet_path
+from utils.triplet_record import iter_records, write_records, fetch_records
+from utils.diff_cache import DIFF_CACHE_VERSION, default_diff_cache_path
+from utils.dedup import DEDUP_KEY_VERSION, iter_deduplicated
+from utils.syntax_check import check_syntax_mode, default_syntax_cache_path, iter_syntax_filtered, syntax_check_id
+from utils.hdp_cache import HdpFitCache, DEFAULT_HDP_CACHE_MAX_BYTES
+from utils.load_instruct_from_file import instruction_from_record
+from utils.statistic_funcs import iter_filtered_by_modify_lines
+from utils.hdp_preprocess import HdpPreprocessor
+from utils.statistic_funcs import hdp_data_id, hdp_fit_key, has_hdp_fit_results, load_or_fit_hdp, load_or_update_hdp
+from utils.statistic_funcs import assign_dominant_topics
+from utils.topic_sampler import sample_indices_by_topic
+from utils.topic_backends import check_topic_backend, backend_dominant_topics
 
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
@@ -12,11 +25,17 @@ logging.getLogger('gensim').setLevel(logging.WARNING)
 def dt_filtering(jsonl_path, field_name, data_format, random_seed=None, filter_settings=None):
     """
     Filters and processes data from a JSONL file using diff-based and topic-based criteria.
-    This function performs two main filtering steps:
+    This function performs two main filtering steps (after an optional exact-duplicate removal and Python syntax
+    check, see "dedup" and "syntax_check"):
     1. Diff Filtering: Filters data samples based on the number of modified lines and hunks.
-    2. HDP Topic Filtering: Further filters the diff-filtered data using Hierarchical Dirichlet Process (HDP) topic analysis.
+    2. HDP Topic Filtering: Further filters the diff-filtered data using Hierarchical Dirichlet Process (HDP) topic analysis
+       (or another topic backend, see "topic_backend").
+    The input is read in a single streaming pass. Diff-filtered records are written out as they pass, and their
+    instructions are tokenized at the same time. Only record locators and token lists are kept in memory. The
+    selected records are finally fetched from the diff-filtered file by locator.
     Args:
-        jsonl_path (str): Path to the input JSONL file containing data samples.
+        jsonl_path (str): Path to the input JSONL file containing data samples. A Parquet file (`.parquet`) is
+            also accepted, in which case the filtered outputs are written as Parquet too.
         field_name (str or list): Field name(s) to extract instruction content.
             - For 'sharegpt': a single field specifying the conversation list.
             - For general format: one or two field names to concatenate.
@@ -27,61 +46,166 @@ def dt_filtering(jsonl_path, field_name, data_format, random_seed=None, filter_s
             - "max_hunk_num" (int): Maximum number of hunks allowed per sample (default: 7).
             - "max_samples_total" (int): Maximum total number of samples after filtering (default: 10000).
             - "refit" (bool): Whether to refit the HDP topic model (default: False).
+            - "incremental" (bool): When the input has grown since an earlier run under the same file name and
+              settings, update that run's cached HDP fit with the new documents instead of fitting from scratch;
+              only unseen instructions are tokenized (see `load_or_update_hdp`) (default: False).
+            - "num_workers" (int): Number of worker processes for diff analysis, HDP preprocessing and topic inference,
+              1 for serial (default: 1).
+            - "diff_cache" (bool or str): Cache diff statistics by content hash in a SQLite file, so re-filtering
+              with other thresholds skips the diffs. True uses `utils/fit_results/diff_stats_cache.sqlite`,
+              a string gives the cache path (default: False).
+            - "hdp_cache_max_gb" (float): Disk budget of the HDP fit cache in `utils/fit_results/hdp_cache`;
+              least recently used fits are evicted beyond it (default: 20).
+            - "topic_backend" (str): "hdp" (default), or a multi-core alternative with a fixed topic count:
+              "lda_multicore" (gensim LdaMulticore) or "tfidf_kmeans" (TF-IDF + MiniBatchKMeans, needs scikit-learn).
+              All backends feed the same quota-balancing sampler; only HDP fits are cached.
+            - "num_topics" (int): Number of topics of the "lda_multicore" and "tfidf_kmeans" backends (default: 50).
+            - "dedup" (bool): Drop triplets whose whitespace-normalized code before, instruction and code after
+              repeat an earlier one, before any diff or HDP work. Seen keys are kept in a scratch SQLite file in
+              the output directory (default: False).
+            - "syntax_check" (str): Check that `code_before_purify` and `code_after_purify` are Python (in worker
+              processes) before any diff or HDP work: "drop" removes samples that fail, "flag" keeps them with a
+              `syntax_valid` field, "keep" skips the check (default: "keep").
+            - "syntax_level" (str): "fragment" accepts any snippet that tokenizes as Python, such as a window cut
+              out of a file; "module" requires that the snippet parses on its own with `ast` (default: "fragment").
+            - "syntax_cache" (bool or str): Cache syntax check results by content hash in a SQLite file. True uses
+              `utils/fit_results/syntax_check_cache.sqlite`, a string gives the cache path (default: True).
     Returns:
         None: The function writes filtered data to output files in the "filtered" directory.
     """
 
 
     base_name = os.path.splitext(os.path.basename(jsonl_path))[0]
-    abs_jsonl_path = os.path.abspath(jsonl_path)
-    dir_name = os.path.dirname(abs_jsonl_path)
 
     max_modify_lines = filter_settings.get("max_modify_lines", 70) if filter_settings else 70
     max_hunk_num = filter_settings.get("max_hunk_num", 7) if filter_settings else 7
     max_samples_total = filter_settings.get("max_samples_total", 10000) if filter_settings else 10000
     refit = filter_settings.get("refit", False) if filter_settings else False
-
-
-    ### Diff Filtering
-    data_list = read_jsonl(jsonl_path)
-    filtered_data = filter_by_modify_lines(data_list, max_modify_lines=max_modify_lines, max_hunk_num=max_hunk_num)
-    output_filename = f"{base_name}_diff_filtered.jsonl"
-    instruct_gen_dir = os.path.dirname(os.path.abspath(__file__))
-    output_dir = os.path.join(instruct_gen_dir, "data", "filtered")
+    incremental = filter_settings.get("incremental", False) if filter_settings else False
+    num_workers = filter_settings.get("num_workers", 1) if filter_settings else 1
+    diff_cache = filter_settings.get("diff_cache", False) if filter_settings else False
+    if diff_cache is True:
+        diff_cache = default_diff_cache_path()
+    hdp_cache_max_gb = filter_settings.get("hdp_cache_max_gb") if filter_settings else None
+    hdp_cache_max_bytes = int(hdp_cache_max_gb * 1024 ** 3) if hdp_cache_max_gb else DEFAULT_HDP_CACHE_MAX_BYTES
+    topic_backend = filter_settings.get("topic_backend", "hdp") if filter_settings else "hdp"
+    num_topics = filter_settings.get("num_topics", 50) if filter_settings else 50
+    dedup = filter_settings.get("dedup", False) if filter_settings else False
+    syntax_check = filter_settings.get("syntax_check", "keep") if filter_settings else "keep"
+    syntax_level = filter_settings.get("syntax_level", "fragment") if filter_settings else "fragment"
+    check_syntax_mode(syntax_check, syntax_level)
+    syntax_cache = filter_settings.get("syntax_cache", True) if filter_settings else True
+    if syntax_cache is True:
+        syntax_cache = default_syntax_cache_path()
+    check_topic_backend(topic_backend)
+    if incremental and topic_backend != "hdp":
+        log.warning(f"incremental only applies to the hdp topic backend; {topic_backend} is fitted from scratch")
+    extension = ".parquet" if is_parquet_path(jsonl_path) else ".jsonl"
+
+
+    output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "filtered")
     os.makedirs(output_dir, exist_ok=True)
-    diff_output_path = os.path.join(output_dir, output_filename)
-    write_jsonl(filtered_data, diff_output_path)
-
-    ### HDP Topic Filtering
-    output_filename = f"{base_name}_dt_filtered.jsonl"
-    output_path = os.path.join(output_dir, output_filename)
-
-    filter_data_by_hdp_topic_analysis(
-        jsonl_path=diff_output_path,
-        field_name=field_name,
-        data_format=data_format,
-        output_path=output_path,
-        max_samples_total=max_samples_total,
-        random_seed=random_seed,
-        refit=refit
-    )
-
-
-def read_jsonl(file_path):
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                data.append(json.loads(line))
-    return data
-
-def write_jsonl(data_list, file_path):
-    dir_name = os.path.dirname(file_path)
-    os.makedirs(dir_name, exist_ok=True)
-    with open(file_path, 'w', encoding='utf-8') as f:
-        for item in data_list:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    diff_output_path = os.path.join(output_dir, f"{base_name}_diff_filtered{extension}")
+    output_path = os.path.join(output_dir, f"{base_name}_dt_filtered{extension}")
+    hdp_base_name = os.path.splitext(os.path.basename(diff_output_path))[0]
+
+    # The diff-filtered documents are determined by the input content and the diff settings, so the HDP fit
+    # is cached under those (not under the file name) and can be looked up before the filtering pass.
+    preprocessor = HdpPreprocessor()
+    hdp_cache = hdp_cache_key = lineage_key = None
+    if topic_backend == "hdp":
+        hdp_cache = HdpFitCache(max_bytes=hdp_cache_max_bytes)
+        prefilter_id = {}
+        if dedup:
+            prefilter_id["dedup"] = DEDUP_KEY_VERSION.decode("ascii")
+        if syntax_check == "drop":
+            prefilter_id["syntax_check"] = syntax_check_id(syntax_level)
+        if incremental:
+            # An updated fit differs from a fit from scratch on the same data, so they are cached apart
+            prefilter_id["incremental"] = True
+        data_id = hdp_data_id(jsonl_path, field_name, data_format, max_modify_lines=max_modify_lines,
+                              max_hunk_num=max_hunk_num, diff_engine=DIFF_CACHE_VERSION.decode("ascii"), **prefilter_id)
+        hdp_cache_key = hdp_fit_key(data_id, preprocessor.settings(), random_seed)
+        if incremental:
+            # Successive versions of the same dataset (file name) under the same settings form a lineage
+            lineage_id = {**{k: v for k, v in data_id.items() if k != "content"}, "lineage": base_name}
+            lineage_key = hdp_fit_key(lineage_id, preprocessor.settings(), random_seed)
+
+    ### Diff Filtering (single streaming pass)
+    # Records are streamed once from the input: kept records are written to the diff-filtered file while
+    # their instructions are tokenized for HDP. Only the record locators and token lists stay in memory.
+    records = iter_records(jsonl_path)
+    if dedup:
+        # Exact duplicates are dropped first, so they cost neither a diff nor HDP tokenization
+        records = iter_deduplicated(records, tmp_dir=output_dir)
+    if syntax_check != "keep":
+        # Samples that do not parse are dropped (or flagged) before the diff analysis
+        records = iter_syntax_filtered(records, mode=syntax_check, level=syntax_level, num_workers=num_workers,
+                                       cache_path=syntax_cache or None)
+    kept_records = iter_filtered_by_modify_lines(records, max_modify_lines=max_modify_lines,
+                                                 max_hunk_num=max_hunk_num, num_workers=num_workers,
+                                                 cache_path=diff_cache or None)
+    processed_docs = instructions = None
+    needs_fit = hdp_cache_key is None or refit or not has_hdp_fit_results(hdp_cache_key, hdp_cache)
+    if needs_fit and lineage_key is not None:
+        # Incremental update: only the instructions are kept here, `load_or_update_hdp` tokenizes the unseen ones
+        instructions = []
+
+        def collect_instructions(records):
+            for record in records:
+                instructions.append(instruction_from_record(record, field_name, data_format))
+                yield record
+
+        kept_records = collect_instructions(kept_records)
+    elif needs_fit:
+        # Kept records are tokenized by worker processes a window ahead of the writer; `tee` only buffers
+        # the records between the two, so memory stays bounded by the tokenizer's look-ahead.
+        processed_docs = []
+        kept_records, text_source = tee(kept_records)
+        texts = (instruction_from_record(record, field_name, data_format) for record in text_source)
+        token_lists = preprocessor.imap(texts, num_workers=num_workers)
+
+        def tokenize_kept(records):
+            for record in records:
+                processed_docs.append(next(token_lists))
+                yield record
+            token_lists.close()
+
+        kept_records = tokenize_kept(kept_records)
+
+    locators = write_records(kept_records, diff_output_path)
+    log.info(f"Number of items after filtering by diff: {len(locators)}")
+
+    ### Topic Filtering
+    if random_seed is not None:
+        random.seed(random_seed)
+        np.random.seed(random_seed)
+    log.info(f"Total sample count set: {max_samples_total}")
+
+    if topic_backend == "hdp":
+        if instructions is not None:
+            hdp_model, _, corpus = load_or_update_hdp(hdp_cache_key, lineage_key, instructions, preprocessor,
+                                                      refit=refit, random_seed=random_seed, cache=hdp_cache,
+                                                      name=hdp_base_name, num_workers=num_workers)
+            instructions = None
+        else:
+            hdp_model, _, corpus = load_or_fit_hdp(hdp_cache_key, lambda: processed_docs, refit=refit,
+                                                   random_seed=random_seed, cache=hdp_cache, name=hdp_base_name)
+        if len(corpus) != len(locators):
+            raise ValueError(f"Cached HDP results {hdp_cache_key} cover {len(corpus)} documents, but {len(locators)} "
+                             f"samples passed the diff filter. Please set refit: true.")
+        processed_docs = None  # Token lists are no longer needed once the corpus is built
+        dominant_topics = assign_dominant_topics(hdp_model, corpus, num_workers=num_workers)
+    else:
+        dominant_topics = backend_dominant_topics(topic_backend, processed_docs, num_topics=num_topics,
+                                                  num_workers=num_workers, random_seed=random_seed)
+        processed_docs = None
+
+    selected_indices = sample_indices_by_topic(dominant_topics, max_samples_total=max_samples_total)
+
+    # Fetch only the selected records from the diff-filtered file by their locators
+    write_records(fetch_records(diff_output_path, [locators[idx] for idx in selected_indices]), output_path)
+    log.info(f"Filtered data saved to: {output_path}")
 
 
 if __name__ == "__main__":
@@ -1,88 +1,182 @@
 import json
-import random
+import hashlib
 import os
+from functools import partial
 from typing import Optional
+from tqdm import tqdm
+
+from utils.columnar_io import ParquetRowWriter, is_parquet_path
+from utils.parallel import imap_ordered
+from utils.sharded_writer import ShardedWriter, shard_output_dir
+from utils.triplet_record import iter_records
 
 SYSTEM_PROMPT = "You are a code editor. You will be provided the original code snippet and an instruction that specifies " \
 "the changes you need to make. You will produce the changed code, based on the original code and the instruction given. " \
 "Only produce the code, do not include any additional prose."
 
+PROMPT_FORMATS = ('alpaca', 'share_gpt')
+
+# Fields read from the input for prompt construction
+PROMPT_FIELDS = ["commit", "code_before_purify", "instruct_purify", "code_after_purify", "instr_type"]
 
-def generate_prompt(input_files, output_file, prompt_format='share_gpt', random_seed=None):
+
+def generate_prompt(input_files, output_file, prompt_format='share_gpt', random_seed=None, num_shards=None,
+                    max_records_per_shard=None, max_bytes_per_shard=None, extra_outputs=None, num_workers=None):
     """
-    Generates prompts for finetuning datasets from input files and writes them to an output file in JSONL format.
+    Generates prompts for finetuning datasets from input files and writes them to an output file in JSONL format
+    (or Parquet if it ends with `.parquet`).
+    If any of the shard options is set, the prompts are instead written as shards with a manifest (see
+    `utils.sharded_writer`) into the directory named after `output_file` without its extension.
+
+    The input is streamed and prompts are constructed by `num_workers` processes in bounded windows, so memory
+    does not grow with the dataset. Several formats are written in the same pass over the input through
+    `extra_outputs`, e.g. `[('alpaca', 'data/finetune/ft_alpaca.jsonl')]`.
     Args:
-        input_files (str): Path to the input file containing data to be processed.
+        input_files (str): Path to the input file (JSONL or Parquet) containing data to be processed.
         output_file (str): Path to the output file where the constructed prompts will be saved.
         prompt_format (str, optional): Format of the prompt to be constructed. Defaults to 'share_gpt'.
-        random_seed (int, optional): Random seed for reproducibility. If provided, sets the seed for random operations.
+        random_seed (int, optional): Random seed for reproducibility. The codeblock choice of each record is
+            derived from its commit, code, instruction and this seed, see `codeblock_choice`.
+        num_shards (int, optional): Number of output shards, assigned by the hash of the commit. Defaults to None.
+        max_records_per_shard (int, optional): Maximum number of prompts per shard file. Defaults to None.
+        max_bytes_per_shard (int, optional): Maximum size of a JSONL shard file in bytes. Defaults to None.
+        extra_outputs (list of tuple, optional): Further (prompt_format, output_file) pairs written in the same
+            pass, with the same shard options. Defaults to None.
+        num_workers (int, optional): Number of worker processes constructing prompts. Defaults to None (serial).
 
     Returns:
         None
 
     """
-    
+    outputs = [(prompt_format, output_file)] + list(extra_outputs or [])
+    for fmt, _ in outputs:
+        if fmt not in PROMPT_FORMATS:
+            raise ValueError("Invalid prompt_format. Choose either 'alpaca' or 'share_gpt'.")
+    prompt_formats = tuple(dict.fromkeys(fmt for fmt, _ in outputs))
+
+    if is_parquet_path(input_files):
+        # Only the columns used for prompt construction are read
+        lines = iter_records(input_files, fields=PROMPT_FIELDS)
+    else:
+        lines = _iter_jsonl_lines(input_files)
+
+    writers = []
+    try:
+        for _, path in outputs:
+            writers.append(open_prompt_writer(path, num_shards=num_shards, max_records_per_shard=max_records_per_shard,
+                                              max_bytes_per_shard=max_bytes_per_shard))
+        # Construct prompts from the sampled lines
+        constructed_data = iter_prompts(lines,
+                                        prompt_formats=prompt_formats,
+                                        random_seed=random_seed,
+                                        num_workers=num_workers,
+                                        code_before_field="code_before_purify",
+                                        instruct_field="instruct_purify",
+                                        code_after_field="code_after_purify"
+                                        )
+        for prompts in tqdm(constructed_data, desc="Constructing prompts", unit="records"):
+            for (fmt, _), writer in zip(outputs, writers):
+                writer.write(prompts[fmt])
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+    for writer in writers:
+        writer.close()
+
+
+def _iter_jsonl_lines(file_path):
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+class _JsonlWriter:
+    """Writes prompts to a JSONL file, one `json.dumps` line each."""
 
-    if random_seed is not None:
-        random.seed(random_seed)  # Set the random seed for reproducibility
+    def __init__(self, file_path):
+        self._file = open(file_path, 'w', encoding='utf-8')
 
+    def write(self, item):
+        self._file.write(json.dumps(item) + '\n')
+
+    def close(self):
+        self._file.close()
+
+    abort = close
+
+
+def open_prompt_writer(output_file, num_shards=None, max_records_per_shard=None, max_bytes_per_shard=None):
+    """
+    Opens a writer (with `write`, `close` and `abort`) for one prompt output: shards with a manifest if any
+    shard option is set, else a single Parquet file if `output_file` ends with `.parquet`, else a JSONL file.
+    """
     output_dir = os.path.dirname(os.path.abspath(output_file))
     if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir)
-        
-    with open(input_files, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        # Construct prompts from the sampled lines
-        constructed_data = construct_prompt(lines, 
-                                            prompt_format=prompt_format, 
-                                            code_before_field="code_before_purify",
-                                            instruct_field="instruct_purify",
-                                            code_after_field="code_after_purify"
-                                            )
 
-    # Write the constructed data to the output file in JSONL format
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for item in constructed_data:
-            f.write(json.dumps(item) + '\n')
+    if num_shards or max_records_per_shard or max_bytes_per_shard:
+        return ShardedWriter(shard_output_dir(output_file), num_shards=num_shards or 1,
+                             max_records=max_records_per_shard, max_bytes=max_bytes_per_shard,
+                             file_format="parquet" if is_parquet_path(output_file) else "jsonl", ensure_ascii=True)
+    if is_parquet_path(output_file):
+        return ParquetRowWriter(output_file)
+    return _JsonlWriter(output_file)
 
 
-def construct_prompt(input_lines, prompt_format='alpaca', **kwargs):
+def codeblock_choice(key, random_seed=None):
     """
-    Generate prompts from input JSON strings and return the constructed data.
+    Chooses whether the original code is wrapped in a ```python codeblock ('python') or left bare (None).
+
+    Each choice is equally likely, as with `random.choice(['python', None])`, but the choice is a function of
+    the record key (its commit and content) and `random_seed`, so it does not depend on the order in which records
+    are processed or on which worker process handles them, while records of the same commit still get independent
+    choices.
+    """
+    payload = str(key) if random_seed is None else f"{random_seed}:{key}"
+    digest = hashlib.blake2b(payload.encode('utf-8'), digest_size=8).digest()
+    return 'python' if digest[-1] & 1 == 0 else None
+
+
+def construct_prompt_formats(line, prompt_formats=('alpaca',), random_seed=None, **kwargs):
+    """
+    Constructs the prompt data of one input record in one or more formats.
 
     Args:
-        input_lines (list of str): List of JSON strings representing the input lines.
-        prompt_format (str): Format of the prompt, either 'alpaca' or 'share_gpt'.
+        line (str, bytes, dict or TripletRecord): A JSON line, or a decoded record.
+        prompt_formats (iterable of str, optional): Formats to construct. Defaults to ('alpaca',).
+        random_seed (int, optional): Seed of the codeblock choice, see `codeblock_choice`. Defaults to None.
         **kwargs: Additional fields mapping, such as 'code_before_field', 'instruct_field', and 'code_after_field'.
 
     Returns:
-        list of dict: A list of dictionaries containing the constructed prompt data.
+        dict: Prompt format -> the constructed prompt data.
     """
-    constructed_data = []
-    for line in input_lines:
-        data = json.loads(line)
-        commit = data.get('commit', '')
-        code_before = data.get(kwargs.get('code_before_field', 'code_before_purify'), '')
-        instruct = data.get(kwargs.get('instruct_field', 'instruct_purify'), '')
-        code_after = data.get(kwargs.get('code_after_field', 'code_after_purify'), '')
-        codeblock_choice = random.choice(['python', None])
-
-        # Check commit, if it is a list, join as a string
-        if isinstance(commit, list):
-            commit = ",".join(str(item) for item in commit)
-
-        prompt = edit_prompt(
-            old=code_before,
-            instr=instruct,
-            new="",  # The model will generate the new code
-            codeblock_before=codeblock_choice
-        )
+    data = json.loads(line) if isinstance(line, (str, bytes)) else line
+    commit = data.get('commit', '')
+    code_before = data.get(kwargs.get('code_before_field', 'code_before_purify'), '')
+    instruct = data.get(kwargs.get('instruct_field', 'instruct_purify'), '')
+    code_after = data.get(kwargs.get('code_after_field', 'code_after_purify'), '')
 
+    # Check commit, if it is a list, join as a string
+    if isinstance(commit, list):
+        commit = ",".join(str(item) for item in commit)
+
+    prompt = edit_prompt(
+        old=code_before,
+        instr=instruct,
+        new="",  # The model will generate the new code
+        codeblock_before=codeblock_choice(f"{commit}:{code_before}:{instruct}", random_seed)
+    )
+    response = build_response(code_after, codeblock_after="python")
+
+    prompts = {}
+    for prompt_format in prompt_formats:
         # Construct prompt data
         ft_data = format_prompt(
             system_prompt=SYSTEM_PROMPT,
             user_prompt=prompt,
-            response=build_response(code_after, codeblock_after="python"),
+            response=response,
             prompt_format=prompt_format,
             no_thinking_tag=kwargs.get('no_thinking_tag', False)  # Add tag to avoid thinking mode if specified
         )
@@ -90,9 +184,46 @@ def construct_prompt(input_lines, prompt_format='alpaca', **kwargs):
         ft_data['instr_type'] = data.get('instr_type', 'unknown')
         ft_data['old_code'] = code_before
         ft_data['new_code'] = code_after
-        constructed_data.append(ft_data)
+        prompts[prompt_format] = ft_data
+    return prompts
 
-    return constructed_data
+
+def iter_prompts(input_lines, prompt_formats=('alpaca',), random_seed=None, num_workers=None, chunk_size=64,
+                 **kwargs):
+    """
+    Lazily constructs the prompts of a stream of records with `construct_prompt_formats`, in input order.
+
+    Args:
+        input_lines (iterable of str, bytes or TripletRecord): JSON lines or decoded records; can be a generator.
+        prompt_formats (iterable of str, optional): Formats to construct. Defaults to ('alpaca',).
+        random_seed (int, optional): Seed of the codeblock choice. Defaults to None.
+        num_workers (int, optional): Number of worker processes (see `utils.parallel.imap_ordered`).
+            Defaults to None (serial).
+        chunk_size (int, optional): Number of records sent to a worker at a time. Defaults to 64.
+        **kwargs: Additional fields mapping, passed to `construct_prompt_formats`.
+
+    Yields:
+        dict: Prompt format -> the constructed prompt data, one per input record.
+    """
+    construct = partial(construct_prompt_formats, prompt_formats=tuple(prompt_formats), random_seed=random_seed,
+                        **kwargs)
+    yield from imap_ordered(construct, input_lines, num_workers=num_workers, chunk_size=chunk_size)
+
+
+def construct_prompt(input_lines, prompt_format='alpaca', **kwargs):
+    """
+    Generate prompts from input JSON strings and return the constructed data.
+
+    Args:
+        input_lines (iterable of str or TripletRecord): JSON strings representing the input lines, or decoded records.
+        prompt_format (str): Format of the prompt, either 'alpaca' or 'share_gpt'.
+        **kwargs: Additional fields mapping, such as 'code_before_field', 'instruct_field', and 'code_after_field',
+            and the `random_seed` and `num_workers` options of `iter_prompts`.
+
+    Returns:
+        list of dict: A list of dictionaries containing the constructed prompt data.
+    """
+    return [prompts[prompt_format] for prompts in iter_prompts(input_lines, prompt_formats=(prompt_format,), **kwargs)]
 
 
 def format_prompt(system_prompt, user_prompt, response, prompt_format='alpaca', no_thinking_tag=False):
@@ -179,9 +310,26 @@ if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Generate prompts from input JSONL file.")
-    parser.add_argument("input_file", type=str, help="Path to the input JSONL file.")
-    parser.add_argument("output_file", type=str, help="Path to the output JSONL file.")
+    parser.add_argument("input_file", type=str, help="Path to the input JSONL (or Parquet) file.")
+    parser.add_argument("output_file", type=str, help="Path to the output JSONL (or Parquet) file.")
     parser.add_argument("--prompt_format", type=str, choices=['alpaca', 'share_gpt'], default='share_gpt', help="Format of the prompt.")
+    parser.add_argument("--num_shards", type=int, default=None, help="Write the output as this many shards, assigned by commit hash.")
+    parser.add_argument("--max_records_per_shard", type=int, default=None, help="Maximum number of prompts per shard file.")
+    parser.add_argument("--max_bytes_per_shard", type=int, default=None, help="Maximum size of a shard file in bytes.")
+    parser.add_argument("--extra_output", type=str, action="append", default=[], metavar="FORMAT=PATH",
+                        help="Also write the prompts in FORMAT to PATH in the same pass, e.g. alpaca=data/finetune/ft_alpaca.jsonl. Can be repeated.")
+    parser.add_argument("--num_workers", type=int, default=None, help="Number of worker processes constructing prompts.")
+    parser.add_argument("--random_seed", type=int, default=None, help="Random seed of the per-record codeblock choice.")
     args = parser.parse_args()
 
-    generate_prompt(input_files=args.input_file, output_file=args.output_file, prompt_format=args.prompt_format)
\ No newline at end of file
+    extra_outputs = []
+    for spec in args.extra_output:
+        fmt, sep, path = spec.partition("=")
+        if not sep or fmt not in PROMPT_FORMATS or not path:
+            parser.error(f"--extra_output must be FORMAT=PATH with FORMAT in {PROMPT_FORMATS}, got: {spec}")
+        extra_outputs.append((fmt, path))
+
+    generate_prompt(input_files=args.input_file, output_file=args.output_file, prompt_format=args.prompt_format,
+                    random_seed=args.random_seed, num_shards=args.num_shards,
+                    max_records_per_shard=args.max_records_per_shard, max_bytes_per_shard=args.max_bytes_per_shard,
+                    extra_outputs=extra_outputs, num_workers=args.num_workers)
\ No newline at end of file
@@ -1,6 +1,7 @@
 from utils.purify_instruct_v2 import purify_instructions
 from utils.purify_code_v4 import purify_code_from_jsonl
 from utils.separate_instruct import separate_instruct
+from utils.columnar_io import is_parquet_path, convert_jsonl_to_parquet
 import os
 import json
 import argparse
@@ -27,7 +28,7 @@ def extract_instruct(input_file, output_file):
     2. Filters out entries with single-line code in specified fields.
     3. Purifies code segments by removing unwanted marks.
     4. Purifies instruction segments by removing unwanted marks.
-    5. Writes the processed data to the specified output file.
+    5. Writes the processed data to the specified output file (JSONL, or Parquet if it ends with `.parquet`).
     6. Cleans up temporary files created during processing.
     Args:
         input_file (str): Path to the input file containing model responses.
@@ -73,7 +74,18 @@ def extract_instruct(input_file, output_file):
     purify_code_from_jsonl(input_file=purify_temp_file_2, output_file=purify_temp_file_3, purify_fields=["code_before", "code_after"], keep_language_mark=False)
 
     # Purify instruction part
-    purify_instructions(input_file=purify_temp_file_3, output_file=output_file, purify_fields=["instruct_descriptive", "instruct_lazy"])
+    if is_parquet_path(output_file):
+        # Generate a fourth temporary file name for the JSONL result before columnar conversion
+        while True:
+            purify_temp_file_4 = f"{base_name}_{counter}{extension}"
+            if not os.path.exists(purify_temp_file_4):
+                break
+            counter += 1
+        purify_instructions(input_file=purify_temp_file_3, output_file=purify_temp_file_4, purify_fields=["instruct_descriptive", "instruct_lazy"])
+        convert_jsonl_to_parquet(purify_temp_file_4, output_file)
+        os.remove(purify_temp_file_4)
+    else:
+        purify_instructions(input_file=purify_temp_file_3, output_file=output_file, purify_fields=["instruct_descriptive", "instruct_lazy"])
 
     # Delete temporary files
     os.remove(purify_temp_file)
@@ -83,7 +95,7 @@ def extract_instruct(input_file, output_file):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Purify instructions and code from a JSONL file.")
     parser.add_argument("input_file", help="Path to the input JSONL file")
-    parser.add_argument("output_file", help="Path to the output JSONL file")
+    parser.add_argument("output_file", help="Path to the output JSONL file (use a .parquet extension for Parquet output)")
     args = parser.parse_args()
 
     extract_instruct(args.input_file, args.output_file)
@@ -1,6 +1,62 @@
+import os
 import json
-import random
 import yaml
+import numpy as np
+
+from utils.external_shuffle import external_shuffle
+from utils.sharded_writer import write_sharded
+from utils.triplet_record import fetch_records, record_locators, write_records
+
+# Fields read from each input file; the rest of a triplet is not needed for mixing
+MIX_FIELDS = [
+    "commit", "code_snippet", "code_before_purify", "code_after_purify",
+    "instruct_descriptive_purify", "instruct_lazy_purify",
+]
+
+
+def construct_entry(data, instr_type, model_name=None):
+    """
+    Constructs one data entry from a decoded record, as `construct_data` does for each line.
+
+    Args:
+        data (dict or TripletRecord): The decoded record.
+        instr_type (str): Type of instruction ('descriptive' or 'lazy').
+        model_name (str, optional): Name of the model to prefix the instruction type. Defaults to None.
+
+    Returns:
+        dict or None: The constructed entry, or None if the record has no instruction of this type.
+    """
+    if instr_type == 'descriptive':
+        instruction = data.get('instruct_descriptive_purify', '')
+    elif instr_type == 'lazy':
+        instruction = data.get('instruct_lazy_purify', '')
+    else:
+        raise ValueError("instr_type must be either 'descriptive' or 'lazy'")
+
+    if not instruction:
+        return None  # Skip if instruction is empty
+
+    commit = data.get('commit', '')
+    if isinstance(commit, list):
+        commit = ",".join(str(x) for x in commit)
+    code_snippet = data.get('code_snippet', '')
+    code_before = data.get('code_before_purify', '')
+    code_after = data.get('code_after_purify', '')
+
+    if model_name:
+        model_instr_type = f"{model_name}_{instr_type}"
+    else:
+        model_instr_type = f"unknown_{instr_type}"
+
+    return {
+        "commit": commit,
+        "code_snippet": code_snippet,
+        "code_before_purify": code_before,
+        "code_after_purify": code_after,
+        "instruct_purify": instruction,
+        "instr_type": model_instr_type
+    }
+
 
 def construct_data(input_lines, instr_type, model_name=None):
     """
@@ -8,7 +64,7 @@ def construct_data(input_lines, instr_type, model_name=None):
     Each entry contains commit info, code snippets, purified instructions, and type labels.
 
     Args:
-        input_lines (list[str]): List of JSONL lines to process.
+        input_lines (list[str] or list[TripletRecord]): List of JSONL lines (or already decoded records) to process.
         instr_type (str): Type of instruction ('descriptive' or 'lazy').
         model_name (str, optional): Name of the model to prefix the instruction type. Defaults to None.
 
@@ -17,60 +73,116 @@ def construct_data(input_lines, instr_type, model_name=None):
     """
     constructed_data = []
     for line in input_lines:
-        data = json.loads(line)
-        if instr_type == 'descriptive':
-            instruction = data.get('instruct_descriptive_purify', '')
-        elif instr_type == 'lazy':
-            instruction = data.get('instruct_lazy_purify', '')
-        else:
-            raise ValueError("instr_type must be either 'descriptive' or 'lazy'")
-
-        if not instruction:
-            continue  # Skip if instruction is empty
-
-        commit = data.get('commit', '')
-        if isinstance(commit, list):
-            commit = ",".join(str(x) for x in commit)
-        code_snippet = data.get('code_snippet', '')
-        code_before = data.get('code_before_purify', '')
-        code_after = data.get('code_after_purify', '')
-
-        if model_name:
-            model_instr_type = f"{model_name}_{instr_type}"
-        else:
-            model_instr_type = f"unknown_{instr_type}"
-
-        constructed_entry = {
-            "commit": commit,
-            "code_snippet": code_snippet,
-            "code_before_purify": code_before,
-            "code_after_purify": code_after,
-            "instruct_purify": instruction,
-            "instr_type": model_instr_type
-        }
-        constructed_data.append(constructed_entry)
+        data = json.loads(line) if isinstance(line, (str, bytes)) else line
+        entry = construct_entry(data, instr_type, model_name=model_name)
+        if entry is not None:
+            constructed_data.append(entry)
     return constructed_data
 
-def sample_and_mix(input_files, output_file, instr_types, model_names, ratios, total_samples, random_seed=None):
+
+def allocate_samples(ratios, total_samples):
+    """
+    Splits `total_samples` across inputs by `ratios` with the largest remainder method, so that the counts
+    sum to `total_samples` without rounding errors.
+    """
+    raw_counts = [r * total_samples for r in ratios]
+    samples_per_file = [int(count) for count in raw_counts]
+    remainder = total_samples - sum(samples_per_file)
+    # Allocate remaining samples according to the fractional part in descending order
+    if remainder > 0:
+        fractional_parts = [(i, raw_counts[i] - samples_per_file[i]) for i in range(len(raw_counts))]
+        fractional_parts.sort(key=lambda x: x[1], reverse=True)
+        for i in range(remainder):
+            samples_per_file[fractional_parts[i][0]] += 1
+    return samples_per_file
+
+
+def iter_sampled_entries(input_files, samples_per_file, instr_types, model_names, rng):
+    """
+    Samples records of each input by index and returns an iterator over their constructed entries.
+
+    Every distinct file is scanned once for its record locators, however many inputs list it (e.g. the
+    descriptive and lazy instructions of the same triplets). Each input draws its own sample of indices
+    without replacement; the selected records of a file are then fetched in one pass in file order, and
+    one entry is constructed per input that selected the record.
+
+    Args:
+        input_files (list[str]): Input JSONL (or Parquet) file per input.
+        samples_per_file (list[int]): Number of records to sample per input.
+        instr_types (list[str]): Instruction type per input.
+        model_names (list[str]): Model name per input.
+        rng (numpy.random.Generator): Random number generator for the sampling.
+
+    Returns:
+        iterator of dict: Constructed entries (see `construct_entry`), grouped by file.
+
+    Raises:
+        ValueError: If an input has fewer records than its sample count (before any record is read).
+    """
+    inputs_by_file = {}
+    for i, file in enumerate(input_files):
+        inputs_by_file.setdefault(file, []).append(i)
+
+    selections = {}
+    for file, inputs in inputs_by_file.items():
+        locators = record_locators(file)
+        for i in inputs:
+            if samples_per_file[i] > len(locators):
+                raise ValueError(f"Not enough data in {file} to sample {samples_per_file[i]} items.")
+        selections[file] = locators, {i: np.sort(rng.choice(len(locators), samples_per_file[i], replace=False))
+                                      for i in inputs}
+
+    def entries():
+        for file, (locators, sampled) in selections.items():
+            # Record index -> inputs that selected it
+            selected_by = {}
+            for i, indices in sampled.items():
+                for index in indices.tolist():
+                    selected_by.setdefault(index, []).append(i)
+            indices = sorted(selected_by)
+            records = fetch_records(file, (locators[index] for index in indices), fields=MIX_FIELDS)
+            for index, record in zip(indices, records):
+                for i in selected_by[index]:
+                    entry = construct_entry(record, instr_types[i], model_name=model_names[i])
+                    if entry is not None:
+                        yield entry
+
+    return entries()
+
+
+def sample_and_mix(input_files, output_file, instr_types, model_names, ratios, total_samples, random_seed=None,
+                   shuffle_buffer_size=100000, num_shards=None, max_records_per_shard=None, max_bytes_per_shard=None):
     """
     Samples and mixes data from multiple JSONL files according to specified ratios and configuration.
     Uses the largest remainder method for sample allocation, constructs unified data entries,
-    and writes the mixed dataset to an output file in JSONL format.
+    and writes the mixed dataset to an output file in JSONL format (or Parquet if it ends with `.parquet`).
+
+    Records are sampled by index (see `iter_sampled_entries`) and the entries are shuffled with an external
+    shuffle on their way to the output, so memory stays bounded by the record locators and one shuffle
+    bucket rather than by the sampled data. The output is reproducible for a given `random_seed`.
+
+    If `num_shards`, `max_records_per_shard` or `max_bytes_per_shard` is set, the output is written as shards
+    with a manifest (see `utils.sharded_writer`) into the directory named after `output_file` without its
+    extension, each entry assigned to a shard by the hash of its commit.
 
     Args:
-        input_files (list[str]): List of input JSONL file paths.
-        output_file (str): Path to the output JSONL file.
+        input_files (list[str]): List of input JSONL (or Parquet) file paths.
+        output_file (str): Path to the output JSONL or Parquet file.
         instr_types (list[str]): List of instruction types for each input file.
         model_names (list[str]): List of model names for each input file.
         ratios (list[float]): List of sampling ratios for each input file (must sum to 1).
         total_samples (int): Total number of samples to generate.
         random_seed (int, optional): Random seed for reproducibility. Defaults to None.
+        shuffle_buffer_size (int, optional): Number of entries shuffled in memory at a time; larger outputs
+            are shuffled through temporary files next to the output. Defaults to 100000.
+        num_shards (int, optional): Number of output shards. Defaults to None (a single output file).
+        max_records_per_shard (int, optional): Maximum number of entries per shard file. Defaults to None.
+        max_bytes_per_shard (int, optional): Maximum size of a JSONL shard file in bytes. Defaults to None.
 
     Raises:
         ValueError: If input configuration is invalid or not enough data to sample.
     """
-    if random_seed is not None:
-        random.seed(random_seed)  # Set the random seed for reproducibility
+    rng = np.random.default_rng(random_seed)
 
     if len(input_files) != len(ratios):
         raise ValueError("The number of input files must match the number of ratios.")
@@ -78,39 +190,21 @@ def sample_and_mix(input_files, output_file, instr_types, model_names, ratios, t
         raise ValueError("Ratios must sum to 1.")
 
     # Use the largest remainder method to allocate sample counts and avoid rounding errors
-    raw_counts = [r * total_samples for r in ratios]
-    samples_per_file = [int(count) for count in raw_counts]
-    remainder = total_samples - sum(samples_per_file)
-    # Allocate remaining samples according to the fractional part in descending order
-    if remainder > 0:
-        fractional_parts = [(i, raw_counts[i] - samples_per_file[i]) for i in range(len(raw_counts))]
-        fractional_parts.sort(key=lambda x: x[1], reverse=True)
-        for i in range(remainder):
-            samples_per_file[fractional_parts[i][0]] += 1
-
-    constructed_data = []
-    for file, num_samples, instr_type, model_name in zip(input_files, samples_per_file, instr_types, model_names):
-        with open(file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            if num_samples > len(lines):
-                raise ValueError(f"Not enough data in {file} to sample {num_samples} items.")
-            sampled_lines = random.sample(lines, num_samples)
-
-        constructed_data.extend(construct_data(sampled_lines, instr_type=instr_type, model_name=model_name))
+    samples_per_file = allocate_samples(ratios, total_samples)
 
-    # Unify the commit field to ensure it is a string
-    for item in constructed_data:
-        commit = item.get("commit")
-        if isinstance(commit, list):
-            item["commit"] = ",".join(str(x) for x in commit)
+    entries = iter_sampled_entries(input_files, samples_per_file, instr_types, model_names, rng)
 
     # Shuffle the constructed data
-    random.shuffle(constructed_data)
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    shuffled = external_shuffle(entries, rng, num_items=sum(samples_per_file), buffer_size=shuffle_buffer_size,
+                                tmp_dir=output_dir)
 
-    # Write the constructed data to the output file in JSONL format
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for item in constructed_data:
-            f.write(json.dumps(item) + '\n')
+    # Write the constructed data to the output file (or its shards) in JSONL (or Parquet) format
+    if num_shards or max_records_per_shard or max_bytes_per_shard:
+        write_sharded(shuffled, output_file, num_shards=num_shards, max_records=max_records_per_shard,
+                      max_bytes=max_bytes_per_shard, ensure_ascii=True)
+    else:
+        write_records(shuffled, output_file, ensure_ascii=True)
 
 if __name__ == "__main__":
     import argparse
@@ -128,5 +222,9 @@ if __name__ == "__main__":
         instr_types=config["instr_types"],
         model_names=config["model_names"],
         total_samples=config["total_samples"],
-        random_seed=config.get("random_seed", None)
+        random_seed=config.get("random_seed", None),
+        shuffle_buffer_size=config.get("shuffle_buffer_size", 100000),
+        num_shards=config.get("num_shards", None),
+        max_records_per_shard=config.get("max_records_per_shard", None),
+        max_bytes_per_shard=config.get("max_bytes_per_shard", None)
     )
\ No newline at end of file
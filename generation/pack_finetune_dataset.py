@@ -0,0 +1,194 @@
+import os
+import json
+import logging
+import tempfile
+from array import array
+from tqdm import tqdm
+
+from utils.columnar_io import is_parquet_path, iter_parquet_rows
+from utils.length_packing import (DEFAULT_BUCKET_BOUNDARIES, DEFAULT_BYTES_PER_TOKEN, PaddingEstimator,
+                                  bucket_index, bucket_name, load_token_counter, merge_padding_summaries,
+                                  pack_lengths, padding_savings, record_num_tokens)
+from utils.sharded_writer import SHARD_MANIFEST_NAME, ShardedWriter, iter_shard_records
+
+log = logging.getLogger(__name__)
+
+REPORT_NAME = "length_report.json"
+
+
+def iter_finetune_records(input_path):
+    """
+    Iterates over the records of a finetuning dataset: a JSONL or Parquet file from `generate_finetune_dataset.py`,
+    or a directory of shards with a manifest.
+    """
+    if os.path.isdir(input_path) and os.path.exists(os.path.join(input_path, SHARD_MANIFEST_NAME)):
+        yield from iter_shard_records(input_path)
+    elif is_parquet_path(input_path):
+        yield from iter_parquet_rows(input_path)
+    else:
+        with open(input_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def bucket_dataset(input_path, output_dir, count_tokens, boundaries=DEFAULT_BUCKET_BOUNDARIES, batch_size=8,
+                   num_shards=1, file_format="jsonl", length_field="num_tokens"):
+    """
+    Writes the records of a finetuning dataset into length buckets, with their token length in `length_field`.
+
+    Every bucket is a directory of shards with a manifest (see `utils.sharded_writer`) under `output_dir`, named
+    by `bucket_name`; records keep their input order within a bucket. Only non-empty buckets are written.
+
+    Args:
+        input_path (str): Finetuning dataset (JSONL, Parquet or sharded directory).
+        output_dir (str): Output directory.
+        count_tokens (callable): Token counter, see `load_token_counter`.
+        boundaries (sequence of int, optional): Ascending upper bounds of the buckets, in tokens; longer records
+            go to an extra last bucket. Defaults to (512, 1024, 2048, 4096, 8192).
+        batch_size (int, optional): Batch size assumed by the padding estimate. Defaults to 8.
+        num_shards (int, optional): Number of hash shards per bucket. Defaults to 1.
+        file_format (str, optional): "jsonl" or "parquet". Defaults to "jsonl".
+        length_field (str, optional): Field receiving the token length. Defaults to "num_tokens".
+
+    Returns:
+        dict: The padding report.
+    """
+    boundaries = sorted(boundaries)
+    baseline = PaddingEstimator(batch_size)
+    bucket_estimators = {}
+    writers = {}
+    try:
+        for record in tqdm(iter_finetune_records(input_path), desc="Bucketing records", unit="records"):
+            num_tokens = record_num_tokens(record, count_tokens)
+            record[length_field] = num_tokens
+            baseline.add(num_tokens)
+            index = bucket_index(num_tokens, boundaries)
+            if index not in writers:
+                writers[index] = ShardedWriter(os.path.join(output_dir, bucket_name(index, boundaries)),
+                                               num_shards=num_shards, file_format=file_format, ensure_ascii=True)
+                bucket_estimators[index] = PaddingEstimator(batch_size)
+            writers[index].write(record)
+            bucket_estimators[index].add(num_tokens)
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    for writer in writers.values():
+        writer.close()
+
+    buckets = []
+    for index in sorted(writers):
+        summary = bucket_estimators[index].summary()
+        buckets.append({"name": bucket_name(index, boundaries),
+                        "max_tokens": boundaries[index] if index < len(boundaries) else None,
+                        "num_records": summary["num_sequences"], "num_tokens": summary["num_tokens"]})
+    baseline_summary = baseline.summary()
+    bucketed_summary = merge_padding_summaries([estimator.summary() for estimator in bucket_estimators.values()])
+    return {"mode": "bucket", "tokenizer": count_tokens.name, "batch_size": batch_size,
+            "num_records": baseline_summary["num_sequences"], "num_tokens": baseline_summary["num_tokens"],
+            "baseline": baseline_summary, "bucketed": bucketed_summary,
+            **padding_savings(baseline_summary, bucketed_summary), "buckets": buckets}
+
+
+def pack_dataset(input_path, output_dir, count_tokens, context_size=4096, batch_size=8, num_shards=1,
+                 file_format="jsonl", length_field="num_tokens"):
+    """
+    Groups the records of a finetuning dataset into packs of at most `context_size` tokens (see `pack_lengths`)
+    and writes them pack by pack, with their token length in `length_field` and their pack in `pack_id`.
+
+    The records are first spooled, with their lengths, to a temporary file in `output_dir`, so only the lengths
+    and file offsets are kept in memory. The output is a directory of shards with a manifest (see
+    `utils.sharded_writer`), sharded by `pack_id` so a pack is never split across shards.
+
+    Args:
+        input_path (str): Finetuning dataset (JSONL, Parquet or sharded directory).
+        output_dir (str): Output directory.
+        count_tokens (callable): Token counter, see `load_token_counter`.
+        context_size (int, optional): Target number of tokens per pack. Defaults to 4096.
+        batch_size (int, optional): Batch size assumed by the padding estimate. Defaults to 8.
+        num_shards (int, optional): Number of hash shards. Defaults to 1.
+        file_format (str, optional): "jsonl" or "parquet". Defaults to "jsonl".
+        length_field (str, optional): Field receiving the token length. Defaults to "num_tokens".
+
+    Returns:
+        dict: The padding report.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    baseline = PaddingEstimator(batch_size)
+    packed = PaddingEstimator(batch_size)
+    lengths = array('q')
+    offsets = array('q')
+    with tempfile.TemporaryDirectory(dir=output_dir, prefix=".pack-") as spool_dir:
+        spool_path = os.path.join(spool_dir, "records.jsonl")
+        with open(spool_path, 'wb') as spool:
+            for record in tqdm(iter_finetune_records(input_path), desc="Counting tokens", unit="records"):
+                num_tokens = record_num_tokens(record, count_tokens)
+                record[length_field] = num_tokens
+                baseline.add(num_tokens)
+                lengths.append(num_tokens)
+                offsets.append(spool.tell())
+                spool.write((json.dumps(record) + '\n').encode('utf-8'))
+
+        packs = pack_lengths(lengths, context_size)
+        with ShardedWriter(output_dir, num_shards=num_shards, file_format=file_format, key_field="pack_id",
+                           ensure_ascii=True) as writer, open(spool_path, 'rb') as spool:
+            for pack_id, pack in enumerate(tqdm(packs, desc="Writing packs", unit="packs")):
+                for i in pack:
+                    spool.seek(offsets[i])
+                    record = json.loads(spool.readline())
+                    record["pack_id"] = pack_id
+                    writer.write(record)
+                packed.add(sum(lengths[i] for i in pack))
+
+    baseline_summary = baseline.summary()
+    packed_summary = packed.summary()
+    return {"mode": "pack", "tokenizer": count_tokens.name, "batch_size": batch_size,
+            "num_records": baseline_summary["num_sequences"], "num_tokens": baseline_summary["num_tokens"],
+            "baseline": baseline_summary, "packed": packed_summary,
+            **padding_savings(baseline_summary, packed_summary),
+            "packs": {"context_size": context_size, "num_packs": len(packs),
+                      "mean_fill": baseline_summary["num_tokens"] / (len(packs) * context_size) if packs else 0.0,
+                      "over_length_records": sum(1 for length in lengths if length > context_size)}}
+
+
+def write_report(report, output_dir):
+    """Writes the padding report to `length_report.json` in `output_dir` and logs its summary."""
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = os.path.join(output_dir, REPORT_NAME)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    baseline = report["baseline"]
+    optimized = report["bucketed" if report["mode"] == "bucket" else "packed"]
+    log.info(f"{report['num_records']} records, {report['num_tokens']} tokens ({report['tokenizer']})")
+    log.info(f"Estimated padding tokens: {baseline['padding_tokens']} unsorted -> {optimized['padding_tokens']} "
+             f"{report['mode']}ed ({report['padding_savings_ratio']:.1%} saved, batch size {report['batch_size']})")
+    log.info(f"Report saved to: {report_path}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description="Add token lengths to a finetuning dataset and write it as "
+                                                 "length buckets or sequence packs.")
+    parser.add_argument("input", type=str, help="Finetuning dataset: JSONL or Parquet file, or sharded directory.")
+    parser.add_argument("output_dir", type=str, help="Output directory.")
+    parser.add_argument("--mode", type=str, choices=["bucket", "pack"], default="bucket", help="Length buckets or sequence packs.")
+    parser.add_argument("--tokenizer", type=str, default=None, help="Local tokenizer.json or tokenizer directory. Defaults to a byte-based approximation.")
+    parser.add_argument("--bytes_per_token", type=float, default=DEFAULT_BYTES_PER_TOKEN, help="Bytes per token of the approximation.")
+    parser.add_argument("--boundaries", type=int, nargs="+", default=list(DEFAULT_BUCKET_BOUNDARIES), help="Upper bounds of the length buckets, in tokens.")
+    parser.add_argument("--context_size", type=int, default=4096, help="Target number of tokens per pack.")
+    parser.add_argument("--batch_size", type=int, default=8, help="Batch size assumed by the padding estimate.")
+    parser.add_argument("--num_shards", type=int, default=1, help="Number of hash shards (per bucket).")
+    parser.add_argument("--output_format", type=str, choices=["jsonl", "parquet"], default="jsonl", help="Format of the output shards.")
+    args = parser.parse_args()
+
+    count_tokens = load_token_counter(args.tokenizer, args.bytes_per_token)
+    if args.mode == "bucket":
+        report = bucket_dataset(args.input, args.output_dir, count_tokens, boundaries=args.boundaries,
+                                batch_size=args.batch_size, num_shards=args.num_shards, file_format=args.output_format)
+    else:
+        report = pack_dataset(args.input, args.output_dir, count_tokens, context_size=args.context_size,
+                              batch_size=args.batch_size, num_shards=args.num_shards, file_format=args.output_format)
+    write_report(report, args.output_dir)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules import each other as `utils.*`, relative to the generation directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
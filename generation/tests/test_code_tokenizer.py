@@ -0,0 +1,95 @@
+import glob
+import inspect
+import os
+import random
+
+import colorsys
+import pytest
+
+from utils.code_splitter import process_code_tokens
+from utils.code_tokenizer import python_code_tokens
+
+# Code where a token of the pygments lexer depends on more than the stdlib token it overlaps
+EDGE_CASES = [
+    # Operators next to numbers (colorsys: "[0.0...1.0]")
+    "range [0.0...1.0]", "x[0.0...1]", "0.0...1", "x = .5 + 1. - 1e-3j", "a[1:.5]", "x.1", "0x1f.real",
+    "1if x else 2", "0b12", "a @b", "a@b", "@property\ndef f(self): pass", "@ functools.wraps(f)", "x **= 2 // 3",
+    "a != b <> c", "f(*args, **kw) -> None", "x := 1", "a ... b", "!x", "a\\\n+ b",
+    # Malformed and nested f-strings
+    'f"{x"', 'f"{"', "f'{a!}'", "f'{a['b']}'", 'f"{"a"}"', 'f"{x!r:>{w}}"', 'f"{x:{y:{z}}}"', 'f"}"', 'f"{{}}"',
+    'f"{x=}"', 'f"{ x = }"', "rf'\\d{x}'", 'f"{lambda: 1}"', "f'{'", "f'{x!}", 'print(f"{x")', 'f"""{\nx\n}"""',
+    'f"{x}" f"{y"', 'f"{1:}"', "F'{x}'", "fr'{x}\\n'", 'f"{x:%Y-%m}"', 'f"\\N{DASH}{x}"',
+    # Strings the lexer may end elsewhere than the tokenizer
+    '"""a \\""" b"""', "x = '''a \\''' b'''", '"\\N{" + x + "}"', '"{a[" + b + "]}"', '"{:" ">3}"', "'{0[1]}'",
+    "'%(name)s %d %%' % d", "b'\\x00\\n'", "r'\\N'", "u'\\u00e9'", "'it''s'", "s = 'a\\\nb'",
+    # Docstrings: triple-quoted strings starting a line
+    'def f():\n    """Doc with "quotes" and \\n."""', '"""Module."""\nx = 1', 'x = 1; """not a docstring"""',
+    'import a,\n    """after a comma"""', "r'''raw\n'''", "f'''not a\ndocstring'''", "  b'''x'''",
+    # Statements that enter a lexer state
+    "from . import x", "from .2 import x", "from ..a.b import (c as d,\n e)", "import a.b as c, d",
+    "import a,\\\n    b", "raise X from None", "raise X from exc", "from x \\\n import y", "import os.path\n",
+    "def\\\n f(): pass", "def __init__(self): pass", "def(x)", "class A(B): pass", "class\n(", "x.def y",
+    "yield from x", "yield  from x", "yield fromage", "async def f(): await x",
+    # Soft keywords and builtins
+    "match x:\n    case [a, _]:\n        pass", "match = 1", "match.group(1)", "case = 2\n", "x.print(self)",
+    "print(x)", "obj.self", "__init__", "x.__class__",
+    # Not Python, or not tokenizable
+    "The quick brown fox jumps over the lazy dog.", 'print "hi"', "$x = 1;", "a ? b : c", "`x`", "x = 1\n\ty = 2",
+    "\ufeffx = 1", "x = 1\r\ny = 2\r", "s = 'unterminated", "é = 1", "naïve_name", "", "   ",
+]
+
+
+def stdlib_files(num_files, seed=0):
+    files = sorted(glob.glob(os.path.join(os.path.dirname(os.__file__), "*.py")))
+    return random.Random(seed).sample(files, min(num_files, len(files)))
+
+
+def windows(code, rng, num_windows):
+    lines = code.split("\n")
+    for _ in range(num_windows):
+        start = rng.randrange(len(lines))
+        yield "\n".join(lines[start:start + rng.randint(1, 40)])
+
+
+def mutated(code, rng, num_mutations):
+    for _ in range(num_mutations):
+        pos = rng.randrange(len(code) + 1)
+        if rng.random() < 0.5:
+            code = code[:pos] + rng.choice("'\"{}[]()\\.@:#0xj_ \n") + code[pos:]
+        else:
+            code = code[:pos] + code[pos + 1:]
+    return code
+
+
+def assert_same_tokens(code):
+    assert process_code_tokens(code, fast=True) == process_code_tokens(code, fast=False), repr(code)
+
+
+@pytest.mark.parametrize("code", EDGE_CASES)
+def test_edge_cases_match_pygments(code):
+    assert_same_tokens(code)
+
+
+def test_colorsys_matches_pygments():
+    source = inspect.getsource(colorsys)
+    assert python_code_tokens(source) is not None
+    assert_same_tokens(source)
+    rng = random.Random(0)
+    for window in windows(source, rng, 200):
+        assert_same_tokens(window)
+
+
+def test_stdlib_corpus_matches_pygments():
+    rng = random.Random(1)
+    docs = []
+    for path in stdlib_files(40):
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        docs.append(source)
+        for window in windows(source, rng, 10):
+            docs.append(window)
+            docs.append(mutated(window, rng, rng.randint(1, 3)))
+    for code in docs:
+        assert_same_tokens(code)
+    # Most of the corpus goes through the fast path
+    assert sum(python_code_tokens(code) is not None for code in docs) > 0.6 * len(docs)
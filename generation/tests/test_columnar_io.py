@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from utils.columnar_io import ABSENT_KEYS_COLUMN, convert_jsonl_to_parquet, fetch_parquet_rows, iter_parquet_rows
+from utils.triplet_record import iter_records, write_records
+
+ROWS = [
+    {"commit": "a1", "code_before": "x = 1", "code_after": "x = 2", "response_lazy": None},
+    {"commit": "b2", "code_before": "y = 1", "code_after": None, "instruct_lazy": "Fix y"},
+    {"commit": "c3", "code_before": "z = 1", "code_after": "z = 3"},
+    # A key first seen in a later row group, so the rows above are rewritten with it
+    {"commit": "d4", "code_before": None, "code_after": "w = 0", "sample_index": 7},
+    {"commit": "e5", "code_before": "v = 1", "code_after": "v = 2", "response_lazy": None, "sample_index": None},
+]
+
+
+def write_jsonl(rows, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+@pytest.mark.parametrize("row_group_size", [1, 2, 10])
+def test_jsonl_parquet_jsonl_round_trip_keeps_nulls(tmp_path, row_group_size):
+    jsonl_path, parquet_path, output_path = (str(tmp_path / name) for name in ("in.jsonl", "t.parquet", "out.jsonl"))
+    write_jsonl(ROWS, jsonl_path)
+    assert convert_jsonl_to_parquet(jsonl_path, parquet_path, row_group_size=row_group_size) == len(ROWS)
+
+    assert list(iter_parquet_rows(parquet_path)) == ROWS
+    assert list(fetch_parquet_rows(parquet_path, [0, 3, 4])) == [ROWS[0], ROWS[3], ROWS[4]]
+    assert list(iter_parquet_rows(parquet_path, columns=["commit", "response_lazy"])) == \
+        [{key: row[key] for key in ("commit", "response_lazy") if key in row} for row in ROWS]
+
+    write_records(iter_records(parquet_path), output_path)
+    expected = [record.to_dict() for record in iter_records(jsonl_path)]
+    with open(output_path, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == expected
+    assert expected[0]["response_lazy"] is None
+
+
+def test_uniform_rows_have_no_absent_keys_column(tmp_path):
+    import pyarrow.parquet as pq
+
+    jsonl_path, parquet_path = str(tmp_path / "in.jsonl"), str(tmp_path / "t.parquet")
+    write_jsonl([{"a": 1, "b": None}, {"a": None, "b": "x"}], jsonl_path)
+    convert_jsonl_to_parquet(jsonl_path, parquet_path, row_group_size=1)
+    assert ABSENT_KEYS_COLUMN not in pq.ParquetFile(parquet_path).schema_arrow.names
+    assert list(iter_parquet_rows(parquet_path)) == [{"a": 1, "b": None}, {"a": None, "b": "x"}]
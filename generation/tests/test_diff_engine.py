@@ -0,0 +1,108 @@
+import difflib
+import random
+
+import pytest
+
+from utils.diff_engine import diff_analysis
+
+
+def legacy_diff_analysis(old_code, new_code, context=3):
+    """The two-pass implementation that `diff_analysis` replaced: SequenceMatcher on strings plus a full unified_diff."""
+    old_lines = old_code.splitlines()
+    new_lines = new_code.splitlines()
+
+    opcodes = difflib.SequenceMatcher(None, old_lines, new_lines).get_opcodes()
+    modified = added = removed = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'replace':
+            modified += max(i2 - i1, j2 - j1)
+        elif tag == 'insert':
+            added += (j2 - j1)
+        elif tag == 'delete':
+            removed += (i2 - i1)
+
+    hunks = []
+    current_hunk = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal' and i2 - i1 > 2 * context:
+            if current_hunk:
+                hunks.append(current_hunk)
+                current_hunk = []
+            continue
+        current_hunk.append((tag, i1, i2, j1, j2))
+    if current_hunk:
+        hunks.append(current_hunk)
+
+    diff_lines = list(difflib.unified_diff(old_lines, new_lines, n=context))
+    hunk_count = sum(1 for line in diff_lines if line.startswith('@@'))
+
+    return {
+        'added': added,
+        'removed': removed,
+        'modified': modified,
+        'hunk_num': len(hunks),
+        'diff_hunk_num': hunk_count,
+    }
+
+
+LINES = "\n".join(f"line_{i} = {i}" for i in range(20))
+EDGE_CASES = [
+    ("", ""),
+    ("", "x = 1\n"),
+    ("x = 1\n", ""),
+    (LINES, LINES),
+    # A change on the first or last line
+    (LINES, LINES.replace("line_0 = 0", "line_0 = -1")),
+    (LINES, LINES.replace("line_19 = 19", "line_19 = -1")),
+    (LINES, "first = 1\n" + LINES),
+    (LINES, LINES + "\nlast = 1"),
+    (LINES, LINES.split("\n", 1)[1]),
+    (LINES, LINES.rsplit("\n", 1)[0]),
+    # Trailing newline only
+    (LINES, LINES + "\n"),
+    ("x = 1\ny = 2", "x = 1\ny = 2\n"),
+    ("x = 1\r\ny = 2\r\n", "x = 1\ny = 3\n"),
+    # Changes separated by equal runs around 2 * context
+    (LINES, LINES.replace("line_2 = 2", "a").replace("line_9 = 9", "b")),
+    (LINES, LINES.replace("line_2 = 2", "a").replace("line_8 = 8", "b")),
+    (LINES, LINES.replace("line_2 = 2", "a").replace("line_4 = 4", "b").replace("line_17 = 17", "c")),
+    ("\n\n\n", "\n\n"),
+]
+
+
+def random_pair(rng):
+    vocabulary = ["", "    pass", "    return x", "else:", "x += 1"] + [f"v_{i} = {i}" for i in range(rng.randint(1, 30))]
+    old_lines = [rng.choice(vocabulary) for _ in range(rng.randint(0, 60))]
+    new_lines = list(old_lines)
+    for _ in range(rng.randint(0, 6)):
+        pos = rng.randrange(len(new_lines) + 1)
+        op = rng.random()
+        if op < 0.3 and pos < len(new_lines):
+            del new_lines[pos]
+        elif op < 0.6:
+            new_lines.insert(pos, rng.choice(vocabulary + ["inserted"]))
+        elif pos < len(new_lines):
+            new_lines[pos] += "  # changed"
+    trailing = [rng.choice(["", "\n"]) for _ in range(2)]
+    return "\n".join(old_lines) + trailing[0], "\n".join(new_lines) + trailing[1]
+
+
+def assert_matches_legacy(old_code, new_code, context):
+    expected = legacy_diff_analysis(old_code, new_code, context=context)
+    assert diff_analysis(old_code, new_code, context=context) == expected, (old_code, new_code, context)
+    without_diff_hunks = dict(expected)
+    del without_diff_hunks['diff_hunk_num']
+    assert diff_analysis(old_code, new_code, context=context, count_diff_hunks=False) == without_diff_hunks
+
+
+@pytest.mark.parametrize("context", [0, 1, 3])
+@pytest.mark.parametrize("old_code, new_code", EDGE_CASES)
+def test_edge_cases_match_legacy(old_code, new_code, context):
+    assert_matches_legacy(old_code, new_code, context)
+
+
+@pytest.mark.parametrize("context", [0, 1, 3])
+def test_random_edits_match_legacy(context):
+    rng = random.Random(context)
+    for _ in range(2000):
+        assert_matches_legacy(*random_pair(rng), context)
@@ -0,0 +1,41 @@
+import pytest
+
+from utils.parallel import imap_ordered, imap_ordered_cached
+
+
+class DictCache:
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+        self.lookups = 0
+
+    def make_key(self, item):
+        return item
+
+    def get_many(self, keys):
+        self.lookups += 1
+        return {key: self.entries[key] for key in keys if key in self.entries}
+
+    def put_many(self, entries):
+        # A key missed in a window read ahead of an earlier window's `put_many` is computed and stored again
+        assert all(self.entries.get(key, value) == value for key, value in entries.items())
+        self.entries.update(entries)
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_imap_ordered_keeps_order(num_workers):
+    items = [str(i) * (i % 7) for i in range(500)]
+    assert list(imap_ordered(len, items, num_workers=num_workers, chunk_size=8, window_chunks=2)) == \
+        [len(item) for item in items]
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+@pytest.mark.parametrize("window_size", [1, 3, 64])
+def test_imap_ordered_cached_keeps_order(num_workers, window_size):
+    # Repeated items within and across windows, and runs of hits with no miss
+    items = ["x" * (i % 5) for i in range(40)] + ["hit"] * 10 + ["y" * i for i in range(20)]
+    cache = DictCache({"hit": 99, "xx": 42})
+    results = list(imap_ordered_cached(len, iter(items), cache, num_workers=num_workers, chunk_size=2,
+                                       window_size=window_size))
+    assert results == [cache.entries[item] for item in items]
+    assert cache.entries["xx"] == 42
+    assert cache.lookups == -(-len(items) // window_size)
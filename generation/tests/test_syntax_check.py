@@ -0,0 +1,52 @@
+import pytest
+
+from utils.syntax_check import SyntaxCheckCache, iter_syntax_checks, python_syntax_ok
+
+FRAGMENTS = [
+    "x = f(a, b)\nif x:\n    return 1",
+    "        return x\n    def g(self):\n        y = [i for i in range(3)]\n",
+    "key=lambda x: x[1], reverse=True)",
+    # Starting or ending inside a docstring
+    "    Returns the user's name.\n    \"\"\"\n    return self._name\n",
+    "    Returns the user's name.\n    '''\n    return self._name\n",
+    'def f():\n    """Returns the user\'s name\n',
+    "x = 'a' 'b' f\"{c}\" \"d\"",
+    "match x:\n    case [a, _]:\n        pass",
+    'y = f"{x!r:>{w}} {a.b}"',
+]
+
+NOT_PYTHON = [
+    "The quick brown fox jumps over the lazy dog.",
+    'print "hi"',
+    "$ pip install foo",
+    "x = 1 2",
+    "s = 'unterminated\nx = 1",
+    "Traceback (most recent call last):\n  File \"x.py\", line 1",
+]
+
+
+@pytest.mark.parametrize("code", FRAGMENTS)
+def test_fragments_pass(code):
+    assert python_syntax_ok(code, level="fragment")
+
+
+@pytest.mark.parametrize("code", NOT_PYTHON)
+def test_not_python_fails(code):
+    assert not python_syntax_ok(code, level="fragment")
+
+
+def test_module_level_requires_a_parse():
+    assert python_syntax_ok("def f():\n    return 1\n", level="module")
+    assert python_syntax_ok("    def f(self):\n        return 1\n", level="module")
+    assert not python_syntax_ok("        return x\n    def g(self):\n", level="module")
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_cached_checks_match_uncached(tmp_path, num_workers):
+    codes = (FRAGMENTS + NOT_PYTHON) * 3
+    expected = [python_syntax_ok(code) for code in codes]
+    with SyntaxCheckCache(str(tmp_path / "syntax.sqlite")) as cache:
+        assert list(iter_syntax_checks(codes, num_workers=num_workers, chunk_size=2, cache=cache)) == expected
+        assert len(cache.get_many([cache.make_key(code) for code in codes])) == len(set(codes))
+        # Second pass: every snippet is a hit
+        assert list(iter_syntax_checks(iter(codes), num_workers=num_workers, cache=cache)) == expected
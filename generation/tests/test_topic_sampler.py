@@ -0,0 +1,99 @@
+import random
+from collections import Counter
+
+import pytest
+
+from utils.topic_sampler import reservoir_sample_by_topic, sample_indices_by_topic, topic_quotas
+
+
+def legacy_topic_quotas(topic_counts, max_samples_total):
+    """The `while True` allocation loop that `topic_quotas` replaced, with the topic sizes in place of index lists."""
+    locked = {}
+    unlocked = dict(topic_counts)
+    while True:
+        n_unlocked = len(unlocked)
+        if n_unlocked == 0:
+            break
+        target_per_topic = (max_samples_total - sum(locked.values())) / n_unlocked
+        changed = False
+        for topic, count in list(unlocked.items()):
+            if count <= target_per_topic:
+                locked[topic] = count
+                del unlocked[topic]
+                changed = True
+        if not changed:
+            break
+
+    quota = (max_samples_total - sum(locked.values())) / len(unlocked)
+    topic_target_counts = dict(locked)
+    for topic in unlocked:
+        topic_target_counts[topic] = int(quota)
+    diff = max_samples_total - sum(topic_target_counts.values())
+    if diff != 0:
+        keys = list(unlocked.keys())
+        for i in range(abs(diff)):
+            topic_target_counts[keys[i % len(keys)]] += (1 if diff > 0 else -1)
+    return topic_target_counts
+
+
+def random_topic_counts(rng):
+    num_topics = rng.randint(1, 60)
+    shape = rng.choice(["uniform", "skewed", "ties"])
+    if shape == "uniform":
+        sizes = [rng.randint(1, 500) for _ in range(num_topics)]
+    elif shape == "skewed":
+        sizes = [max(1, int(rng.paretovariate(1.2) * 5)) for _ in range(num_topics)]
+    else:
+        sizes = [rng.choice([3, 7, 20, 20, 50]) for _ in range(num_topics)]
+    topics = rng.sample(range(-1, 1000), num_topics)  # -1: documents without a topic
+    return Counter(dict(zip(topics, sizes)))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_topic_quotas_match_legacy_loop(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        topic_counts = random_topic_counts(rng)
+        total = sum(topic_counts.values())
+        # The legacy loop divides by zero once the budget covers every topic, so limits stay below the total
+        max_samples_total = rng.randint(1, total - 1) if total > 1 else None
+        if max_samples_total is None:
+            continue
+        quotas = topic_quotas(topic_counts, max_samples_total)
+        legacy = legacy_topic_quotas(topic_counts, max_samples_total)
+        assert quotas == legacy
+        assert list(quotas) == list(topic_counts)
+        assert sum(quotas.values()) == max_samples_total
+
+
+def test_topic_quotas_keep_everything_within_budget():
+    topic_counts = Counter({0: 5, 1: 3, 2: 9})
+    assert topic_quotas(topic_counts, max_samples_total=17) == topic_counts
+    assert topic_quotas(topic_counts, max_samples_total=100) == topic_counts
+
+
+def test_topic_quotas_per_topic_cap():
+    topic_counts = Counter({0: 5, 1: 3, 2: 9})
+    assert topic_quotas(topic_counts, max_samples_per_topic=4) == {0: 4, 1: 3, 2: 4}
+    assert topic_quotas(topic_counts) == topic_counts
+
+
+def test_sample_indices_by_topic_meets_quotas():
+    rng = random.Random(0)
+    dominant_topics = [rng.choice([0, 0, 0, 1, 2, 2, -1]) for _ in range(2000)]
+    quotas = topic_quotas(Counter(dominant_topics), max_samples_total=300)
+    selected = sample_indices_by_topic(dominant_topics, max_samples_total=300, rng=random.Random(1))
+    assert selected == sorted(set(selected))
+    assert Counter(dominant_topics[i] for i in selected) == Counter(quotas)
+
+
+def test_reservoir_sample_is_uniform():
+    # Every document of a topic is selected with probability quota / topic size
+    doc_topics = [(doc_id, 0) for doc_id in range(20)]
+    counts = Counter()
+    rng = random.Random(3)
+    num_trials = 20000
+    for _ in range(num_trials):
+        counts.update(reservoir_sample_by_topic(doc_topics, {0: 5}, rng))
+    for doc_id in range(20):
+        assert abs(counts[doc_id] / num_trials - 0.25) < 0.02
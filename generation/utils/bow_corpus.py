@@ -0,0 +1,104 @@
+import os
+import numpy as np
+from array import array
+from tqdm import tqdm
+
+
+_ARRAY_FILES = {
+    "indptr": "indptr.npy",
+    "indices": "indices.npy",
+    "counts": "counts.npy",
+}
+
+
+class BowCorpus:
+    """
+    A bag-of-words corpus stored as three flat CSR arrays instead of a list of lists of tuples.
+
+    Document `i` holds the word IDs `indices[indptr[i]:indptr[i + 1]]` with the counts at the same positions
+    of `counts`, exactly as `Dictionary.doc2bow` returns them (sorted by word ID). Indexing or iterating
+    yields the usual `[(word_id, count), ...]` lists, so the object can be passed wherever gensim expects
+    a corpus, and `to_csr` gives the sparse document-term matrix without a per-document conversion.
+
+    Saved corpora are plain `.npy` files, loaded memory-mapped: a cached corpus costs no parsing and only
+    the pages that are read are brought into memory.
+
+    Usage:
+        corpus = BowCorpus.from_docs(processed_docs, dictionary)
+        corpus.save(dir_path)
+        corpus = BowCorpus.load(dir_path)
+        bow = corpus[0]
+    """
+
+    def __init__(self, indptr, indices, counts):
+        """
+        Args:
+            indptr (numpy.ndarray): Offsets of the documents, of length num_docs + 1.
+            indices (numpy.ndarray): Word IDs of all documents, concatenated.
+            counts (numpy.ndarray): Word counts, aligned with `indices`.
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+
+    @classmethod
+    def from_bows(cls, bows):
+        """Builds a corpus from bag-of-words documents (lists of (word_id, count))."""
+        lengths, indices, counts = array("q"), array("i"), array("i")
+        for bow in bows:
+            lengths.append(len(bow))
+            indices.extend(word_id for word_id, _ in bow)
+            counts.extend(count for _, count in bow)
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(np.frombuffer(lengths, dtype=np.int64), out=indptr[1:])
+        return cls(indptr, np.array(indices, dtype=np.int32), np.array(counts, dtype=np.int32))
+
+    @classmethod
+    def from_docs(cls, docs, dictionary, desc="Building HDP corpus"):
+        """Builds a corpus from token lists with `dictionary.doc2bow`."""
+        return cls.from_bows(dictionary.doc2bow(doc) for doc in tqdm(docs, desc=desc))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, idx):
+        idx = range(len(self))[idx]
+        start, end = self.indptr[idx], self.indptr[idx + 1]
+        return list(zip(self.indices[start:end].tolist(), self.counts[start:end].tolist()))
+
+    def __iter__(self):
+        indptr = self.indptr.tolist()
+        for start, end in zip(indptr[:-1], indptr[1:]):
+            yield list(zip(self.indices[start:end].tolist(), self.counts[start:end].tolist()))
+
+    def to_csr(self, num_terms):
+        """
+        Args:
+            num_terms (int): Number of terms (columns).
+        Returns:
+            scipy.sparse.csr_matrix: Matrix of shape (len(self), num_terms) holding the word counts.
+        """
+        from scipy.sparse import csr_matrix
+
+        return csr_matrix((self.counts.astype(np.float64), self.indices, self.indptr), shape=(len(self), num_terms))
+
+    def save(self, dir_path):
+        """Writes the arrays as `.npy` files into `dir_path`."""
+        os.makedirs(dir_path, exist_ok=True)
+        for name, file_name in _ARRAY_FILES.items():
+            np.save(os.path.join(dir_path, file_name), getattr(self, name))
+
+    @classmethod
+    def load(cls, dir_path, mmap=True):
+        """
+        Args:
+            dir_path (str): Directory written by `save`.
+            mmap (bool, optional): Memory-map the arrays instead of reading them. Defaults to True.
+        Returns:
+            BowCorpus: The loaded corpus.
+        """
+        mmap_mode = "r" if mmap else None
+        # np.asarray drops the memmap subclass, whose slicing is slower, but keeps the mapping
+        arrays = {name: np.asarray(np.load(os.path.join(dir_path, file_name), mmap_mode=mmap_mode))
+                  for name, file_name in _ARRAY_FILES.items()}
+        return cls(**arrays)
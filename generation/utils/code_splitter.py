@@ -1,22 +1,43 @@
 from pygments import lex
-from pygments.lexers import get_lexer_by_name
-from pygments.token import Token
+from functools import lru_cache
+from utils.code_tokenizer import NAME_TYPES, python_code_tokens, python_lexer
 import re
 
+_CAMEL_CASE_RE = re.compile('([a-z])([A-Z])')
+_CODE_SECTION_RE = re.compile(r'## Code Before:(.*?)## Instruction:', re.DOTALL)
+_INSTRUCTION_SECTION_RE = re.compile(r'## Instruction:(.*?)## Code After:', re.DOTALL)
+_CODE_FENCE_START_RE = re.compile(r"^```[a-zA-Z]*\n?")
+_CODE_FENCE_END_RE = re.compile(r"\n?```$")
+_WHITESPACE_RE = re.compile(r'\s+')
+_NON_WORD_RE = re.compile(r'[^\w]')
+
+
 def split_identifier(identifier):
     """
     Splits a given identifier into sub-tokens based on camelCase and snake_case conventions.
     This function handles identifiers that may be in camelCase (e.g., `myVariableName`)
     or snake_case (e.g., `my_variable_name`). It splits them into individual words.
     """
+    return list(_split_identifier(identifier))
+
+
+@lru_cache(maxsize=1 << 16)
+def _split_identifier(identifier):
     # Split camelCase and snake_case identifiers
-    parts = re.sub('([a-z])([A-Z])', r'\1 \2', identifier).split()
+    parts = _CAMEL_CASE_RE.sub(r'\1 \2', identifier).split()
     sub_parts = []
     for part in parts:
         sub_parts.extend(part.split('_'))
-    return [p for p in sub_parts if p]
+    return tuple(p for p in sub_parts if p)
+
 
-def process_code_tokens(code_str):
+@lru_cache(maxsize=1 << 16)
+def _identifier_tokens(identifier):
+    # Lowercased sub-tokens; identifiers repeat a lot across a corpus, so they are split once
+    return tuple(t.lower() for t in _split_identifier(identifier))
+
+
+def process_code_tokens(code_str, lexer=None, fast=True):
     """
     Tokenizes a given Python code string and processes the tokens.
     This function uses a Python lexer to tokenize the input code string. For each token:
@@ -24,31 +45,39 @@ def process_code_tokens(code_str):
     - All tokens are converted to lowercase.
     Args:
         code_str (str): The Python code as a string to be tokenized and processed.
+        lexer (pygments.lexer.Lexer, optional): Lexer to use. Defaults to the shared `python_lexer()`.
+        fast (bool, optional): Tokenize with the stdlib tokenizer (see `utils.code_tokenizer`), which gives the
+            same tokens as the shared Python lexer about twice as fast. Code it cannot handle, and any other
+            `lexer`, goes through pygments. Defaults to True.
     Returns:
         List[str]: A list of processed tokens, where identifiers are split into sub-tokens and all tokens are lowercase.
     """
 
-    lexer = get_lexer_by_name("python", stripall=True)
-    tokens = lex(code_str, lexer)
+    if lexer is None:
+        lexer = python_lexer()
+    tokens = python_code_tokens(code_str) if fast and lexer is python_lexer() else None
+    if tokens is None:
+        tokens = [(token_type in NAME_TYPES, token.strip()) for token_type, token in lex(code_str, lexer)]
 
     result_tokens = []
-    for token_type, token in tokens:
-        token = token.strip()
+    for is_name, token in tokens:
         if token:
-            if token_type in [Token.Name, Token.Name.Function, Token.Name.Variable]:
-                result_tokens.extend([t.lower() for t in split_identifier(token)])
+            if is_name:
+                result_tokens.extend(_identifier_tokens(token))
             else:
                 result_tokens.append(token.lower())
     return result_tokens
 
 
-def edit_instruction_splitter(instr: str, tokenize: bool = True) -> tuple:
+def edit_instruction_splitter(instr, tokenize: bool = True, lexer=None) -> tuple:
     """
     Splits an input string containing code and instruction sections, tokenizes each part, and returns the tokens.
     Args:
-        instr (str): The input string containing code and instruction sections, formatted with
-            '## Code Before:', '## Instruction:', and '## Code After:' delimiters.
+        instr (str or tuple): The input string containing code and instruction sections, formatted with
+            '## Code Before:', '## Instruction:', and '## Code After:' delimiters (e.g. a ShareGPT user message),
+            or the (code, instruction) pair itself (e.g. a `CodeInstruction`), which is used without parsing.
         tokenize (bool): If True, returns tokenized code and instruction; if False, returns raw strings.
+        lexer (pygments.lexer.Lexer, optional): Lexer passed to `process_code_tokens`.
     Returns:
         tuple: A tuple (code_tokens, instr_tokens) where:
             - code_tokens (list or str): Tokens from the code section if tokenize is True, else raw code string.
@@ -58,27 +87,79 @@ def edit_instruction_splitter(instr: str, tokenize: bool = True) -> tuple:
         - Code blocks wrapped in markdown (```) are stripped before tokenization.
     """
 
-    # Extract code section
-    code_match = re.search(r'## Code Before:(.*?)## Instruction:', instr, re.DOTALL)
-    instr_match = re.search(r'## Instruction:(.*?)## Code After:', instr, re.DOTALL)
-    code_str = code_match.group(1).strip() if code_match else ''
+    if isinstance(instr, tuple):
+        code_str, instr_str = str(instr[0]).strip(), str(instr[1]).strip()
+    else:
+        # Extract code section
+        code_match = _CODE_SECTION_RE.search(instr)
+        instr_match = _INSTRUCTION_SECTION_RE.search(instr)
+        code_str = code_match.group(1).strip() if code_match else ''
+        instr_str = instr_match.group(1).strip() if instr_match else ''
     # Remove markdown code block wrappers
     if code_str.startswith("```") and code_str.endswith("```"):
-        code_str = re.sub(r"^```[a-zA-Z]*\n?", "", code_str)
-        code_str = re.sub(r"\n?```$", "", code_str)
-        
-    instr_str = instr_match.group(1).strip() if instr_match else ''
+        code_str = _CODE_FENCE_START_RE.sub("", code_str)
+        code_str = _CODE_FENCE_END_RE.sub("", code_str)
 
     if tokenize is False:
         return code_str, instr_str
     
     # Tokenize code
-    code_tokens = process_code_tokens(code_str)
+    code_tokens = process_code_tokens(code_str, lexer=lexer)
 
     # Tokenize instruction, remove punctuation, and convert to lowercase
-    instr_word_list = re.split(r'\s+', instr_str)
-    instr_tokens = [re.sub(r'[^\w]', '', w).lower() for w in instr_word_list]
+    instr_word_list = _WHITESPACE_RE.split(instr_str)
+    instr_tokens = [_NON_WORD_RE.sub('', w).lower() for w in instr_word_list]
     instr_tokens = [w for w in instr_tokens if w]
 
     return code_tokens, instr_tokens
 
+
+
+def benchmark_process_code_tokens(code_strs):
+    """
+    Benchmarks `process_code_tokens` with the fast tokenizer against pygments alone, and checks that both
+    return the same tokens for every document.
+    Args:
+        code_strs (list of str): Python code documents.
+    Returns:
+        dict: Timings in seconds ("pygments", "fast"), the share of documents handled without the pygments
+            fallback ("fast_coverage") and the number of documents whose tokens differ ("mismatches").
+    """
+    import time
+
+    timings = {}
+    for name, fast in [("pygments", False), ("fast", True)]:
+        _identifier_tokens.cache_clear()
+        start = time.perf_counter()
+        results = [process_code_tokens(code_str, fast=fast) for code_str in code_strs]
+        timings[name] = time.perf_counter() - start
+        if not fast:
+            expected = results
+    timings["fast_coverage"] = sum(python_code_tokens(code_str) is not None for code_str in code_strs) / max(len(code_strs), 1)
+    timings["mismatches"] = sum(got != ref for got, ref in zip(results, expected))
+    return timings
+
+
+if __name__ == "__main__":
+    import os
+    import glob
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark process_code_tokens on Python source files.")
+    parser.add_argument("paths", nargs="*", default=[os.path.dirname(os.__file__)],
+                        help="Python files or directories (searched recursively). Defaults to the standard library")
+    parser.add_argument("--max_docs", type=int, default=2000, help="Maximum number of files to tokenize")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        files.extend(sorted(glob.glob(os.path.join(path, "**", "*.py"), recursive=True)) if os.path.isdir(path) else [path])
+    code_strs = []
+    for path in files[:args.max_docs]:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            code_strs.append(f.read())
+
+    results = benchmark_process_code_tokens(code_strs)
+    for name in ("pygments", "fast"):
+        print(f"{name}: {results[name]:.3f}s ({len(code_strs) / results[name]:.1f} docs/s)")
+    print(f"fast path coverage: {results['fast_coverage']:.1%}, mismatches: {results['mismatches']}")
@@ -0,0 +1,316 @@
+import io
+import re
+import tokenize
+from functools import lru_cache
+
+from pygments.lexers import get_lexer_by_name
+from pygments.token import Comment, Token
+
+
+# Token types that `process_code_tokens` splits into sub-tokens
+NAME_TYPES = (Token.Name, Token.Name.Function, Token.Name.Variable)
+
+_BOM = "\ufeff"
+# The tokenizer sees the code inside this many opening brackets, see `_significant_tokens`
+_WRAP_DEPTH = 16
+_FSTRING_START = getattr(tokenize, "FSTRING_START", None)  # Python 3.12+
+_FSTRING_END = getattr(tokenize, "FSTRING_END", None)
+_KEPT_TOKEN_TYPES = frozenset({tokenize.NAME, tokenize.NUMBER, tokenize.OP, tokenize.STRING, tokenize.COMMENT,
+                               _FSTRING_START, _FSTRING_END} - {None})
+
+# Names the lexer reads as the start of a statement (a lexer state) when whitespace follows them; their rules
+# consume `(?:\s|\\\s)+` after the keyword
+_STATEMENT_KEYWORDS = ("def", "class", "from", "import")
+_STATEMENT_GAP_RE = re.compile(r"(?:\s|\\\s)+")
+# Patterns of the lexer's "import" and "fromimport" states; names are ASCII only (others fall back)
+_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_IMPORT_AS_RE = re.compile(r"\s+as\s+")
+_IMPORT_COMMA_RE = re.compile(r"\s*,\s*")
+_FROM_IMPORT_RE = re.compile(r"\s+import\b")
+_FROM_NONE_RE = re.compile(r"None\b")
+_STRING_PREFIX_RE = re.compile(r"[A-Za-z]*")
+# Text and quote tokens of a string body without escapes, "%" or "{"
+_STRING_TEXT_RE = re.compile(r"[^'\"\n]+|['\"]")
+_DOCSTRING_PREFIXES = ("", "r", "u", "b", "rb", "br")
+# A "{" interpolation at the end of a string body that the lexer may read past the closing quote: an unclosed
+# "[" key, or a format spec whose fill character would be the quote
+_OPEN_INTERPOLATION_RE = re.compile(r"\{(?:\w+(?:\.\w+|\[[^\]]+\])*\[[^\]]*"
+                                    r"|(?:\w+(?:\.\w+|\[[^\]]+\])*)?(?:![sra])?:)\Z")
+
+
+@lru_cache(maxsize=None)
+def python_lexer():
+    """Return the Python lexer, built once per process (lexing does not mutate it, so it can be shared)."""
+    return get_lexer_by_name("python", stripall=True)
+
+
+@lru_cache(maxsize=1 << 16)
+def _lex_piece(piece, before="", after=""):
+    """
+    Lexes `piece` with pygments, between the context strings `before` and `after`. Returns the (is_name, text)
+    tokens of `piece`, or None if a token crosses its boundaries, or if `after` is given and the lexer does not
+    end in its root state (`after` then ends with a comment, which only the root state reads as one).
+    """
+    start, end = len(before), len(before) + len(piece)
+    tokens = []
+    last_type = None
+    for index, ttype, value in python_lexer().get_tokens_unprocessed(before + piece + after):
+        token_end = index + len(value)
+        if index < start < token_end or index < end < token_end:
+            return None
+        if start <= index < end:
+            value = value.strip()
+            if value:
+                tokens.append((ttype in NAME_TYPES, value))
+        last_type = ttype
+    if after and (last_type is None or last_type not in Comment):
+        return None
+    return tuple(tokens)
+
+
+def _preprocess(code_str):
+    # Same input normalization as the pygments lexer with stripall=True
+    if code_str.startswith(_BOM):
+        code_str = code_str[len(_BOM):]
+    return code_str.replace("\r\n", "\n").replace("\r", "\n").strip() + "\n"
+
+
+def _significant_tokens(text):
+    """
+    Tokenizes `text` with the stdlib tokenizer. Returns (type, string, start, end) tuples with character
+    offsets into `text`, without whitespace tokens, or None if the tokenizer cannot handle the code.
+    """
+    # Character offset of each line of `text` by row in the tokenizer, where row 1 is the opening brackets
+    # (the tokenizer splits lines on "\n" only)
+    line_starts = [0, 0, 0]
+    pos = text.find("\n")
+    while pos >= 0:
+        line_starts.append(pos + 1)
+        pos = text.find("\n", pos + 1)
+    last_row = len(line_starts) - 2
+
+    # The code is wrapped in brackets, so that the tokenizer treats it as one continued statement and does
+    # not check the indentation of snippets cut out of a larger file, which may also close a few brackets
+    # they did not open. Snippets it still rejects (e.g. closing more brackets) go through pygments.
+    tokens = []
+    try:
+        for tok_type, string, (start_row, start_col), (end_row, end_col), _ in \
+                tokenize.generate_tokens(io.StringIO("(" * _WRAP_DEPTH + "\n" + text + ")\n").readline):
+            if tok_type not in _KEPT_TOKEN_TYPES:
+                if tok_type == tokenize.ERRORTOKEN:
+                    return None
+                continue
+            if start_row == 1 or start_row > last_row:
+                continue  # the wrapping brackets
+            if end_row > last_row:
+                return None
+            tokens.append((tok_type, string, line_starts[start_row] + start_col, line_starts[end_row] + end_col))
+    except tokenize.TokenError as e:
+        # Unclosed brackets are only reported at the end of the input, after all tokens
+        if "statement" not in str(e.args[0]):
+            return None
+    except (SyntaxError, ValueError):
+        return None
+    if _FSTRING_START is not None:
+        tokens = _merge_fstrings(tokens, text)
+    return tokens
+
+
+def _merge_fstrings(tokens, text):
+    # Python 3.12+ splits f-strings into parts; they are lexed as a whole, like other string literals (None if
+    # one is left open)
+    merged, depth = [], 0
+    for tok in tokens:
+        if tok[0] == _FSTRING_START:
+            if depth == 0:
+                start = tok[2]
+            depth += 1
+        elif tok[0] == _FSTRING_END:
+            depth -= 1
+            if depth == 0:
+                merged.append((tokenize.STRING, text[start:tok[3]], start, tok[3]))
+        elif depth == 0:
+            merged.append(tok)
+    return merged if depth == 0 else None
+
+
+def _statement_tokens(text, keyword, pos, out):
+    """
+    Appends the tokens the lexer produces in the state entered by `keyword` ("def", "class", "from" or
+    "import" followed by whitespace at `pos`), and returns the position where the lexer is back in its root
+    state, or None if the statement is not lexed here.
+    """
+    m = _STATEMENT_GAP_RE.match(text, pos)
+    gap = m.group().strip()  # line continuations
+    if gap:
+        out.append((False, gap))
+    pos = m.end()
+    if keyword in ("def", "class"):
+        m = _NAME_RE.match(text, pos)
+        if m is None or not text[m.end()].isascii():
+            # Without a name, "def" goes back to the root state, "class" reads error tokens
+            return pos if keyword == "def" and m is None else None
+        tokens = _lex_piece(m.group(), f"({keyword} ")
+        if tokens is None:
+            return None
+        out.extend(tokens)
+        return m.end()
+
+    while True:
+        if keyword == "from":
+            m = _FROM_IMPORT_RE.match(text, pos) or _FROM_NONE_RE.match(text, pos)
+            if m is not None:
+                out.append((False, m.group().strip()))
+                return m.end()
+        else:
+            m = _IMPORT_AS_RE.match(text, pos)
+            if m is not None:
+                out.append((False, "as"))
+                pos = m.end()
+                continue
+        if text.startswith(".", pos):
+            out.append((False, "."))
+            pos += 1
+            continue
+        m = _NAME_RE.match(text, pos)
+        if m is not None:
+            if not text[m.end()].isascii():
+                return None
+            out.append((False, m.group()))
+            pos = m.end()
+            continue
+        if keyword == "import":
+            m = _IMPORT_COMMA_RE.match(text, pos)
+            if m is not None:
+                out.append((False, ","))
+                pos = m.end()
+                continue
+        return pos
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_"
+
+
+def _string_tokens(literal, at_line_start):
+    """The (is_name, text) tokens of a string literal, or None if the lexer may not end it in the same place."""
+    prefix = _STRING_PREFIX_RE.match(literal).group()
+    lower_prefix = prefix.lower()
+    quote = literal[len(prefix):len(prefix) + 3]
+    if quote not in ('"""', "'''"):
+        quote = quote[:1]
+    body = literal[len(prefix) + len(quote):len(literal) - len(quote)]
+    if at_line_start and len(quote) == 3 and lower_prefix in _DOCSTRING_PREFIXES:
+        # A triple-quoted string starting a line is lexed as a docstring: one token, up to the first closing
+        # quotes (escaped or not)
+        if literal.find(quote, len(prefix) + 3) != len(literal) - 3:
+            return None
+        return ((False, prefix),) * bool(prefix) + ((False, literal[len(prefix):]),)
+    if "f" not in lower_prefix and "\\" not in body and "%" not in body and "{" not in body:
+        # Text and quotes only, so both the lexer and the tokenizer end the literal at the first closing quotes
+        tokens = [(False, prefix)] if prefix else []
+        tokens.append((False, quote))
+        for part in _STRING_TEXT_RE.findall(body):
+            part = part.strip()
+            if part:
+                tokens.append((False, part))
+        tokens.append((False, quote))
+        return tokens
+    if "\\N" in literal and "r" not in lower_prefix and "b" not in lower_prefix:
+        return None  # The lexer's "\N{...}" escape may run past the closing quote
+    if "f" not in lower_prefix and _OPEN_INTERPOLATION_RE.search(body):
+        return None
+    # "(" keeps the literal off the beginning of a line
+    return _lex_piece(literal, "(", " #")
+
+
+def python_code_tokens(code_str):
+    """
+    Tokenizes Python code with the stdlib `tokenize` module, producing the tokens the pygments Python lexer
+    (with stripall=True) would produce.
+
+    The stdlib tokenizer finds the token boundaries, and each name, string literal and run of adjacent
+    operators and numbers is then lexed by pygments on its own (and cached), with just enough context to be
+    lexed as in the whole code: whether a name follows a ".", whether a string starts a line. String literals
+    without escapes, "%" or "{" are split directly, as the lexer does; the lexer states entered by "def",
+    "class", "from" and "import" are followed here. Code where a token may depend on more context than that
+    returns None instead: "match" and "case" soft keyword statements, non-ASCII names, a number directly
+    followed by a name, and string literals the lexer may not end where the tokenizer does.
+
+    Args:
+        code_str (str): Python code.
+    Returns:
+        list of (bool, str) or None: (is_name, text) per non-whitespace token, where `is_name` marks the tokens
+            the lexer tags as `Name`, `Name.Function` or `Name.Variable`; None if the code cannot be tokenized
+            this way (e.g. unterminated strings or non-Python characters), in which case pygments should be used.
+    """
+    text = _preprocess(code_str)
+    tokens = _significant_tokens(text)
+    if tokens is None:
+        return None
+
+    out = []
+    prev_end = 0
+    i, n = 0, len(tokens)
+    while i < n:
+        ttype, value, start, end = tokens[i]
+        # Between tokens there is only whitespace and line continuations, one "\\" token each
+        out.extend([(False, "\\")] * text.count("\\", prev_end, start))
+        i += 1
+
+        if ttype == tokenize.NAME:
+            if not value.isascii():
+                return None
+            line_start = text.rfind("\n", 0, start) + 1
+            if value in ("match", "case") and prev_end <= line_start and not text[line_start:start].strip(" \t"):
+                # Soft keyword, unless what follows on the line makes it a name
+                if not _lex_piece(text[start:text.find("\n", end) + 1])[0][0]:
+                    return None
+            if value == "yield" and text.startswith(" from", end) and not _is_word_char(text[end + 5]):
+                out.extend(_lex_piece("yield from", "("))
+                prev_end = tokens[i][3]
+                i += 1
+                continue
+            if value in _STATEMENT_KEYWORDS and _STATEMENT_GAP_RE.match(text, end):
+                out.append((False, value))
+                pos = _statement_tokens(text, value, end, out)
+                if pos is None:
+                    return None
+                # Skip the tokens the statement state has read; it must stop between two tokens
+                while i < n and tokens[i][3] <= pos:
+                    i += 1
+                if i < n and tokens[i][2] < pos:
+                    return None
+                prev_end = pos
+                continue
+            # Builtins are not tagged as such after a "."
+            piece = _lex_piece(value, "(." if text[start - 1:start] == "." else "(")
+        elif ttype in (tokenize.OP, tokenize.NUMBER):
+            # Adjacent operators and numbers are lexed as one run, e.g. "0.0...1" as "0.0", ".", ".", ".1"
+            while i < n and tokens[i][0] in (tokenize.OP, tokenize.NUMBER) and tokens[i][2] == end:
+                end = tokens[i][3]
+                i += 1
+            if i < n and tokens[i][2] == end and tokens[i][0] in (tokenize.NAME, tokenize.STRING):
+                if text[end - 1] == "@" and tokens[i][0] == tokenize.NAME and tokens[i][1].isascii():
+                    # Decorator (or matrix multiplication without a space): "@" and the name are one token
+                    end = tokens[i][3]
+                    i += 1
+                elif _is_word_char(text[end - 1]):
+                    return None  # e.g. "1if": number rules may read letters
+            piece = _lex_piece(text[start:end])
+        elif ttype == tokenize.STRING:
+            line_start = text.rfind("\n", 0, start) + 1
+            # A docstring is only lexed as such when the lexer reaches the beginning of its line
+            piece = _string_tokens(value, prev_end <= line_start and not text[line_start:start].strip())
+        else:
+            value = value.strip()
+            piece = ((False, value),) if value else ()
+        if piece is None:
+            return None
+        out.extend(piece)
+        prev_end = end
+    tail = text[prev_end:]
+    if tail.replace("\\", "").strip():
+        return None  # The tokenizer stopped early
+    out.extend([(False, "\\")] * tail.count("\\"))
+    return out
@@ -0,0 +1,256 @@
+import os
+
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+# Column listing, for each row that lacked some keys, the keys it lacked (null when it had them all). Only written
+# when some row lacks a key, so that the readers can tell a missing key from a null value.
+ABSENT_KEYS_COLUMN = "__absent_keys__"
+
+
+def is_parquet_path(file_path):
+    """Return True if the file path refers to a Parquet file (by extension)."""
+    return os.path.splitext(str(file_path))[1].lower() in PARQUET_EXTENSIONS
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet support requires pyarrow. Please run: pip install pyarrow")
+    return pa, pq
+
+
+def _table_rows(table):
+    """Yields the rows of a record batch or table as dicts, without the keys listed in `ABSENT_KEYS_COLUMN`."""
+    for row in table.to_pylist():
+        absent = row.pop(ABSENT_KEYS_COLUMN, None)
+        if absent:
+            for key in absent:
+                row.pop(key, None)
+        yield row
+
+
+def iter_parquet_rows(file_path, columns=None, batch_size=4096):
+    """
+    Stream rows of a Parquet file as dicts, one record batch at a time.
+
+    Only the requested columns are read from disk, and at most one record batch is decoded at a time,
+    so memory is bounded by `batch_size` rather than by the file size.
+
+    Args:
+        file_path (str): Path to the Parquet file.
+        columns (iterable of str, optional): Columns to read. Columns missing from the file are ignored.
+            Defaults to None (read all columns).
+        batch_size (int, optional): Number of rows per decoded batch. Defaults to 4096.
+
+    Yields:
+        dict: One row per record, with the keys it was written with (null values included).
+    """
+    _, pq = _import_pyarrow()
+    parquet_file = pq.ParquetFile(file_path)
+    if columns is not None:
+        available = set(parquet_file.schema_arrow.names)
+        columns = [c for c in columns if c in available and c != ABSENT_KEYS_COLUMN]
+        if ABSENT_KEYS_COLUMN in available:
+            columns.append(ABSENT_KEYS_COLUMN)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield from _table_rows(batch)
+
+
+def parquet_num_rows(file_path):
+    """Return the number of rows of a Parquet file, from its metadata (no data is read)."""
+    _, pq = _import_pyarrow()
+    return pq.ParquetFile(file_path).metadata.num_rows
+
+
+def fetch_parquet_rows(file_path, row_indices):
+    """
+    Read selected rows of a Parquet file by row index.
+
+    Only the row groups that contain at least one selected row are read.
+
+    Args:
+        file_path (str): Path to the Parquet file.
+        row_indices (iterable of int): Row indices to fetch, in ascending order.
+
+    Yields:
+        dict: The selected rows, in the order of `row_indices`, with the keys they were written with.
+    """
+    _, pq = _import_pyarrow()
+    parquet_file = pq.ParquetFile(file_path)
+    row_indices = list(row_indices)
+    pos = 0
+    group_start = 0
+    for group in range(parquet_file.num_row_groups):
+        group_end = group_start + parquet_file.metadata.row_group(group).num_rows
+        wanted = []
+        while pos < len(row_indices) and row_indices[pos] < group_end:
+            wanted.append(row_indices[pos] - group_start)
+            pos += 1
+        if wanted:
+            yield from _table_rows(parquet_file.read_row_group(group).take(wanted))
+        group_start = group_end
+        if pos >= len(row_indices):
+            break
+
+
+class ParquetRowWriter:
+    """
+    Incremental Parquet writer: rows (dicts) are added one at a time and written in row groups of
+    `row_group_size`, so several files can be filled side by side from one stream.
+
+    The schema is inferred from the rows, and keys missing from a row are stored as nulls and listed in the row's
+    `ABSENT_KEYS_COLUMN`, so that the readers drop them but keep the null values a row had. When a row group
+    brings a new key, or a type that is wider than the one written so far (e.g. values in a column that was
+    all nulls, or floats in an integer column), the rows already written are copied to a file with the
+    promoted schema, one row group at a time. A type that cannot be promoted (e.g. strings in an integer
+    column) raises ValueError naming the column. The file is created on the first flush (or on `close`).
+    """
+
+    def __init__(self, file_path, row_group_size=10000):
+        self.file_path = file_path
+        self.row_group_size = row_group_size
+        self.count = 0
+        self._pa, self._pq = _import_pyarrow()
+        self._writer = None
+        self._schema = None
+        self._batch = []
+
+    def write(self, row):
+        self._batch.append(row)
+        if len(self._batch) >= self.row_group_size:
+            self._flush()
+
+    def _batch_table(self):
+        """
+        Builds a table of the buffered rows, with a column for every key of any row (in order of first use), and
+        `ABSENT_KEYS_COLUMN` if a row lacks some of them.
+        """
+        names = [key for key in dict.fromkeys(key for row in self._batch for key in row) if key != ABSENT_KEYS_COLUMN]
+        columns = []
+        for name in names:
+            try:
+                columns.append(self._pa.array([row.get(name) for row in self._batch]))
+            except (self._pa.ArrowInvalid, self._pa.ArrowTypeError) as e:
+                raise ValueError(f"Column '{name}' of {self.file_path} has values of mixed types: {e}") from e
+        absent = [[name for name in names if name not in row] or None for row in self._batch]
+        if any(absent):
+            columns.append(self._pa.array(absent, type=self._pa.list_(self._pa.string())))
+            names.append(ABSENT_KEYS_COLUMN)
+        return self._pa.Table.from_arrays(columns, names=names)
+
+    def _conform(self, table, schema, row_group=None):
+        """Casts a table to `schema`, adding the missing columns as nulls that are listed as absent keys."""
+        missing = [name for name in schema.names if name not in table.column_names and name != ABSENT_KEYS_COLUMN]
+        if missing:
+            absent = (table.column(ABSENT_KEYS_COLUMN).to_pylist() if ABSENT_KEYS_COLUMN in table.column_names
+                      else [None] * len(table))
+            absent = self._pa.array([(keys or []) + missing for keys in absent], type=self._pa.list_(self._pa.string()))
+        columns = []
+        for schema_field in schema:
+            if schema_field.name == ABSENT_KEYS_COLUMN and missing:
+                columns.append(absent)
+                continue
+            if schema_field.name not in table.column_names:
+                columns.append(self._pa.nulls(len(table), type=schema_field.type))
+                continue
+            column = table.column(schema_field.name)
+            try:
+                columns.append(column.cast(schema_field.type))
+            except (self._pa.ArrowInvalid, self._pa.ArrowTypeError, self._pa.ArrowNotImplementedError) as e:
+                where = f" in row group {row_group}" if row_group is not None else ""
+                raise ValueError(f"Column '{schema_field.name}' of {self.file_path}{where} cannot be converted "
+                                 f"from {column.type} to {schema_field.type}: {e}") from e
+        return self._pa.Table.from_arrays(columns, schema=schema)
+
+    def _promote(self, schema):
+        """Rewrites the rows written so far with the promoted `schema`, and keeps writing with it."""
+        self._writer.close()
+        old_path = f"{self.file_path}.promote-old"
+        os.replace(self.file_path, old_path)
+        try:
+            self._writer = self._pq.ParquetWriter(self.file_path, schema)
+            self._schema = schema
+            old_file = self._pq.ParquetFile(old_path)
+            for group in range(old_file.num_row_groups):
+                table = self._conform(old_file.read_row_group(group), schema, row_group=group)
+                self._writer.write_table(table, row_group_size=self.row_group_size)
+            old_file.close()
+        finally:
+            os.remove(old_path)
+
+    def _flush(self):
+        table = self._batch_table()
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = self._pq.ParquetWriter(self.file_path, self._schema)
+        else:
+            schema = self._schema
+            if table.schema != schema:
+                try:
+                    schema = self._pa.unify_schemas([schema, table.schema], promote_options="permissive")
+                except (self._pa.ArrowInvalid, self._pa.ArrowTypeError) as e:
+                    raise ValueError(f"The rows of {self.file_path} do not fit one schema: {e}") from e
+            if ABSENT_KEYS_COLUMN not in schema.names and not set(schema.names) <= set(table.column_names):
+                # The rows of this group lack keys of earlier ones
+                schema = schema.append(self._pa.field(ABSENT_KEYS_COLUMN, self._pa.list_(self._pa.string())))
+            if schema != self._schema:
+                self._promote(schema)
+        self._writer.write_table(self._conform(table, self._schema), row_group_size=self.row_group_size)
+        self.count += len(self._batch)
+        self._batch = []
+
+    def close(self):
+        """Writes the remaining rows and closes the file. Returns the number of rows written."""
+        try:
+            if self._batch or self._writer is None:
+                self._flush()
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+        return self.count
+
+    def abort(self):
+        """Closes the file without writing the buffered rows, e.g. after an error."""
+        if self._writer is not None:
+            self._writer.close()
+
+
+def write_parquet(rows, file_path, row_group_size=10000):
+    """
+    Write rows (dicts) to a Parquet file in row groups of `row_group_size`.
+
+    The schema is inferred from the rows and promoted as new keys or wider types appear, and keys missing
+    from a row are stored as nulls (see `ParquetRowWriter`).
+
+    Args:
+        rows (iterable of dict): Rows to write.
+        file_path (str): Path to the output Parquet file.
+        row_group_size (int, optional): Number of rows per row group. Defaults to 10000.
+
+    Returns:
+        int: Number of rows written.
+    """
+    writer = ParquetRowWriter(file_path, row_group_size=row_group_size)
+    try:
+        for row in rows:
+            writer.write(row)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+def convert_jsonl_to_parquet(jsonl_path, parquet_path, row_group_size=10000):
+    """Convert a JSONL file to Parquet without loading it fully into memory."""
+    import json
+
+    def rows():
+        with open(jsonl_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    return write_parquet(rows(), parquet_path, row_group_size=row_group_size)
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import hashlib
+import logging
+import tempfile
+from itertools import islice
+
+
+log = logging.getLogger(__name__)
+
+# Bump when the normalization or the key layout changes
+DEDUP_KEY_VERSION = b"dedup-v1"
+
+# Fields of a triplet that identify it; a record without one of them counts it as empty. Mixed data carries
+# `instruct_purify`, extracted triplets the descriptive and lazy instructions.
+DEDUP_CODE_FIELDS = ("code_before_purify", "code_after_purify")
+DEDUP_INSTRUCTION_FIELDS = ("instruct_purify", "instruct_descriptive_purify", "instruct_lazy_purify")
+
+
+def normalize_code(code):
+    """Normalizes line endings, trailing whitespace of each line and leading/trailing blank lines. Indentation is kept."""
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+def normalize_instruction(text):
+    """Collapses every run of whitespace to a single space."""
+    return " ".join(text.split())
+
+
+def triplet_dedup_key(record):
+    """
+    Returns the 16-byte dedup key of a triplet: a hash of its whitespace-normalized `code_before_purify`,
+    instruction(s) and `code_after_purify`. Triplets that differ only in whitespace (or in fields outside the
+    key, such as the commit) get the same key.
+    """
+    before, after = (normalize_code(str(record.get(field) or "")) for field in DEDUP_CODE_FIELDS)
+    instructions = [normalize_instruction(str(record.get(field) or "")) for field in DEDUP_INSTRUCTION_FIELDS]
+    parts = [part.encode("utf-8", "surrogatepass") for part in (before, *instructions, after)]
+    # The part lengths are hashed first, so that the boundaries between fields are unambiguous
+    header = ",".join(str(len(part)) for part in parts).encode("ascii")
+    return hashlib.blake2b(header + b":" + b"".join(parts), digest_size=16, person=DEDUP_KEY_VERSION).digest()
+
+
+class DiskHashSet:
+    """
+    A set of fixed-size keys in a scratch SQLite file, for membership tests over more keys than fit in memory.
+
+    The file lives in a temporary directory (in `tmp_dir`) and is removed on `close`. Journaling and syncing are
+    disabled, since the contents do not need to survive a crash. Keys are added a batch at a time, so a whole
+    window of records costs one lookup query and one bulk insert.
+
+    Usage:
+        with DiskHashSet() as seen:
+            new_flags = seen.add_many(keys)
+    """
+
+    _MAX_QUERY_PARAMS = 500
+
+    def __init__(self, tmp_dir=None):
+        if tmp_dir:
+            os.makedirs(tmp_dir, exist_ok=True)
+        self._tmp = tempfile.TemporaryDirectory(dir=tmp_dir, prefix=".dedup-")
+        self._conn = sqlite3.connect(os.path.join(self._tmp.name, "keys.sqlite"))
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE keys (key BLOB PRIMARY KEY) WITHOUT ROWID")
+        self.size = 0
+
+    def add_many(self, keys):
+        """
+        Adds keys, in order.
+        Args:
+            keys (list of bytes): Keys to add.
+        Returns:
+            list of bool: For each key, True if it was neither in the set nor earlier in `keys`.
+        """
+        distinct = list(dict.fromkeys(keys))
+        known = set()
+        for start in range(0, len(distinct), self._MAX_QUERY_PARAMS):
+            batch = distinct[start:start + self._MAX_QUERY_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            known.update(row[0] for row in self._conn.execute(f"SELECT key FROM keys WHERE key IN ({placeholders})",
+                                                              batch))
+        new_keys = [key for key in distinct if key not in known]
+        self._conn.executemany("INSERT INTO keys VALUES (?)", ((key,) for key in new_keys))
+        self._conn.commit()
+        self.size += len(new_keys)
+
+        flags = []
+        pending = set(new_keys)
+        for key in keys:
+            flags.append(key in pending)
+            pending.discard(key)
+        return flags
+
+    def add(self, key):
+        """Adds a key. Returns True if it was not in the set yet."""
+        return self.add_many([key])[0]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._tmp.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def iter_deduplicated(records, key_fn=triplet_dedup_key, tmp_dir=None, stats=None, window_size=4096):
+    """
+    Streams records, dropping every record whose key was already seen, so only first occurrences are yielded,
+    in order. Seen keys are kept in a `DiskHashSet`, so memory does not grow with the number of records;
+    records are checked a window of `window_size` at a time.
+
+    Args:
+        records (iterable): Records (dict or TripletRecord); can be a generator.
+        key_fn (callable, optional): Record -> bytes key. Defaults to `triplet_dedup_key`.
+        tmp_dir (str, optional): Directory for the scratch key file. Defaults to the system temporary directory.
+        stats (dict, optional): Updated with the counts "seen" and "duplicates" as records are consumed.
+        window_size (int, optional): Number of records checked per batch. Defaults to 4096.
+
+    Yields:
+        The first occurrence of every distinct record.
+    """
+    stats = {} if stats is None else stats
+    stats.update(seen=0, duplicates=0)
+    iterator = iter(records)
+    with DiskHashSet(tmp_dir=tmp_dir) as keys:
+        while True:
+            window = list(islice(iterator, window_size))
+            if not window:
+                break
+            flags = keys.add_many([key_fn(record) for record in window])
+            stats["seen"] += len(window)
+            stats["duplicates"] += flags.count(False)
+            for record, is_new in zip(window, flags):
+                if is_new:
+                    yield record
+    log.info(f"Removed {stats['duplicates']} duplicate triplets of {stats['seen']}")
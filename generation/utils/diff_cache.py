@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import hashlib
+
+
+# Bump when `diff_analysis` changes the statistics it returns, so that stale entries are not reused
+DIFF_CACHE_VERSION = b"diff-v1"
+
+DIFF_STAT_FIELDS = ("added", "removed", "modified", "hunk_num", "diff_hunk_num")
+
+
+def default_diff_cache_path():
+    """Default location of the diff statistics cache, next to the HDP fit results."""
+    return os.path.join(os.path.dirname(__file__), "fit_results", "diff_stats_cache.sqlite")
+
+
+class DiffStatsCache:
+    """
+    A persistent SQLite cache mapping hash(code_before, code_after, context) to `diff_analysis` statistics.
+
+    Entries are looked up and inserted in batches, so a whole window of samples costs one query.
+    Because the thresholds are applied after the lookup, re-filtering with different
+    `max_modify_lines` / `max_hunk_num`, or re-plotting diff histograms, does not recompute any diff.
+
+    Usage:
+        with DiffStatsCache(path) as cache:
+            keys = [cache.make_key(old, new) for old, new in pairs]
+            found = cache.get_many(keys)
+            cache.put_many({key: stats, ...})
+    """
+
+    _MAX_QUERY_PARAMS = 500
+
+    def __init__(self, db_path=None, context=3):
+        self.db_path = db_path or default_diff_cache_path()
+        self.context = context
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS diff_stats ("
+            "key BLOB PRIMARY KEY, added INTEGER, removed INTEGER, modified INTEGER, "
+            "hunk_num INTEGER, diff_hunk_num INTEGER) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def make_key(self, old_code, new_code):
+        """Return the 16-byte content hash of a code pair (and the diff context)."""
+        h = hashlib.blake2b(digest_size=16, person=DIFF_CACHE_VERSION)
+        old_bytes = old_code.encode("utf-8", "surrogatepass")
+        h.update(f"{self.context}:{len(old_bytes)}:".encode("ascii"))
+        h.update(old_bytes)
+        h.update(new_code.encode("utf-8", "surrogatepass"))
+        return h.digest()
+
+    def get_many(self, keys):
+        """
+        Look up several keys at once.
+        Args:
+            keys (iterable of bytes): Keys from `make_key`.
+        Returns:
+            dict: key -> diff statistics dict, for the keys found in the cache.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for start in range(0, len(keys), self._MAX_QUERY_PARAMS):
+            batch = keys[start:start + self._MAX_QUERY_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, {', '.join(DIFF_STAT_FIELDS)} FROM diff_stats WHERE key IN ({placeholders})", batch
+            )
+            for row in rows:
+                found[row[0]] = dict(zip(DIFF_STAT_FIELDS, row[1:]))
+        return found
+
+    def put_many(self, entries):
+        """
+        Insert several entries at once.
+        Args:
+            entries (dict): key -> diff statistics dict (must contain all of `DIFF_STAT_FIELDS`).
+        """
+        if not entries:
+            return
+        self._conn.executemany(
+            f"INSERT OR REPLACE INTO diff_stats (key, {', '.join(DIFF_STAT_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?)",
+            [(key, *(stats[f] for f in DIFF_STAT_FIELDS)) for key, stats in entries.items()],
+        )
+        self._conn.commit()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM diff_stats").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,127 @@
+import difflib
+import random
+import time
+
+
+def _intern_lines(old_lines, new_lines):
+    """
+    Map each distinct line to a small integer ID, shared by both sides.
+    Matching integer sequences is cheaper than matching strings (hashing and equality checks no longer
+    touch line contents), and equal lines get equal IDs, so the diff is the same as on the raw lines.
+    """
+    line_ids = {}
+    old_ids = [line_ids.setdefault(line, len(line_ids)) for line in old_lines]
+    new_ids = [line_ids.setdefault(line, len(line_ids)) for line in new_lines]
+    return old_ids, new_ids
+
+
+def diff_analysis(old_code, new_code, context=3, count_diff_hunks=True):
+    """
+    Computes line-level diff statistics between two code strings.
+    A single `difflib.SequenceMatcher` pass (same autojunk behaviour as before) is run over
+    integer line IDs, and all counters are derived from one walk over its opcodes:
+    - added / removed / modified: inserted, deleted and replaced lines (a replace counts max of both sides).
+    - hunk_num: groups of opcodes split by equal runs longer than 2 * context.
+    - diff_hunk_num: number of `@@` hunks `difflib.unified_diff` would emit with the same context.
+      These are the hunks above that contain at least one change, so no second diff is needed.
+    Args:
+        old_code (str): Code before the edit.
+        new_code (str): Code after the edit.
+        context (int, optional): Number of context lines, as in `difflib.unified_diff`. Defaults to 3.
+        count_diff_hunks (bool, optional): If False, 'diff_hunk_num' is not computed or returned. Defaults to True.
+    Returns:
+        dict: {'added', 'removed', 'modified', 'hunk_num'} and, if requested, 'diff_hunk_num'.
+    """
+    old_ids, new_ids = _intern_lines(old_code.splitlines(), new_code.splitlines())
+    opcodes = difflib.SequenceMatcher(None, old_ids, new_ids).get_opcodes()
+
+    modified = added = removed = 0
+    hunk_num = diff_hunk_num = 0
+    in_hunk = hunk_has_change = False
+    max_equal_len = 2 * context
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            if i2 - i1 > max_equal_len:
+                # A long equal run closes the current hunk
+                if in_hunk:
+                    hunk_num += 1
+                    diff_hunk_num += hunk_has_change
+                in_hunk = hunk_has_change = False
+            else:
+                in_hunk = True
+            continue
+
+        in_hunk = hunk_has_change = True
+        if tag == 'replace':
+            modified += max(i2 - i1, j2 - j1)
+        elif tag == 'insert':
+            added += (j2 - j1)
+        elif tag == 'delete':
+            removed += (i2 - i1)
+
+    if in_hunk:
+        hunk_num += 1
+        diff_hunk_num += hunk_has_change
+
+    diff_stats = {
+        'added': added,
+        'removed': removed,
+        'modified': modified,
+        'hunk_num': hunk_num,
+    }
+    if count_diff_hunks:
+        diff_stats['diff_hunk_num'] = diff_hunk_num
+    return diff_stats
+
+
+def benchmark_diff_analysis(num_pairs=50, num_lines=2000, num_edits=40, random_seed=42):
+    """
+    Times `diff_analysis` on long synthetic files, with and without the unified-diff hunk count.
+    (Its equivalence with the previous two-pass implementation is tested in tests/test_diff_engine.py.)
+    Args:
+        num_pairs (int, optional): Number of (old, new) pairs. Defaults to 50.
+        num_lines (int, optional): Number of lines per file. Defaults to 2000.
+        num_edits (int, optional): Number of random line edits applied to each file. Defaults to 40.
+        random_seed (int, optional): Seed for generating the pairs. Defaults to 42.
+    Returns:
+        dict: Timings in seconds for the engine, and the engine without the unified-diff hunk count.
+    """
+    rng = random.Random(random_seed)
+    vocabulary = [f"    value_{i} = compute(value_{i - 1}, {i})" for i in range(num_lines // 4)]
+    vocabulary += ["", "    return result", "    pass", "else:", "    i += 1"]
+    pairs = []
+    for _ in range(num_pairs):
+        old_lines = [rng.choice(vocabulary) for _ in range(num_lines)]
+        new_lines = list(old_lines)
+        for _ in range(num_edits):
+            pos = rng.randrange(len(new_lines))
+            op = rng.random()
+            if op < 0.3:
+                del new_lines[pos]
+            elif op < 0.6:
+                new_lines.insert(pos, f"    inserted_{rng.random()}")
+            else:
+                new_lines[pos] += "  # changed"
+        pairs.append(("\n".join(old_lines), "\n".join(new_lines)))
+
+    timings = {}
+    for name, count_diff_hunks in [("engine", True), ("engine_no_diff_hunks", False)]:
+        start = time.perf_counter()
+        for old, new in pairs:
+            diff_analysis(old, new, count_diff_hunks=count_diff_hunks)
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark diff_analysis on long synthetic files.")
+    parser.add_argument("--num_pairs", type=int, default=50, help="Number of code pairs")
+    parser.add_argument("--num_lines", type=int, default=2000, help="Number of lines per file")
+    parser.add_argument("--num_edits", type=int, default=40, help="Number of edits per file")
+    args = parser.parse_args()
+
+    timings = benchmark_diff_analysis(args.num_pairs, args.num_lines, args.num_edits)
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds:.3f}s ({args.num_pairs / seconds:.1f} pairs/s)")
@@ -0,0 +1,175 @@
+import os
+import numpy as np
+
+
+# Metrics accumulated per sample: name -> function of a `diff_analysis` result
+DIFF_METRICS = {
+    "modified": lambda stats: stats["modified"] + stats["added"] + stats["removed"],
+    "hunk_num": lambda stats: stats["hunk_num"],
+}
+
+DEFAULT_DIFF_THRESHOLDS = {"modified": 70, "hunk_num": 7}
+
+_FLUSH_SIZE = 4096
+
+
+def default_filter_config_path():
+    """Default location of `filter_config.yaml`, next to `dt_filtering.py`."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), "filter_config.yaml")
+
+
+def diff_thresholds_from_config(config_path=None):
+    """
+    Reads the diff filtering thresholds (`max_modify_lines`, `max_hunk_num`) of a filter config.
+    Args:
+        config_path (str, optional): Path to the YAML config. Defaults to `filter_config.yaml`.
+    Returns:
+        dict: {"modified": max_modify_lines, "hunk_num": max_hunk_num}; values missing from the config (or a
+            missing config file) default to 70 and 7, as in `dt_filtering`.
+    """
+    import yaml
+
+    config_path = config_path or default_filter_config_path()
+    thresholds = dict(DEFAULT_DIFF_THRESHOLDS)
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            filter_settings = (yaml.safe_load(f) or {}).get("filter_settings") or {}
+        thresholds["modified"] = filter_settings.get("max_modify_lines", thresholds["modified"])
+        thresholds["hunk_num"] = filter_settings.get("max_hunk_num", thresholds["hunk_num"])
+    return thresholds
+
+
+class DiffStatsAccumulator:
+    """
+    Streaming aggregate of diff statistics (modified lines and hunk numbers per sample) in bounded memory.
+
+    Every metric is a small non-negative integer, so each one is kept as a histogram with one bin per value
+    (a numpy count array, grown as larger values arrive). Min, max, median and any quantile are therefore
+    exact, counts above a threshold are exact, and the histograms of any bin width are re-binned from it for
+    plotting. Memory depends on the largest value seen, not on the number of samples.
+
+    Accumulators of disjoint parts of a dataset (e.g. shards processed by different worker processes) are
+    combined with `merge`, which adds the counts; `to_dict` / `from_dict` give a JSON-serializable form to
+    pass partial results between processes or runs.
+
+    Usage:
+        acc = DiffStatsAccumulator(thresholds={"modified": 70, "hunk_num": 7})
+        for stats in iter_diff_stats(code_pairs):
+            acc.add(stats)
+        acc.merge(other_acc)
+        summary = acc.summary()
+    """
+
+    def __init__(self, thresholds=None):
+        """
+        Args:
+            thresholds (dict, optional): Metric -> threshold; `summary` reports how many samples are above it.
+                Defaults to `DEFAULT_DIFF_THRESHOLDS`.
+        """
+        self.thresholds = dict(DEFAULT_DIFF_THRESHOLDS if thresholds is None else thresholds)
+        self.value_counts = {metric: np.zeros(0, dtype=np.int64) for metric in DIFF_METRICS}
+        self._pending = {metric: [] for metric in DIFF_METRICS}
+
+    def add(self, diff_stats):
+        """Adds the statistics of one sample, as returned by `diff_analysis`."""
+        for metric, value_of in DIFF_METRICS.items():
+            self._pending[metric].append(value_of(diff_stats))
+        if len(self._pending["modified"]) >= _FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        # Values are buffered and counted per batch with one `bincount`
+        for metric, values in self._pending.items():
+            if values:
+                self._add_counts(metric, np.bincount(np.asarray(values, dtype=np.int64)))
+                values.clear()
+
+    def _add_counts(self, metric, counts):
+        current = self.value_counts[metric]
+        if len(counts) > len(current):
+            current, counts = counts.astype(np.int64), current
+        current[:len(counts)] += counts
+        self.value_counts[metric] = current
+
+    def merge(self, other):
+        """Adds the counts of another accumulator (of other samples) to this one. Returns self."""
+        self._flush()
+        other._flush()
+        for metric, counts in other.value_counts.items():
+            self._add_counts(metric, counts)
+        return self
+
+    @property
+    def total(self):
+        """Number of samples added."""
+        self._flush()
+        return int(self.value_counts["modified"].sum())
+
+    def quantile(self, metric, q):
+        """Exact `q`-quantile of a metric, interpolated between samples like `numpy.quantile`."""
+        self._flush()
+        counts = self.value_counts[metric]
+        total = int(counts.sum())
+        if total == 0:
+            raise ValueError("No samples have been added")
+        cumulative = np.cumsum(counts)
+        position = q * (total - 1)
+        lower, upper = int(np.floor(position)), int(np.ceil(position))
+        # Value of the sample at a rank: the first value whose cumulative count exceeds the rank
+        lower_value, upper_value = np.searchsorted(cumulative, [lower + 1, upper + 1])
+        return float(lower_value + (upper_value - lower_value) * (position - lower))
+
+    def count_above(self, metric, threshold):
+        """Number of samples whose metric is strictly greater than `threshold`."""
+        self._flush()
+        return int(self.value_counts[metric][int(threshold) + 1:].sum())
+
+    def histogram(self, metric, bin_width):
+        """
+        Re-bins a metric into bins of `bin_width` from 0, with the same edges and counts as
+        `numpy.histogram(values, bins=np.arange(0, max(values) + bin_width, bin_width))`.
+        Returns:
+            tuple: (counts, bin_edges) as numpy arrays.
+        """
+        self._flush()
+        counts = self.value_counts[metric]
+        nonzero = np.flatnonzero(counts)
+        max_value = int(nonzero[-1]) if len(nonzero) else 0
+        bin_edges = np.arange(0, max_value + bin_width, bin_width)
+        hist, bin_edges = np.histogram(np.arange(len(counts)), bins=bin_edges, weights=counts)
+        return hist.astype(np.int64), bin_edges
+
+    def summary(self):
+        """
+        Returns:
+            dict: Metric ("modified", "hunk_num") -> {"min", "max", "median", "gt{threshold}_count",
+                "gt{threshold}_ratio"}, the threshold keys only for metrics with a threshold.
+        """
+        total = self.total
+        if total == 0:
+            raise ValueError("No samples have been added")
+        result = {}
+        for metric in DIFF_METRICS:
+            nonzero = np.flatnonzero(self.value_counts[metric])
+            stats = {"min": int(nonzero[0]), "max": int(nonzero[-1]), "median": self.quantile(metric, 0.5)}
+            threshold = self.thresholds.get(metric)
+            if threshold is not None:
+                above = self.count_above(metric, threshold)
+                stats[f"gt{threshold}_count"] = above
+                stats[f"gt{threshold}_ratio"] = above / total
+            result[metric] = stats
+        return result
+
+    def to_dict(self):
+        """JSON-serializable state, e.g. to send a partial result from a worker process."""
+        self._flush()
+        return {"thresholds": self.thresholds,
+                "value_counts": {metric: counts.tolist() for metric, counts in self.value_counts.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuilds an accumulator from `to_dict` output."""
+        acc = cls(thresholds=data["thresholds"])
+        for metric, counts in data["value_counts"].items():
+            acc.value_counts[metric] = np.asarray(counts, dtype=np.int64)
+        return acc
@@ -0,0 +1,60 @@
+import os
+import math
+import pickle
+import tempfile
+import numpy as np
+
+
+def external_shuffle(items, rng, num_items, buffer_size=100000, tmp_dir=None, draw_size=4096):
+    """
+    Shuffles a stream of items in bounded memory.
+
+    Items are scattered into `ceil(num_items / buffer_size)` temporary bucket files, each item to a bucket
+    drawn uniformly at random; each bucket is then loaded, permuted in memory and yielded in turn. Scattering
+    uniformly and permuting every bucket uniformly gives a uniformly random permutation of the whole stream,
+    while at most one bucket (about `buffer_size` items) is held in memory. With a single bucket, nothing is
+    written to disk. The order depends only on the stream and the state of `rng`.
+
+    Args:
+        items (iterable): Picklable items to shuffle; can be a generator.
+        rng (numpy.random.Generator): Random number generator.
+        num_items (int): Expected number of items (an upper bound is fine), used to size the buckets.
+        buffer_size (int, optional): Target number of items per bucket. Defaults to 100000.
+        tmp_dir (str, optional): Directory for the bucket files. Defaults to the system temporary directory.
+        draw_size (int, optional): Number of bucket assignments drawn from `rng` at a time. Defaults to 4096.
+
+    Yields:
+        The items, in random order.
+    """
+    num_buckets = max(1, math.ceil(num_items / buffer_size))
+    if num_buckets == 1:
+        buffered = list(items)
+        for i in rng.permutation(len(buffered)):
+            yield buffered[i]
+        return
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir, prefix=".shuffle-") as bucket_dir:
+        paths = [os.path.join(bucket_dir, f"bucket_{b}.pkl") for b in range(num_buckets)]
+        files = [open(path, "wb") for path in paths]
+        try:
+            draws, pos = np.empty(0, dtype=np.int64), 0
+            for item in items:
+                if pos == len(draws):
+                    draws, pos = rng.integers(num_buckets, size=draw_size), 0
+                pickle.dump(item, files[draws[pos]], protocol=pickle.HIGHEST_PROTOCOL)
+                pos += 1
+        finally:
+            for f in files:
+                f.close()
+
+        for path in paths:
+            bucket = []
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        bucket.append(pickle.load(f))
+                    except EOFError:
+                        break
+            os.remove(path)
+            for i in rng.permutation(len(bucket)):
+                yield bucket[i]
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: manifest updates are not locked
+    fcntl = None
+
+
+log = logging.getLogger(__name__)
+
+# Bump when the layout of a cache entry changes, so that old entries are not reused
+HDP_CACHE_VERSION = "hdp-cache-v2"
+
+DEFAULT_HDP_CACHE_MAX_BYTES = 20 * 1024 ** 3
+
+_ENTRY_FILES = {
+    "hdp_model": "hdp_model.joblib",
+    "dictionary": "hdp_dictionary.joblib",
+    "corpus": "hdp_corpus",  # directory of a memory-mapped `BowCorpus`
+}
+# Optional: content hashes of the documents, used by incremental updates
+_DOC_HASHES_FILE = "hdp_doc_hashes.joblib"
+
+
+def default_hdp_cache_dir():
+    """Default location of the HDP fit cache, under `utils/fit_results`."""
+    return os.path.join(os.path.dirname(__file__), "fit_results", "hdp_cache")
+
+
+def file_content_hash(file_path, chunk_size=1 << 20):
+    """Return the hex blake2b digest of a file's content, read in chunks."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _settings_hash(settings):
+    # Canonical JSON, so that dict ordering does not change the hash
+    payload = json.dumps(settings, sort_keys=True, ensure_ascii=True, default=str)
+    return hashlib.blake2b(payload.encode("ascii"), digest_size=16).hexdigest()
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+@contextmanager
+def _file_lock(lock_path):
+    # Exclusive advisory lock held for the duration of the block, so that concurrent runs serialize on it
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _atomic_write_json(data, file_path):
+    # Write to a temporary file in the same directory, then rename over the target
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=".tmp-", suffix=".json")
+    try:
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class HdpFitCache:
+    """
+    A content-addressed cache of HDP fit results (model, dictionary and bag-of-words corpus).
+
+    An entry is keyed by a hash of what the fit depends on: the input data (file content hash and the fields
+    read from it), the preprocessing settings and the HDP parameters. A changed file therefore misses the
+    cache instead of reusing a stale model, and the same data under another file name hits it.
+
+    Layout:
+        {cache_dir}/manifest.json    key -> {name, size, created, last_used, num_docs, ...}
+        {cache_dir}/{key}/           hdp_model.joblib, hdp_dictionary.joblib, hdp_corpus/ (CSR `.npy` arrays)
+                                     and, for incremental fits, hdp_doc_hashes.joblib
+
+    The corpus is loaded memory-mapped (see `BowCorpus`), so a cached run neither rebuilds it with
+    `doc2bow` nor holds it as Python objects.
+
+    Entries are written to a temporary directory and renamed into place, and the manifest is replaced
+    atomically, so an interrupted run never leaves a partial entry behind. Every read-modify-write of the
+    manifest holds a lock on `{cache_dir}/.manifest.lock`, so concurrent runs do not lose each other's
+    entries. When the total size exceeds `max_bytes`, the least recently used entries are evicted; entry
+    directories missing from the manifest (e.g. after a lost manifest) are counted too.
+
+    Usage:
+        cache = HdpFitCache()
+        key = cache.make_key(data_id, preprocess_settings, hdp_params)
+        fit = cache.load(key)
+        if fit is None:
+            cache.save(key, hdp_model, dictionary, corpus, name=base_name)
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_HDP_CACHE_MAX_BYTES):
+        """
+        Args:
+            cache_dir (str, optional): Cache directory. Defaults to `utils/fit_results/hdp_cache`.
+            max_bytes (int, optional): Disk budget of the cache; None disables eviction. Defaults to 20 GiB.
+        """
+        self.cache_dir = cache_dir or default_hdp_cache_dir()
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(self.cache_dir, "manifest.json")
+        self.lock_path = os.path.join(self.cache_dir, ".manifest.lock")
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(data_id, preprocess_settings, hdp_params):
+        """
+        Args:
+            data_id (dict): Identifies the documents, e.g. {"content": file_content_hash(path), "field_name": ...}.
+            preprocess_settings (dict): Preprocessing settings (see `HdpPreprocessor.settings`).
+            hdp_params (dict): Parameters passed to `HdpModel`, plus anything else the fit depends on.
+        Returns:
+            str: Hex cache key.
+        """
+        return _settings_hash({
+            "version": HDP_CACHE_VERSION,
+            "data": data_id,
+            "preprocess": preprocess_settings,
+            "hdp": hdp_params,
+        })
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            log.warning(f"Unreadable HDP cache manifest, starting a new one: {self.manifest_path}")
+            return {}
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _entry_complete(self, key):
+        entry_dir = self._entry_dir(key)
+        return all(os.path.exists(os.path.join(entry_dir, name)) for name in _ENTRY_FILES.values())
+
+    def __contains__(self, key):
+        return key in self._read_manifest() and self._entry_complete(key)
+
+    def load(self, key, load_corpus=True):
+        """
+        Load a cached fit and mark it as recently used.
+        Args:
+            key (str): Cache key from `make_key`.
+            load_corpus (bool, optional): Whether to load the corpus too. Defaults to True.
+        Returns:
+            tuple or None: (hdp_model, dictionary, corpus), or None on a cache miss. `corpus` is a memory-mapped
+                `BowCorpus`, or None if not requested.
+        """
+        import joblib
+        from utils.bow_corpus import BowCorpus
+
+        manifest = self._read_manifest()
+        if key not in manifest or not self._entry_complete(key):
+            return None
+        # Read before loading: another process may evict the entry from the manifest once its files are loaded
+        name = manifest[key].get("name")
+        entry_dir = self._entry_dir(key)
+        hdp_model = joblib.load(os.path.join(entry_dir, _ENTRY_FILES["hdp_model"]))
+        dictionary = joblib.load(os.path.join(entry_dir, _ENTRY_FILES["dictionary"]))
+        corpus = None
+        if load_corpus:
+            corpus = BowCorpus.load(os.path.join(entry_dir, _ENTRY_FILES["corpus"]))
+
+        with _file_lock(self.lock_path):
+            manifest = self._read_manifest()
+            if key in manifest:
+                manifest[key]["last_used"] = time.time()
+                _atomic_write_json(manifest, self.manifest_path)
+        log.info(f"Loaded cached HDP fit {key} ({name}) from {entry_dir}")
+        return hdp_model, dictionary, corpus
+
+    def save(self, key, hdp_model, dictionary, corpus, name=None, info=None, doc_hashes=None, lineage=None):
+        """
+        Store a fit under `key`, then evict least recently used entries beyond the disk budget.
+        Args:
+            key (str): Cache key from `make_key`.
+            hdp_model (HdpModel): Fitted model.
+            dictionary (gensim.corpora.Dictionary): Dictionary of the fit.
+            corpus (BowCorpus): Bag-of-words corpus of the fit.
+            name (str, optional): Human readable name of the dataset, recorded in the manifest.
+            info (dict, optional): Extra JSON-serializable metadata recorded in the manifest.
+            doc_hashes (list of bytes, optional): Content hash of each document, for incremental updates.
+            lineage (str, optional): Lineage key (see `latest_in_lineage`) recorded in the manifest.
+        Returns:
+            str: The entry directory.
+        """
+        import joblib
+
+        entry_dir = self._entry_dir(key)
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            os.chmod(tmp_dir, 0o755)
+            joblib.dump(hdp_model, os.path.join(tmp_dir, _ENTRY_FILES["hdp_model"]))
+            joblib.dump(dictionary, os.path.join(tmp_dir, _ENTRY_FILES["dictionary"]))
+            corpus.save(os.path.join(tmp_dir, _ENTRY_FILES["corpus"]))
+            if doc_hashes is not None:
+                joblib.dump(doc_hashes, os.path.join(tmp_dir, _DOC_HASHES_FILE))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        with _file_lock(self.lock_path):
+            try:
+                if os.path.exists(entry_dir):
+                    shutil.rmtree(entry_dir)
+                os.replace(tmp_dir, entry_dir)
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+            now = time.time()
+            manifest = self._read_manifest()
+            manifest[key] = {
+                "name": name,
+                "size": _dir_size(entry_dir),
+                "created": now,
+                "last_used": now,
+                "num_docs": len(corpus),
+                "lineage": lineage,
+                **(info or {}),
+            }
+            self._evict(manifest, keep=key)
+            _atomic_write_json(manifest, self.manifest_path)
+        log.info(f"HDP fit saved to cache: {entry_dir}")
+        return entry_dir
+
+    def latest_in_lineage(self, lineage):
+        """
+        Return the key of the most recently created entry of a lineage that has doc hashes, or None.
+        A lineage groups the successive fits of a growing dataset (e.g. by dataset name and settings),
+        so that a new version can start from the fit of the previous one.
+        """
+        manifest = self._read_manifest()
+        candidates = [key for key, entry in manifest.items()
+                      if entry.get("lineage") == lineage and self._entry_complete(key)
+                      and os.path.exists(os.path.join(self._entry_dir(key), _DOC_HASHES_FILE))]
+        return max(candidates, key=lambda k: manifest[k]["created"], default=None)
+
+    def load_doc_hashes(self, key):
+        """Return the content hashes of the documents of an entry, or None if it has none."""
+        import joblib
+
+        path = os.path.join(self._entry_dir(key), _DOC_HASHES_FILE)
+        return joblib.load(path) if os.path.exists(path) else None
+
+    def _orphan_keys(self, manifest):
+        # Entry directories that are not in the manifest; temporary directories start with "."
+        return [name for name in os.listdir(self.cache_dir)
+                if not name.startswith(".") and name not in manifest
+                and os.path.isdir(os.path.join(self.cache_dir, name))]
+
+    def _evict(self, manifest, keep=None):
+        # Called with the manifest lock held. Drop entries whose directory is gone, adopt complete directories
+        # missing from the manifest (aged by their modification time) and remove incomplete ones, then evict
+        # the least recently used entries until within budget
+        for key in [k for k in manifest if not self._entry_complete(k)]:
+            del manifest[key]
+        for key in self._orphan_keys(manifest):
+            entry_dir = self._entry_dir(key)
+            if not self._entry_complete(key):
+                log.info(f"Removing incomplete HDP cache directory {entry_dir}")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            mtime = os.path.getmtime(entry_dir)
+            manifest[key] = {"name": None, "size": _dir_size(entry_dir), "created": mtime, "last_used": mtime,
+                             "lineage": None}
+        if self.max_bytes is None:
+            return
+        total = sum(entry["size"] for entry in manifest.values())
+        for key in sorted(manifest, key=lambda k: manifest[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            log.info(f"Evicting HDP cache entry {key} ({manifest[key].get('name')})")
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= manifest.pop(key)["size"]
+
+    def total_size(self):
+        """Return the total size in bytes of the cached entries."""
+        return sum(entry["size"] for entry in self._read_manifest().values())
@@ -0,0 +1,85 @@
+import math
+import hashlib
+import logging
+import numpy as np
+
+
+log = logging.getLogger(__name__)
+
+
+def doc_content_hash(text):
+    """
+    Return the 16-byte blake2b digest identifying a document by its content. A `CodeInstruction` hashes as
+    its prompt string, so documents keep their hashes whichever form the loader returns.
+    """
+    if isinstance(text, tuple):
+        text = text.to_prompt()
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def grow_hdp_vocabulary(hdp_model, num_terms):
+    """
+    Resizes the word dimension of a fitted `HdpModel` to `num_terms`, after its dictionary has been extended.
+
+    The topic-word parameters of the new words are initialized as `HdpModel.__init__` does for a fresh model
+    (small gamma noise, drawn from the model's own random state), and marked as up to date for the lazy
+    lambda updates. The parameters of the existing words are unchanged.
+
+    Args:
+        hdp_model (HdpModel): Fitted model, with up-to-date expectations (as left by `HdpModel.update`).
+        num_terms (int): New vocabulary size; must not be smaller than the current one.
+    """
+    from scipy.special import psi
+
+    num_new = num_terms - hdp_model.m_W
+    if num_new < 0:
+        raise ValueError(f"Cannot shrink the HDP vocabulary from {hdp_model.m_W} to {num_terms} terms")
+    if num_new == 0:
+        return
+
+    num_topics = hdp_model.m_T
+    new_lambda = hdp_model.random_state.gamma(1.0, 1.0, (num_topics, num_new)) \
+        * hdp_model.m_D * 100 / (num_topics * num_terms) - hdp_model.m_eta
+    hdp_model.m_lambda = np.hstack([hdp_model.m_lambda, new_lambda])
+    hdp_model.m_lambda_sum = hdp_model.m_lambda_sum + new_lambda.sum(axis=1)
+    hdp_model.m_timestamp = np.concatenate([hdp_model.m_timestamp,
+                                            np.full(num_new, hdp_model.m_updatect, dtype=hdp_model.m_timestamp.dtype)])
+    hdp_model.m_W = num_terms
+    # m_W enters the normalizer of every column, so all of Elogbeta is recomputed
+    hdp_model.m_Elogbeta = psi(hdp_model.m_eta + hdp_model.m_lambda) \
+        - psi(hdp_model.m_W * hdp_model.m_eta + hdp_model.m_lambda_sum[:, np.newaxis])
+
+
+def update_hdp_incrementally(hdp_model, dictionary, new_docs, num_docs):
+    """
+    Continues training a fitted `HdpModel` on new documents only.
+
+    The dictionary is extended with the new words, the model is resized to match, and `HdpModel.update` runs
+    online passes over the new documents. `m_D` is set to the size of the grown dataset, so the new chunks are
+    weighted as part of the whole corpus, and `max_chunks` is set for the call so that exactly the new
+    documents are processed once.
+
+    Args:
+        hdp_model (HdpModel): Fitted model; updated in place.
+        dictionary (gensim.corpora.Dictionary): Dictionary of the model; extended in place.
+        new_docs (list of list of str): Preprocessed new documents.
+        num_docs (int): Total number of documents of the grown dataset.
+    Returns:
+        list of list of (int, int): Bag-of-words corpus of `new_docs`.
+    """
+    dictionary.add_documents(new_docs)
+    hdp_model.id2word = dictionary
+    hdp_model.m_D = num_docs
+    grow_hdp_vocabulary(hdp_model, len(dictionary))
+
+    new_corpus = [dictionary.doc2bow(doc) for doc in new_docs]
+    if not new_corpus:
+        return new_corpus
+    log.info(f"Updating HDP model with {len(new_corpus)} new documents ({num_docs} in total)...")
+    max_chunks = hdp_model.max_chunks
+    hdp_model.max_chunks = math.ceil(len(new_corpus) / hdp_model.chunksize)
+    try:
+        hdp_model.update(new_corpus)
+    finally:
+        hdp_model.max_chunks = max_chunks
+    return new_corpus
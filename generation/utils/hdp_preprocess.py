@@ -0,0 +1,124 @@
+from tqdm import tqdm
+
+from utils.code_splitter import edit_instruction_splitter, python_lexer
+from utils.parallel import imap_ordered
+
+
+# Bump when the tokenization changes, so that cached HDP fits of the old tokens are not reused
+HDP_PREPROCESS_VERSION = "hdp-preprocess-v2"
+
+CODE_STOP_WORDS = set([
+        'def', 'return', 'import', 'from', 'as', 'class', 'if', 'else',
+        'elif', 'for', 'while', 'in', 'break', 'continue', 'None', 'True',
+        'False', 'try', 'except', 'finally', 'with', 'pass', 'print',
+        'self', 'assert', 'yield', 'global', 'lambda', 'nonlocal',
+        'and', 'or', 'not', 'is', '=', '==', '!=', '===', '!==', '>', '<', '>=',
+        '<=', '+', '-', '*', '/', '%', '**', '//', '&', '|', '^', '~', '<<', '>>',
+        '+=', '-=', '*=', '/=', '%=', '**=', '//=', '&=', '|=', '^=', '~=', '<<=', '>>=',
+        '(', ')', '[', ']', '{', '}', ',', '.', ':', ';',
+    ])
+
+
+# The NLTK English stop word list (179 words), bundled so that no corpus has to be downloaded at runtime
+ENGLISH_STOP_WORDS = frozenset([
+        'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're", "you've", "you'll",
+        "you'd", 'your', 'yours', 'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she', "she's",
+        'her', 'hers', 'herself', 'it', "it's", 'its', 'itself', 'they', 'them', 'their', 'theirs',
+        'themselves', 'what', 'which', 'who', 'whom', 'this', 'that', "that'll", 'these', 'those', 'am', 'is',
+        'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'having', 'do', 'does', 'did',
+        'doing', 'a', 'an', 'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while', 'of', 'at',
+        'by', 'for', 'with', 'about', 'against', 'between', 'into', 'through', 'during', 'before', 'after',
+        'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 'on', 'off', 'over', 'under', 'again',
+        'further', 'then', 'once', 'here', 'there', 'when', 'where', 'why', 'how', 'all', 'any', 'both',
+        'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only', 'own', 'same',
+        'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just', 'don', "don't", 'should', "should've",
+        'now', 'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren', "aren't", 'couldn', "couldn't", 'didn',
+        "didn't", 'doesn', "doesn't", 'hadn', "hadn't", 'hasn', "hasn't", 'haven', "haven't", 'isn', "isn't",
+        'ma', 'mightn', "mightn't", 'mustn', "mustn't", 'needn', "needn't", 'shan', "shan't", 'shouldn',
+        "shouldn't", 'wasn', "wasn't", 'weren', "weren't", 'won', "won't", 'wouldn', "wouldn't",
+    ])
+
+
+def load_english_stop_words():
+    """Return the English stop words. The list is bundled, so this works offline."""
+    return set(ENGLISH_STOP_WORDS)
+
+
+class HdpPreprocessor:
+    """
+    Tokenizes instructions for HDP topic modeling.
+
+    The stop word sets and the Python lexer are built once and reused for every document. Calling the
+    object on a text returns its tokens: identifiers from the code that are not in `code_stop_words`,
+    followed by alphabetic words from the instruction that are not in `stop_words`.
+
+    The object is picklable, so it can be sent to worker processes. The lexer is not pickled; each worker
+    builds it once on first use.
+
+    Usage:
+        preprocessor = HdpPreprocessor()
+        tokens = preprocessor(text)
+        processed_docs = preprocessor.map(texts, num_workers=4)
+    """
+
+    def __init__(self, stop_words=None, code_stop_words=None):
+        """
+        Args:
+            stop_words (iterable of str, optional): English stop words. Defaults to ENGLISH_STOP_WORDS.
+            code_stop_words (iterable of str, optional): Code tokens to drop. Defaults to CODE_STOP_WORDS.
+        """
+        self.stop_words = frozenset(load_english_stop_words() if stop_words is None else stop_words)
+        self.code_stop_words = frozenset(CODE_STOP_WORDS if code_stop_words is None else code_stop_words)
+        self._lexer = None
+
+    @property
+    def lexer(self):
+        if self._lexer is None:
+            self._lexer = python_lexer()
+        return self._lexer
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lexer"] = None
+        return state
+
+    def settings(self):
+        """Return the preprocessing settings as a JSON-serializable dict, e.g. for cache keys."""
+        return {
+            "version": HDP_PREPROCESS_VERSION,
+            "stop_words": sorted(self.stop_words),
+            "code_stop_words": sorted(self.code_stop_words),
+        }
+
+    def __call__(self, text):
+        """
+        Args:
+            text (str or CodeInstruction): Instruction text or (code, instruction) pair
+                (see `load_instructions_from_jsonl`).
+        Returns:
+            list of str: Code tokens followed by word tokens.
+        """
+        code_tokens, word_tokens = edit_instruction_splitter(text, lexer=self.lexer)
+        word_tokens = [t for t in word_tokens if t.isalpha() and t not in self.stop_words]
+        code_tokens = [t for t in code_tokens if t.isidentifier() and t not in self.code_stop_words]
+        return code_tokens + word_tokens
+
+    def imap(self, texts, num_workers=None, chunk_size=64):
+        """
+        Lazily tokenizes texts, in parallel if `num_workers` > 1, yielding token lists in input order.
+        The input is consumed in bounded windows, so it can be a generator over a large file.
+        """
+        return imap_ordered(self, texts, num_workers=num_workers, chunk_size=chunk_size)
+
+    def map(self, texts, num_workers=None, chunk_size=64, desc="Preprocessing instructions for HDP"):
+        """
+        Tokenizes a list of texts, in parallel if `num_workers` > 1.
+        Args:
+            texts (list of str): Instruction texts.
+            num_workers (int, optional): Number of worker processes. None or 1 runs serially. Defaults to None.
+            chunk_size (int, optional): Number of texts sent to a worker at a time. Defaults to 64.
+            desc (str, optional): Progress bar description.
+        Returns:
+            list of list of str: Token lists, in the order of `texts`.
+        """
+        return list(tqdm(self.imap(texts, num_workers, chunk_size), total=len(texts), desc=desc))
@@ -0,0 +1,189 @@
+import os
+import math
+from bisect import bisect_left, insort
+
+
+# Default bytes per token of the approximate token counter; code and English prose average about 3-4 bytes per
+# token with common BPE vocabularies
+DEFAULT_BYTES_PER_TOKEN = 3.5
+
+DEFAULT_BUCKET_BOUNDARIES = (512, 1024, 2048, 4096, 8192)
+
+# Record fields that are fed to the model, per prompt format
+ALPACA_TEXT_FIELDS = ("system", "instruction", "input", "output")
+
+
+class ApproxTokenCounter:
+    """Approximate token count of a text: its UTF-8 size divided by `bytes_per_token`, rounded up."""
+
+    def __init__(self, bytes_per_token=DEFAULT_BYTES_PER_TOKEN):
+        if bytes_per_token <= 0:
+            raise ValueError("bytes_per_token must be positive.")
+        self.bytes_per_token = bytes_per_token
+        self.name = f"approx-{bytes_per_token:g}-bytes-per-token"
+
+    def __call__(self, text):
+        return math.ceil(len(text.encode("utf-8")) / self.bytes_per_token) if text else 0
+
+
+class LocalTokenCounter:
+    """
+    Exact token count of a text with a tokenizer loaded from local files, without network access: a
+    `tokenizer.json` file (or a directory containing one) is loaded with the `tokenizers` library, any other
+    directory with `transformers.AutoTokenizer`. Special tokens are not counted.
+    """
+
+    def __init__(self, tokenizer_path):
+        json_path = tokenizer_path
+        if os.path.isdir(tokenizer_path):
+            json_path = os.path.join(tokenizer_path, "tokenizer.json")
+        self.name = os.path.basename(os.path.normpath(tokenizer_path))
+        if os.path.isfile(json_path):
+            try:
+                from tokenizers import Tokenizer
+            except ImportError:
+                raise ImportError("Loading tokenizer.json requires tokenizers. Please run: pip install tokenizers")
+            tokenizer = Tokenizer.from_file(json_path)
+            self._count = lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        elif os.path.isdir(tokenizer_path):
+            try:
+                from transformers import AutoTokenizer
+            except ImportError:
+                raise ImportError("Loading a tokenizer directory requires transformers. "
+                                  "Please run: pip install transformers")
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_path, local_files_only=True)
+            self._count = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        else:
+            raise ValueError(f"Tokenizer not found: {tokenizer_path}")
+
+    def __call__(self, text):
+        return self._count(text) if text else 0
+
+
+def load_token_counter(tokenizer_path=None, bytes_per_token=DEFAULT_BYTES_PER_TOKEN):
+    """
+    Returns a token counter (a callable text -> number of tokens, with a `name`): a `LocalTokenCounter` of
+    `tokenizer_path` if given, else an `ApproxTokenCounter` with `bytes_per_token`.
+    """
+    if tokenizer_path:
+        return LocalTokenCounter(tokenizer_path)
+    return ApproxTokenCounter(bytes_per_token)
+
+
+def record_texts(record):
+    """Texts of a finetuning record that are fed to the model: the message contents (ShareGPT) or the Alpaca fields."""
+    if "messages" in record:
+        return [message.get("content") or "" for message in record["messages"]]
+    return [record.get(field) or "" for field in ALPACA_TEXT_FIELDS]
+
+
+def record_num_tokens(record, count_tokens):
+    """Number of tokens of a finetuning record, the sum over its texts."""
+    return sum(count_tokens(text) for text in record_texts(record))
+
+
+def bucket_index(num_tokens, boundaries):
+    """
+    Index of the length bucket of a record: bucket `i` holds lengths in (boundaries[i - 1], boundaries[i]],
+    and bucket `len(boundaries)` the lengths above the last boundary.
+    """
+    return bisect_left(boundaries, num_tokens)
+
+
+def bucket_name(index, boundaries):
+    """Directory name of a length bucket, e.g. `bucket-01-le01024`, or `bucket-05-gt08192` for the last one."""
+    if index < len(boundaries):
+        return f"bucket-{index:02d}-le{boundaries[index]:05d}"
+    return f"bucket-{index:02d}-gt{boundaries[-1]:05d}"
+
+
+def pack_lengths(lengths, context_size):
+    """
+    Groups records into packs of at most `context_size` tokens with the best-fit decreasing heuristic:
+    records are placed longest first, each into the open pack with the least room left that still fits it.
+    A record of `context_size` tokens or more gets a pack of its own.
+
+    Args:
+        lengths (sequence of int): Token length of each record.
+        context_size (int): Target number of tokens per pack.
+
+    Returns:
+        list of list of int: The record indices of each pack, ascending; packs are ordered by their first
+            record, so the order of the input (e.g. a random shuffle) carries over to the packs.
+    """
+    packs = []
+    open_packs = []  # Sorted (room left, pack index)
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        length = lengths[i]
+        if length >= context_size:
+            packs.append([i])
+            continue
+        pos = bisect_left(open_packs, (length, -1))
+        if pos < len(open_packs):
+            room, pack_id = open_packs.pop(pos)
+            packs[pack_id].append(i)
+            room -= length
+        else:
+            pack_id, room = len(packs), context_size - length
+            packs.append([i])
+        if room > 0:
+            insort(open_packs, (room, pack_id))
+    for pack in packs:
+        pack.sort()
+    packs.sort(key=lambda pack: pack[0])
+    return packs
+
+
+class PaddingEstimator:
+    """
+    Streaming estimate of padding: sequences are grouped into batches of `batch_size` in the order they are
+    added, and every sequence of a batch is padded to the longest one, as a data loader without length
+    grouping does.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.num_sequences = 0
+        self.num_tokens = 0
+        self.padded_tokens = 0
+        self._batch_count = 0
+        self._batch_max = 0
+
+    def add(self, num_tokens):
+        self.num_sequences += 1
+        self.num_tokens += num_tokens
+        self._batch_count += 1
+        self._batch_max = max(self._batch_max, num_tokens)
+        if self._batch_count == self.batch_size:
+            self._close_batch()
+
+    def _close_batch(self):
+        self.padded_tokens += self._batch_count * self._batch_max
+        self._batch_count = 0
+        self._batch_max = 0
+
+    def summary(self):
+        """Returns {"num_sequences", "num_tokens", "padded_tokens", "padding_tokens", "padding_ratio"}."""
+        padded_tokens = self.padded_tokens + self._batch_count * self._batch_max  # Include the last, partial batch
+        return {
+            "num_sequences": self.num_sequences,
+            "num_tokens": self.num_tokens,
+            "padded_tokens": padded_tokens,
+            "padding_tokens": padded_tokens - self.num_tokens,
+            "padding_ratio": (padded_tokens - self.num_tokens) / padded_tokens if padded_tokens else 0.0,
+        }
+
+
+def merge_padding_summaries(summaries):
+    """Sums the `PaddingEstimator.summary` of several groups (e.g. one per length bucket)."""
+    totals = {key: sum(s[key] for s in summaries) for key in ("num_sequences", "num_tokens", "padded_tokens")}
+    totals["padding_tokens"] = totals["padded_tokens"] - totals["num_tokens"]
+    totals["padding_ratio"] = totals["padding_tokens"] / totals["padded_tokens"] if totals["padded_tokens"] else 0.0
+    return totals
+
+
+def padding_savings(baseline, optimized):
+    """Padding tokens saved by `optimized` over `baseline` (padding summaries), absolute and as a ratio."""
+    saved = baseline["padding_tokens"] - optimized["padding_tokens"]
+    return {"padding_tokens_saved": saved,
+            "padding_savings_ratio": saved / baseline["padding_tokens"] if baseline["padding_tokens"] else 0.0}
@@ -1,4 +1,20 @@
-import json
+from typing import NamedTuple
+
+from utils.triplet_record import iter_records
+
+
+class CodeInstruction(NamedTuple):
+    """
+    The code and instruction fields of a general-format record, kept apart so that consumers such as
+    `edit_instruction_splitter` do not have to format them into a prompt and parse it back.
+    """
+    code: object
+    instruction: object
+
+    def to_prompt(self):
+        """Return the `## Code Before: ... ## Instruction: ... ## Code After:` prompt string."""
+        return f"## Code Before:\n{self.code}\n## Instruction:\n{self.instruction}\n## Code After:\n"
+
 
 def load_instructions_from_jsonl(file_path, field_name, data_format):
     """
@@ -13,7 +29,8 @@ def load_instructions_from_jsonl(file_path, field_name, data_format):
 
     Returns:
         tuple: (instructions, commits)
-            - instructions (list of str): Extracted instruction texts.
+            - instructions (list of str or CodeInstruction): Extracted instruction texts, or (code, instruction)
+              pairs for the general format with two fields (see `instruction_from_record`).
             - commits (list of str): Corresponding 'commit' values.
 
     Raises:
@@ -23,9 +40,9 @@ def load_instructions_from_jsonl(file_path, field_name, data_format):
     Notes:
         - Each line in the JSONL file must be a valid JSON object.
         - For 'sharegpt', extracts and joins all user messages from the conversation field.
-        - For general format, concatenates specified fields with a newline if two are provided.
+        - For general format, returns the two fields as a `CodeInstruction` if two are provided.
     """
-    
+
     instructions = []
     commits = []
 
@@ -33,36 +50,56 @@ def load_instructions_from_jsonl(file_path, field_name, data_format):
     if isinstance(field_name, str):
         field_name = [field_name]
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            data = json.loads(line)
-            # Check commit field
-            if "commit" not in data:
-                raise KeyError(f"'commit' field does not exist in data: {data}")
-            
-            # ShareGPT format processing
-            if data_format == "sharegpt":
-                if field_name[0] not in data:
-                    raise KeyError(f"Field {field_name[0]} does not exist in data: {data}")
-                user_messages = [
-                    turn["content"] for turn in data[field_name[0]]
-                    if turn.get("role") == "user"
-                ]
-                if not user_messages:
-                    raise ValueError(f"No conversation with role='user' found: {data}")
-                instructions.append("\n".join(user_messages))
-                commits.append(data["commit"])
-
-            # General format processing
-            # Check field_name
-            elif len(field_name) == 2:
-                if field_name[0] not in data or field_name[1] not in data:
-                    raise KeyError(f"One of the fields in {field_name} does not exist in data: {data}")
-                instructions.append(f"## Code Before:\n{data[field_name[0]]}\n## Instruction:\n{data[field_name[1]]}\n## Code After:\n")
-                commits.append(data["commit"])
-            elif field_name[0] in data:
-                instructions.append(data[field_name[0]])
-                commits.append(data["commit"])
-            else:
-                raise KeyError(f"Field {field_name[0]} does not exist in data: {data}")
-    return instructions, commits
\ No newline at end of file
+    # Only the fields used here are decoded into each record
+    for data in iter_records(file_path, fields=["commit", *field_name]):
+        instructions.append(instruction_from_record(data, field_name, data_format))
+        commits.append(data["commit"])
+    return instructions, commits
+
+
+def instruction_from_record(data, field_name, data_format):
+    """
+    Extract the instruction text of a single record, as `load_instructions_from_jsonl` does for each line.
+
+    Args:
+        data (dict or TripletRecord): The decoded record.
+        field_name (str or list): Field name(s) to extract instruction content.
+        data_format (str): Format type ("sharegpt" or other).
+
+    Returns:
+        str or CodeInstruction: The instruction text, or the (code, instruction) fields for the general format
+            with two field names. Use `CodeInstruction.to_prompt` where the prompt string itself is needed.
+
+    Raises:
+        KeyError: If required fields are missing.
+        ValueError: If no user message is found in 'sharegpt' format.
+    """
+    if isinstance(field_name, str):
+        field_name = [field_name]
+
+    # Check commit field
+    if "commit" not in data:
+        raise KeyError(f"'commit' field does not exist in data: {data}")
+
+    # ShareGPT format processing
+    if data_format == "sharegpt":
+        if field_name[0] not in data:
+            raise KeyError(f"Field {field_name[0]} does not exist in data: {data}")
+        user_messages = [
+            turn["content"] for turn in data[field_name[0]]
+            if turn.get("role") == "user"
+        ]
+        if not user_messages:
+            raise ValueError(f"No conversation with role='user' found: {data}")
+        return "\n".join(user_messages)
+
+    # General format processing
+    # Check field_name
+    elif len(field_name) == 2:
+        if field_name[0] not in data or field_name[1] not in data:
+            raise KeyError(f"One of the fields in {field_name} does not exist in data: {data}")
+        return CodeInstruction(data[field_name[0]], data[field_name[1]])
+    elif field_name[0] in data:
+        return data[field_name[0]]
+    else:
+        raise KeyError(f"Field {field_name[0]} does not exist in data: {data}")
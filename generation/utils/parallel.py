@@ -0,0 +1,99 @@
+from itertools import islice
+
+
+def imap_ordered(func, iterable, num_workers=None, chunk_size=64, window_chunks=4):
+    """
+    Lazily maps `func` over `iterable` with a process pool, yielding results in input order.
+
+    The input is consumed in bounded windows of `num_workers * chunk_size * window_chunks` items, and the next
+    window is submitted before the current one is drained, so workers stay busy while memory stays bounded
+    (unlike `ProcessPoolExecutor.map`, which submits the whole input up front).
+
+    Args:
+        func (callable): Picklable function of one argument (a top-level function, `functools.partial`,
+            or an instance with `__call__`).
+        iterable (iterable): Input items.
+        num_workers (int, optional): Number of worker processes. None or 1 maps serially in this process.
+            Defaults to None.
+        chunk_size (int, optional): Number of items sent to a worker at a time. Defaults to 64.
+        window_chunks (int, optional): Number of chunks per worker in each window. Defaults to 4.
+
+    Yields:
+        The results of `func`, in input order.
+    """
+    if num_workers is None or num_workers <= 1:
+        yield from map(func, iterable)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    iterator = iter(iterable)
+    window_size = num_workers * chunk_size * window_chunks
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        def submit():
+            window = list(islice(iterator, window_size))
+            return executor.map(func, window, chunksize=chunk_size) if window else None
+
+        pending = submit()
+        while pending is not None:
+            next_pending = submit()
+            yield from pending
+            pending = next_pending
+
+
+def imap_ordered_cached(func, iterable, cache, key_fn=None, num_workers=None, chunk_size=64, window_size=4096):
+    """
+    Like `imap_ordered`, with a persistent cache in front of `func`: the input is looked up in windows of
+    `window_size` items, one `cache.get_many` per window, and only the misses are mapped (once per distinct key
+    of a window, in one `imap_ordered` stream for the whole input); their results are stored back with one
+    `cache.put_many` per window. Windows are read ahead as far as the pool asks for misses, so a key missed in
+    two nearby windows may be computed and stored twice.
+
+    Args:
+        func (callable): Picklable function of one argument, see `imap_ordered`.
+        iterable (iterable): Input items.
+        cache: Object with `get_many(keys) -> {key: result}` and `put_many({key: result})`, and `make_key(item)`
+            unless `key_fn` is given. Results must not be None.
+        key_fn (callable, optional): Item -> cache key. Defaults to `cache.make_key`.
+        num_workers (int, optional): Number of worker processes, see `imap_ordered`. Defaults to None.
+        chunk_size (int, optional): Number of items sent to a worker at a time. Defaults to 64.
+        window_size (int, optional): Number of items looked up in the cache at a time. Defaults to 4096.
+
+    Yields:
+        The results of `func` (or the cache), in input order.
+    """
+    from collections import deque
+
+    key_fn = key_fn or cache.make_key
+    iterator = iter(iterable)
+    windows = deque()  # (keys, cached results) of each window read, in order
+    misses = deque()
+
+    def read_window():
+        window = list(islice(iterator, window_size))
+        if not window:
+            return False
+        keys = [key_fn(item) for item in window]
+        cached = cache.get_many(keys)
+        windows.append((keys, cached))
+        misses.extend({key: item for item, key in zip(window, keys) if key not in cached}.values())
+        return True
+
+    def iter_misses():
+        # Reads ahead as far as the pool asks for misses; windows read here are consumed below in order
+        while misses or read_window():
+            while misses:
+                yield misses.popleft()
+
+    results = imap_ordered(func, iter_misses(), num_workers=num_workers, chunk_size=chunk_size)
+    while windows or read_window():
+        keys, cached = windows.popleft()
+        new_entries = {}
+        for key in keys:
+            result = cached.get(key)
+            if result is None:
+                result = new_entries.get(key)
+                if result is None:
+                    result = new_entries[key] = next(results)
+            yield result
+        cache.put_many(new_entries)
@@ -1,7 +1,8 @@
-import json
 import re
 import argparse
 
+from utils.triplet_record import TripletRecord
+
 def purify_code_from_jsonl(input_file, output_file, purify_field="code_after", purify_fields=None, keep_language_mark=False):
     """
     Extract code from markdown code blocks in a JSONL file and write the purified code to an output file.
@@ -24,14 +25,14 @@ def purify_code_from_jsonl(input_file, output_file, purify_field="code_after", p
     if purify_fields is None:
         purify_fields = [purify_field]
 
-    with open(input_file, 'r', encoding='utf-8') as infile, \
+    with open(input_file, 'rb') as infile, \
          open(output_file, 'w', encoding='utf-8') as outfile:
         for line in infile:
-            data = json.loads(line)
-            out_data = data.copy()
+            # The record is freshly decoded, so it is updated in place instead of being copied
+            record = TripletRecord.from_json(line)
             for field in purify_fields:
-                if field in data:
-                    snippet = data[field]
+                if field in record:
+                    snippet = record[field]
                     try:
                         matches = list(pattern.finditer(snippet))
                         if not matches:
@@ -62,11 +63,11 @@ def purify_code_from_jsonl(input_file, output_file, purify_field="code_after", p
                         if keep_language_mark and lang:
                             code = f"## {lang}\n" + code
 
-                        out_data[f'{field}_purify'] = code
+                        record[f'{field}_purify'] = code
                     except Exception as e:
-                        print(f"Failed to process line: {line.strip()}\nError: {e}")
+                        print(f"Failed to process line: {line.decode('utf-8').strip()}\nError: {e}")
 
-            outfile.write(json.dumps(out_data, ensure_ascii=False) + '\n')
+            outfile.write(record.to_json() + '\n')
 
 
 if __name__ == '__main__':
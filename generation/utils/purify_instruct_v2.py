@@ -1,4 +1,4 @@
-import json
+from utils.triplet_record import TripletRecord
 
 def purify_instructions(input_file, output_file, purify_fields=["instruct_descriptive", "instruct_lazy"]):
     """
@@ -21,16 +21,15 @@ def purify_instructions(input_file, output_file, purify_fields=["instruct_descri
         s = s.rstrip('-`*#\n ')  # Remove trailing --- ``` ### ** and \n
         return s
 
-    with open(input_file, 'r', encoding='utf-8') as infile, open(output_file, 'w', encoding='utf-8') as outfile:
+    with open(input_file, 'rb') as infile, open(output_file, 'w', encoding='utf-8') as outfile:
         for line in infile:
-            data = json.loads(line)
-            out_data = data.copy()  # Create a copy to avoid modifying the original data
+            record = TripletRecord.from_json(line)  # Freshly decoded, so it can be updated in place
             for field in purify_fields:
-                if field in data:
-                    out_data[f"{field}_purify"] = purify_string(data[field])
+                if field in record:
+                    record[f"{field}_purify"] = purify_string(record[field])
                 else:
-                    print(f"\033[91mWarning: Field '{field}' not found in data: {data}\033[0m")
-            outfile.write(json.dumps(out_data, ensure_ascii=False) + '\n')
+                    print(f"\033[91mWarning: Field '{field}' not found in data: {record.to_dict()}\033[0m")
+            outfile.write(record.to_json() + '\n')
 
 
 if "__main__" == __name__:
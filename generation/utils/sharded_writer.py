@@ -0,0 +1,343 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from utils.columnar_io import ParquetRowWriter, is_parquet_path, iter_parquet_rows
+from utils.triplet_record import TripletRecord
+
+
+SHARD_MANIFEST_NAME = "manifest.json"
+SHARD_MANIFEST_VERSION = 1
+
+# Shard of a record: the first 8 bytes of the blake2b digest of its key (UTF-8), big-endian, modulo the shard count
+SHARD_HASH = "blake2b-64"
+
+_CHECKSUM_CHUNK = 1 << 20
+
+
+def shard_of(key, num_shards):
+    """Returns the shard index (0 .. num_shards - 1) of a shard key."""
+    digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_shards
+
+
+def record_shard_key(record, key_field="commit"):
+    """
+    Returns the shard key of a record: the value of `key_field` (a list of commits is joined with ","), or the
+    canonical JSON of the whole record if the field is missing or empty, so that records sharing a commit
+    always land in the same shard.
+    """
+    value = record.get(key_field) if key_field else None
+    if isinstance(value, list):
+        value = ",".join(str(x) for x in value)
+    if value is None or value == "":
+        return json.dumps(record, sort_keys=True, ensure_ascii=True)
+    return str(value)
+
+
+def shard_output_dir(output_file):
+    """Directory that receives the shards of an output file: its path without the extension."""
+    return os.path.splitext(output_file)[0]
+
+
+def shard_file_name(shard, num_shards, part=None, extension=".jsonl"):
+    """File name of a shard, e.g. `shard-00003-of-00008.jsonl`, or `shard-00003-of-00008-part-00001.jsonl`."""
+    name = f"shard-{shard:05d}-of-{num_shards:05d}"
+    if part is not None:
+        name += f"-part-{part:05d}"
+    return name + extension
+
+
+def file_sha256(file_path):
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHECKSUM_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _ShardFile:
+    """One open shard file: counts its records and bytes, and checksums JSONL output as it is written."""
+
+    def __init__(self, path, shard, part, file_format):
+        self.path = path
+        self.shard = shard
+        self.part = part
+        self.num_records = 0
+        self.num_bytes = 0
+        if file_format == "parquet":
+            self._parquet = ParquetRowWriter(path)
+            self._file = self._digest = None
+        else:
+            self._parquet = None
+            self._file = open(path, "wb")
+            self._digest = hashlib.sha256()
+
+    def write(self, record, line):
+        if self._parquet is not None:
+            self._parquet.write(record)
+        else:
+            self._file.write(line)
+            self._digest.update(line)
+            self.num_bytes += len(line)
+        self.num_records += 1
+
+    def close(self):
+        """Closes the file. Returns its manifest entry."""
+        if self._parquet is not None:
+            self._parquet.close()
+            self.num_bytes = os.path.getsize(self.path)
+            checksum = file_sha256(self.path)
+        else:
+            self._file.close()
+            checksum = self._digest.hexdigest()
+        return {"file": os.path.basename(self.path), "shard": self.shard, "part": self.part,
+                "num_records": self.num_records, "num_bytes": self.num_bytes, "sha256": checksum}
+
+    def abort(self):
+        if self._parquet is not None:
+            self._parquet.abort()
+        else:
+            self._file.close()
+
+
+class ShardedWriter:
+    """
+    Writes a stream of records into shard files plus a manifest, instead of one monolithic file.
+
+    Each record goes to shard `shard_of(record_shard_key(record, key_field), num_shards)`, so the assignment
+    depends only on the record (by default its commit), not on the order or the number of records: reruns put
+    a record in the same shard, and records of the same commit are never split across shards. Within a shard,
+    records keep their input order. With `max_records` and/or `max_bytes`, a shard is further rolled over into
+    numbered parts once a part is full (a record larger than `max_bytes` gets a part of its own).
+
+    `close` writes `manifest.json` with the record count, size and SHA-256 of every file; it is written last
+    and atomically, so its presence marks a complete output. Loaders and parallel stages should list the files
+    from the manifest (`read_shard_manifest`, `iter_shard_records`), e.g. worker `i` of `k` taking shards
+    `i::k`. Every shard has at least one file, possibly empty.
+
+    Usage:
+        with ShardedWriter("data/ocedata_mix", num_shards=8) as writer:
+            for record in records:
+                writer.write(record)
+        manifest = writer.manifest
+    """
+
+    def __init__(self, output_dir, num_shards=1, max_records=None, max_bytes=None, file_format="jsonl",
+                 key_field="commit", ensure_ascii=False):
+        """
+        Args:
+            output_dir (str): Directory of the shard files and the manifest; created if missing.
+            num_shards (int, optional): Number of hash shards. Defaults to 1 (size-capped parts only).
+            max_records (int, optional): Maximum number of records per file. Defaults to None (no cap).
+            max_bytes (int, optional): Maximum size of a file in bytes; JSONL only. Defaults to None (no cap).
+            file_format (str, optional): "jsonl" or "parquet". Defaults to "jsonl".
+            key_field (str, optional): Record field hashed for the shard assignment. Defaults to "commit".
+            ensure_ascii (bool, optional): Passed to `json.dumps` for JSONL output. Defaults to False.
+
+        Raises:
+            ValueError: If a count or cap is not positive, the format is unknown, or `max_bytes` is given
+                for Parquet output (its size is only known once a file is closed).
+        """
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1.")
+        if max_records is not None and max_records < 1:
+            raise ValueError("max_records must be at least 1.")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1.")
+        if file_format not in ("jsonl", "parquet"):
+            raise ValueError("file_format must be either 'jsonl' or 'parquet'.")
+        if file_format == "parquet" and max_bytes is not None:
+            raise ValueError("max_bytes is only supported for JSONL shards; use max_records for Parquet.")
+
+        self.output_dir = output_dir
+        self.num_shards = num_shards
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.file_format = file_format
+        self.key_field = key_field
+        self.ensure_ascii = ensure_ascii
+        self.manifest = None
+        self._extension = ".parquet" if file_format == "parquet" else ".jsonl"
+        self._capped = max_records is not None or max_bytes is not None
+        self._open = {}
+        self._next_part = {}
+        self._entries = []
+
+        os.makedirs(output_dir, exist_ok=True)
+        # A manifest left by an earlier run would describe files that are about to be overwritten
+        manifest_path = os.path.join(output_dir, SHARD_MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+    def _is_full(self, shard_file, line_size):
+        if self.max_records is not None and shard_file.num_records >= self.max_records:
+            return True
+        return (self.max_bytes is not None and shard_file.num_records > 0
+                and shard_file.num_bytes + line_size > self.max_bytes)
+
+    def _open_part(self, shard):
+        part = self._next_part.get(shard, 0)
+        self._next_part[shard] = part + 1
+        name = shard_file_name(shard, self.num_shards, part if self._capped else None, self._extension)
+        shard_file = _ShardFile(os.path.join(self.output_dir, name), shard, part, self.file_format)
+        self._open[shard] = shard_file
+        return shard_file
+
+    def write(self, record):
+        """Writes one record (dict or TripletRecord). Returns the shard index it was assigned to."""
+        if isinstance(record, TripletRecord):
+            record = record.to_dict()
+        shard = shard_of(record_shard_key(record, self.key_field), self.num_shards) if self.num_shards > 1 else 0
+        line = None
+        if self.file_format == "jsonl":
+            line = (json.dumps(record, ensure_ascii=self.ensure_ascii) + "\n").encode("utf-8")
+
+        shard_file = self._open.get(shard)
+        if shard_file is not None and self._capped and self._is_full(shard_file, len(line) if line else 0):
+            self._entries.append(self._open.pop(shard).close())
+            shard_file = None
+        if shard_file is None:
+            shard_file = self._open_part(shard)
+        shard_file.write(record, line)
+        return shard
+
+    def close(self):
+        """
+        Closes every shard file and writes the manifest.
+
+        Returns:
+            dict: The manifest: {"version", "format", "num_shards", "key_field", "hash", "max_records",
+                "max_bytes", "num_records", "files"}, where "files" lists {"file", "shard", "part",
+                "num_records", "num_bytes", "sha256"} ordered by shard and part.
+        """
+        for shard in range(self.num_shards):
+            if shard not in self._open and shard not in self._next_part:
+                self._open_part(shard)  # Shards without records still get an (empty) file
+        for shard_file in self._open.values():
+            self._entries.append(shard_file.close())
+        self._open = {}
+
+        files = sorted(self._entries, key=lambda entry: (entry["shard"], entry["part"]))
+        self.manifest = {
+            "version": SHARD_MANIFEST_VERSION,
+            "format": self.file_format,
+            "num_shards": self.num_shards,
+            "key_field": self.key_field,
+            "hash": SHARD_HASH,
+            "max_records": self.max_records,
+            "max_bytes": self.max_bytes,
+            "num_records": sum(entry["num_records"] for entry in files),
+            "files": files,
+        }
+        _write_json_atomic(self.manifest, os.path.join(self.output_dir, SHARD_MANIFEST_NAME))
+        return self.manifest
+
+    def abort(self):
+        """Closes the open files without writing a manifest, e.g. after an error."""
+        for shard_file in self._open.values():
+            shard_file.abort()
+        self._open = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def _write_json_atomic(data, file_path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", prefix=".tmp-", suffix=".json")
+    try:
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_sharded(records, output_file, num_shards=None, max_records=None, max_bytes=None, key_field="commit",
+                  ensure_ascii=False):
+    """
+    Writes records into the shards of an output file with a `ShardedWriter`: the shards go to the directory
+    named after `output_file` without its extension (e.g. `data/ocedata_mix/` for `data/ocedata_mix.jsonl`),
+    in Parquet if `output_file` ends with `.parquet` and in JSONL otherwise.
+
+    Args:
+        records (iterable): Records (dict or TripletRecord) to write; can be a generator.
+        output_file (str): Path of the equivalent unsharded output file.
+        num_shards (int, optional): Number of hash shards. Defaults to None (1 shard).
+        max_records (int, optional): Maximum number of records per file. Defaults to None (no cap).
+        max_bytes (int, optional): Maximum size of a JSONL file in bytes. Defaults to None (no cap).
+        key_field (str, optional): Record field hashed for the shard assignment. Defaults to "commit".
+        ensure_ascii (bool, optional): Passed to `json.dumps` for JSONL output. Defaults to False.
+
+    Returns:
+        dict: The manifest, as returned by `ShardedWriter.close`.
+    """
+    file_format = "parquet" if is_parquet_path(output_file) else "jsonl"
+    with ShardedWriter(shard_output_dir(output_file), num_shards=num_shards or 1, max_records=max_records,
+                       max_bytes=max_bytes, file_format=file_format, key_field=key_field,
+                       ensure_ascii=ensure_ascii) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.manifest
+
+
+def read_shard_manifest(output_dir):
+    """Reads the manifest of a sharded output directory."""
+    with open(os.path.join(output_dir, SHARD_MANIFEST_NAME), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_shard_records(output_dir, shards=None):
+    """
+    Iterates over the records of a sharded output, as listed in its manifest.
+
+    Args:
+        output_dir (str): Sharded output directory.
+        shards (iterable of int, optional): Shard indices to read, e.g. `range(worker_id, num_shards, num_workers)`.
+            Defaults to None (all shards).
+
+    Yields:
+        dict: The records of the selected shards, shard by shard and part by part.
+    """
+    manifest = read_shard_manifest(output_dir)
+    selected = None if shards is None else set(shards)
+    for entry in manifest["files"]:
+        if selected is not None and entry["shard"] not in selected:
+            continue
+        file_path = os.path.join(output_dir, entry["file"])
+        if manifest["format"] == "parquet":
+            yield from iter_parquet_rows(file_path)
+            continue
+        with open(file_path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def verify_shards(output_dir):
+    """
+    Checks the files of a sharded output against the size and SHA-256 recorded in its manifest.
+
+    Returns:
+        list of str: Names of the files that are missing or do not match (empty if the output is intact).
+    """
+    manifest = read_shard_manifest(output_dir)
+    mismatched = []
+    for entry in manifest["files"]:
+        file_path = os.path.join(output_dir, entry["file"])
+        if (not os.path.exists(file_path) or os.path.getsize(file_path) != entry["num_bytes"]
+                or file_sha256(file_path) != entry["sha256"]):
+            mismatched.append(entry["file"])
+    return mismatched
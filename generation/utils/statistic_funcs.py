@@ -2,67 +2,126 @@
 
 import os
 import json
-import matplotlib.pyplot as plt
 import logging
 import numpy as np
 from collections import Counter
-import argparse
+from functools import partial
+from contextlib import nullcontext
 from tqdm import tqdm
-import difflib
-import json
-import spacy
-import pandas as pd
-from collections import Counter
-import plotly.express as px
 
 from utils.load_instruct_from_file import load_instructions_from_jsonl
-from utils.code_splitter import edit_instruction_splitter
+from utils.triplet_record import iter_records, write_records
+from utils.hdp_preprocess import CODE_STOP_WORDS, HdpPreprocessor
+from utils.diff_engine import diff_analysis
+from utils.diff_cache import DiffStatsCache
+from utils.parallel import imap_ordered, imap_ordered_cached
+from utils.hdp_cache import HdpFitCache, file_content_hash
+from utils.bow_corpus import BowCorpus
+from utils.hdp_incremental import doc_content_hash, update_hdp_incrementally
+from utils.topic_inference import infer_dominant_topics, dominant_topics_per_doc, validate_dominant_topics
+from utils.topic_sampler import sample_indices_by_topic
 
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
 logging.getLogger('gensim').setLevel(logging.WARNING)
 
 
-CODE_STOP_WORDS = set([
-        'def', 'return', 'import', 'from', 'as', 'class', 'if', 'else',
-        'elif', 'for', 'while', 'in', 'break', 'continue', 'None', 'True',
-        'False', 'try', 'except', 'finally', 'with', 'pass', 'print',
-        'self', 'assert', 'yield', 'global', 'lambda', 'nonlocal',
-        'and', 'or', 'not', 'is', '=', '==', '!=', '===', '!==', '>', '<', '>=', 
-        '<=', '+', '-', '*', '/', '%', '**', '//', '&', '|', '^', '~', '<<', '>>',
-        '+=', '-=', '*=', '/=', '%=', '**=', '//=', '&=', '|=', '^=', '~=', '<<=', '>>=',
-        '(', ')', '[', ']', '{', '}', ',', '.', ':', ';',
-    ])
-
-
-def filter_by_modify_lines(data_list, max_modify_lines=70, max_hunk_num=7):
+def filter_by_modify_lines(data_list, max_modify_lines=70, max_hunk_num=7, num_workers=None, chunk_size=64,
+                           cache_path=None):
     """
-    Filters a list of items based on the number of modified lines between 'old_code' and 'new_code'.
-    Each item in `data_list` should be a dictionary containing 'old_code' and 'new_code' keys.
+    Filters a list of items based on the number of modified lines between 'code_before_purify' and 'code_after_purify'.
+    Each item in `data_list` should be a dictionary or `TripletRecord` containing these keys.
     The function uses `diff_analysis` to compute the number of modified, added, and removed lines.
     Only items with a total number of modified lines greater than 0 and less than or equal to `max_modify_lines` are retained.
     Args:
-        data_list (list): List of dictionaries, each containing 'old_code' and 'new_code'.
+        data_list (list): List of dictionaries or `TripletRecord`, each containing 'code_before_purify' and 'code_after_purify'.
         max_modify_lines (int, optional): Maximum allowed number of modified lines. Defaults to 70.
+        max_hunk_num (int, optional): Maximum allowed number of hunks. Defaults to 7.
+        num_workers (int, optional): Number of worker processes for diff analysis. None or 1 runs serially. Defaults to None.
+        chunk_size (int, optional): Number of samples sent to a worker at a time. Defaults to 64.
+        cache_path (str, optional): Path to a `DiffStatsCache` SQLite file. If given, diff statistics are read from
+            and stored to this cache, so re-filtering with other thresholds skips the diffs. Defaults to None.
     Returns:
-        list: Filtered list of items meeting the modification criteria.
+        list: Filtered list of items meeting the modification criteria, in the original order.
     """
 
-    filtered = []
-    for item in data_list:
-        old_code = item.get('code_before_purify', '')
-        new_code = item.get('code_after_purify', '')
-        diff_stats = diff_analysis(old_code, new_code)
-        modify_lines = diff_stats["modified"] + diff_stats["added"] + diff_stats["removed"]
-        hunk_num = diff_stats["hunk_num"]
-        if 0 < modify_lines <= max_modify_lines and hunk_num <= max_hunk_num:
-            filtered.append(item)
+    filtered = list(iter_filtered_by_modify_lines(data_list, max_modify_lines=max_modify_lines, max_hunk_num=max_hunk_num,
+                                                  num_workers=num_workers, chunk_size=chunk_size, cache_path=cache_path,
+                                                  total=len(data_list)))
 
     logging.info(f"Number of items after filtering by diff: {len(filtered)}")
     return filtered
 
 
-def hdp_topic_analysis(jsonl_path, field_name, data_format, refit=False, debug=False, random_seed=None, **kwargs):
+def iter_filtered_by_modify_lines(items, max_modify_lines=70, max_hunk_num=7, num_workers=None, chunk_size=64,
+                                  cache_path=None, total=None):
+    """
+    Streaming version of `filter_by_modify_lines`: consumes an iterable of records and yields the ones that pass,
+    in order. Only a bounded window of records is held in memory at a time.
+    Args:
+        items (iterable): Dictionaries or `TripletRecord`, each containing 'code_before_purify' and 'code_after_purify'.
+        total (int, optional): Number of items, for the progress bar. Defaults to None.
+        Other arguments are as in `filter_by_modify_lines`.
+    Yields:
+        The items meeting the modification criteria.
+    """
+    from itertools import tee
+
+    items, pair_source = tee(items)
+    code_pairs = ((item.get('code_before_purify', ''), item.get('code_after_purify', '')) for item in pair_source)
+
+    with _open_diff_cache(cache_path) as cache:
+        all_diff_stats = iter_diff_stats(code_pairs, num_workers=num_workers, chunk_size=chunk_size,
+                                         total=total, cache=cache)
+        for item, diff_stats in zip(items, all_diff_stats):
+            modify_lines = diff_stats["modified"] + diff_stats["added"] + diff_stats["removed"]
+            hunk_num = diff_stats["hunk_num"]
+            if 0 < modify_lines <= max_modify_lines and hunk_num <= max_hunk_num:
+                yield item
+
+
+def _open_diff_cache(cache_path):
+    # A no-op context when caching is disabled
+    return DiffStatsCache(cache_path) if cache_path else nullcontext()
+
+
+def _diff_analysis_of_pair(code_pair, context=3, count_diff_hunks=False):
+    # Top-level function so that it can be pickled for worker processes
+    return diff_analysis(*code_pair, context=context, count_diff_hunks=count_diff_hunks)
+
+
+def iter_diff_stats(code_pairs, num_workers=None, chunk_size=64, total=None, count_diff_hunks=False, cache=None,
+                    desc="Analyzing code diffs"):
+    """
+    Yields `diff_analysis` results for an iterable of (old_code, new_code) pairs, in input order.
+    Pairs are diffed with `utils.parallel.imap_ordered`, so with `num_workers` > 1 they are sent in chunks to a
+    process pool without materializing the whole input. With a `cache`, they go through `imap_ordered_cached`:
+    each window is looked up in one batch, only the misses are diffed, and their results are stored back.
+    Args:
+        code_pairs (iterable): Iterable of (old_code, new_code) tuples.
+        num_workers (int, optional): Number of worker processes. None or 1 runs serially. Defaults to None.
+        chunk_size (int, optional): Number of pairs sent to a worker at a time. Defaults to 64.
+        total (int, optional): Total number of pairs, for the progress bar. Defaults to None.
+        count_diff_hunks (bool, optional): Whether to include 'diff_hunk_num' in the results. Defaults to False.
+            Always computed when a cache is used, so that cached entries are complete.
+        cache (DiffStatsCache, optional): Persistent diff statistics cache. Diffs are computed with its
+            `context`, which is part of its keys. Defaults to None (context 3).
+        desc (str, optional): Progress bar description.
+    Yields:
+        dict: Diff statistics as returned by `diff_analysis`.
+    """
+    analyze = partial(_diff_analysis_of_pair, context=cache.context if cache is not None else 3,
+                      count_diff_hunks=count_diff_hunks or cache is not None)
+    if cache is None:
+        results = imap_ordered(analyze, code_pairs, num_workers=num_workers, chunk_size=chunk_size)
+    else:
+        results = imap_ordered_cached(analyze, code_pairs, cache, key_fn=lambda pair: cache.make_key(*pair),
+                                      num_workers=num_workers, chunk_size=chunk_size)
+    yield from tqdm(results, total=total, desc=desc, unit="sample")
+
+
+def hdp_topic_analysis(jsonl_path, field_name, data_format, refit=False, debug=False, random_seed=None,
+                       num_workers=None, **kwargs):
     """
     Performs Hierarchical Dirichlet Process (HDP) topic modeling analysis on a dataset of instructions.
     This function loads instruction data from a JSONL file, preprocesses the text by splitting into code and word tokens,
@@ -73,76 +132,29 @@ def hdp_topic_analysis(jsonl_path, field_name, data_format, refit=False, debug=F
         data_format (str): The format of the data in the JSONL file.
         debug (bool, optional): If True, enables debug logging for token processing. Defaults to False.
         random_seed (int, optional): Random seed for reproducibility of HDP model. Defaults to None.
+        num_workers (int, optional): Number of worker processes for preprocessing. Defaults to None (serial).
     Returns:
         HdpModel: Trained Gensim HDP topic model on the processed instruction data.
     Notes:
-        - Requires NLTK and Gensim libraries.
-        - Downloads NLTK stopwords and punkt tokenizer if not already present.
-        - Assumes existence of CODE_STOP_WORDS, load_instructions_from_jsonl, edit_instruction_splitter, and log objects/functions.
+        - Requires the Gensim library.
+        - Uses the bundled English stop word list; nothing is downloaded.
         - Logs the number of topics found and the top 20 topics with their representative words.
     """
 
-    import nltk
-    from gensim import corpora
-    from gensim.models import HdpModel
-    from nltk.corpus import stopwords
-    import joblib
-    import os
+    base_name = os.path.splitext(os.path.basename(jsonl_path))[0]
 
-    # Download NLTK stopwords
-    nltk.download('punkt')
-    nltk.download('stopwords')
+    preprocessor = HdpPreprocessor()
+    cache_key = hdp_fit_key(hdp_data_id(jsonl_path, field_name, data_format), preprocessor.settings(), random_seed)
 
-    code_stop_words = CODE_STOP_WORDS
+    def get_processed_docs():
+        instr_list, _ = load_instructions_from_jsonl(jsonl_path, field_name, data_format)
+        return preprocessor.map(instr_list, num_workers=num_workers)
 
-    # Get model save path
-    base_name = os.path.splitext(os.path.basename(jsonl_path))[0]
-    fit_dir = os.path.join(os.path.dirname(__file__), "fit_results")
-    os.makedirs(fit_dir, exist_ok=True)
-    hdp_model_path = os.path.join(fit_dir, f"{base_name}_hdp_model.joblib")
-    hdp_dict_path = os.path.join(fit_dir, f"{base_name}_hdp_dictionary.joblib")
-    processed_docs_path = os.path.join(fit_dir, f"{base_name}_hdp_processed_docs.joblib")
-
-    # Load data
-    instr_list, _ = load_instructions_from_jsonl(jsonl_path, field_name, data_format)
-
-    # Text preprocessing function
-    def preprocess(text):
-        stop_words = set(stopwords.words('english'))
-        code_tokens, word_tokens = edit_instruction_splitter(text)
-        word_tokens = [t for t in word_tokens if t.isalpha()]
-        word_tokens = [t for t in word_tokens if t not in stop_words]
-        code_tokens = [t for t in code_tokens if t.isidentifier()]
-        code_tokens = [t for t in code_tokens if t not in code_stop_words]
-        # if debug:
-        #     log.info(f"Processed code tokens: {code_tokens}")
-        #     log.info(f"Processed word tokens: {word_tokens}")
-        return code_tokens + word_tokens
-
-    # If model exists and refit is not required, load directly
-    if os.path.exists(hdp_model_path) and os.path.exists(hdp_dict_path) \
-            and os.path.exists(processed_docs_path) and not refit:
-        log.info(f"Loaded existing HDP model: {hdp_model_path}")
-        hdp_model = joblib.load(hdp_model_path)
-        dictionary = joblib.load(hdp_dict_path)
-        processed_docs = joblib.load(processed_docs_path)
-        corpus = [dictionary.doc2bow(doc) for doc in tqdm(processed_docs, desc="Building HDP corpus")]
-    else:
-        processed_docs = [preprocess(doc) for doc in tqdm(instr_list, desc="Preprocessing instructions for HDP")]
-        dictionary = corpora.Dictionary(processed_docs)
-        corpus = [dictionary.doc2bow(doc) for doc in tqdm(processed_docs, desc="Building HDP corpus")]
-        log.info("Performing HDP topic analysis...")
-        hdp_model = HdpModel(corpus=corpus, id2word=dictionary, random_state=random_seed)
-        joblib.dump(hdp_model, hdp_model_path)
-        joblib.dump(dictionary, hdp_dict_path)
-        joblib.dump(processed_docs, processed_docs_path)
-        log.info(f"HDP model saved to: {hdp_model_path}")
-        log.info(f"HDP dictionary saved to: {hdp_dict_path}")
-        log.info(f"Processed docs saved to: {processed_docs_path}")
+    hdp_model, _, corpus = load_or_fit_hdp(cache_key, get_processed_docs, refit=refit, random_seed=random_seed,
+                                           name=base_name)
 
     # Count hard distribution: dominant topic for each document
-    dominant_topics = [max(hdp_model[bow], key=lambda x: x[1])[0] 
-                       for bow in tqdm(corpus, desc="Assigning dominant topics (HDP)")]
+    dominant_topics = assign_dominant_topics(hdp_model, corpus, num_workers=num_workers)
     topic_counts = Counter(dominant_topics)
     top_topics = topic_counts.most_common(20)
     topic_ids = [tid for tid, _ in top_topics]
@@ -177,8 +189,159 @@ def hdp_topic_analysis(jsonl_path, field_name, data_format, refit=False, debug=F
     return hdp_model
 
 
+def hdp_data_id(file_path, field_name, data_format, **extra):
+    """
+    Identifies the documents an HDP fit is computed on: the content hash of the input file, the fields read
+    from it and any extra settings that select the documents (e.g. the diff filter thresholds).
+    """
+    return {
+        "content": file_content_hash(file_path),
+        "field_name": [field_name] if isinstance(field_name, str) else list(field_name),
+        "data_format": data_format,
+        **extra,
+    }
+
+
+def _hdp_params(random_seed=None):
+    # Keyword arguments of `HdpModel`; they are part of the HDP cache key
+    return {"random_state": random_seed}
+
+
+def hdp_fit_key(data_id, preprocess_settings, random_seed=None):
+    """
+    Returns the HDP cache key of a fit on the documents `data_id` with the given preprocessing settings.
+    The gensim version is part of the key, since pickled models are not portable across versions.
+    """
+    from importlib.metadata import version
+
+    hdp_params = {**_hdp_params(random_seed), "gensim": version("gensim")}
+    return HdpFitCache.make_key(data_id, preprocess_settings, hdp_params)
+
+
+def has_hdp_fit_results(cache_key, cache=None):
+    """Return True if the HDP cache holds a fit for `cache_key`."""
+    return cache_key in (cache or HdpFitCache())
+
+
+def load_or_fit_hdp(cache_key, get_processed_docs, refit=False, random_seed=None, cache=None, name=None):
+    """
+    Loads the cached HDP fit for `cache_key`, or fits a new one and caches it.
+    Args:
+        cache_key (str): HDP cache key, see `hdp_fit_key`.
+        get_processed_docs (callable): Returns the preprocessed documents (list of token lists). Only called
+            when the model has to be fitted, so callers can skip preprocessing on cached runs.
+        refit (bool, optional): Whether to refit even if cached results exist. Defaults to False.
+        random_seed (int, optional): Random seed of the HDP model. Defaults to None.
+        cache (HdpFitCache, optional): The HDP cache. Defaults to the cache in `utils/fit_results/hdp_cache`.
+        name (str, optional): Dataset name recorded in the cache manifest.
+    Returns:
+        tuple: (hdp_model, dictionary, corpus), where corpus is a `BowCorpus` (memory-mapped when cached)
+    """
+    cache = cache or HdpFitCache()
+    fit = None if refit else cache.load(cache_key)
+    if fit is None:
+        hdp_model, dictionary, corpus = _fit_hdp(get_processed_docs(), random_seed)
+        cache.save(cache_key, hdp_model, dictionary, corpus, name=name)
+        fit = hdp_model, dictionary, corpus
+    return fit
+
+
+def _fit_hdp(processed_docs, random_seed=None):
+    # Fits a new HDP model; returns (hdp_model, dictionary, corpus)
+    from gensim import corpora
+    from gensim.models import HdpModel
+
+    dictionary = corpora.Dictionary(processed_docs)
+    corpus = BowCorpus.from_docs(processed_docs, dictionary)
+    log.info("Performing HDP topic analysis...")
+    hdp_model = HdpModel(corpus=corpus, id2word=dictionary, **_hdp_params(random_seed))
+    return hdp_model, dictionary, corpus
+
+
+def load_or_update_hdp(cache_key, lineage_key, texts, preprocessor, refit=False, random_seed=None, cache=None,
+                       name=None, num_workers=None):
+    """
+    Incremental variant of `load_or_fit_hdp` for datasets that grow over time.
+
+    On a cache miss, the latest cached fit of the same lineage (same dataset name and settings, previous
+    content) is reused: documents are matched by content hash, so only unseen documents are tokenized, the
+    cached dictionary is extended with their words, and the cached model continues training on them with
+    online `HdpModel.update` passes (see `utils.hdp_incremental`). The cost is proportional to the new
+    documents. Documents removed from the dataset cannot be unlearned by the online updates; they only
+    leave the corpus. Without a previous fit, or with `refit`, the model is fitted from scratch.
+
+    Args:
+        cache_key (str): HDP cache key of the current dataset, see `hdp_fit_key`.
+        lineage_key (str): HDP cache key identifying the lineage, independent of the dataset content.
+        texts (list of str): Instruction texts of the current dataset.
+        preprocessor (HdpPreprocessor): Tokenizer for unseen documents.
+        refit (bool, optional): Whether to refit from scratch. Defaults to False.
+        random_seed (int, optional): Random seed of a new HDP model. Defaults to None.
+        cache (HdpFitCache, optional): The HDP cache. Defaults to the cache in `utils/fit_results/hdp_cache`.
+        name (str, optional): Dataset name recorded in the cache manifest.
+        num_workers (int, optional): Number of worker processes for tokenization. Defaults to None (serial).
+    Returns:
+        tuple: (hdp_model, dictionary, corpus), where corpus is a `BowCorpus`
+    """
+    cache = cache or HdpFitCache()
+    doc_hashes = [doc_content_hash(text) for text in texts]
+    fit = None if refit else cache.load(cache_key)
+    if fit is not None:
+        return fit
+
+    base_key = None if refit else cache.latest_in_lineage(lineage_key)
+    if base_key is None:
+        processed_docs = preprocessor.map(texts, num_workers=num_workers)
+        hdp_model, dictionary, corpus = _fit_hdp(processed_docs, random_seed)
+        cache.save(cache_key, hdp_model, dictionary, corpus, name=name, doc_hashes=doc_hashes, lineage=lineage_key)
+        return hdp_model, dictionary, corpus
+
+    # Word IDs of the cached dictionary stay valid when it is extended, so cached documents keep their rows
+    hdp_model, dictionary, base_corpus = cache.load(base_key)
+    base_index = {}
+    for idx, doc_hash in enumerate(cache.load_doc_hashes(base_key)):
+        base_index.setdefault(doc_hash, idx)
+
+    new_positions = [pos for pos, doc_hash in enumerate(doc_hashes) if doc_hash not in base_index]
+    log.info(f"Reusing {len(texts) - len(new_positions)} cached documents, tokenizing {len(new_positions)} new ones")
+    new_docs = preprocessor.map([texts[pos] for pos in new_positions], num_workers=num_workers)
+    new_corpus = update_hdp_incrementally(hdp_model, dictionary, new_docs, len(texts))
+    bows = [base_corpus[base_index[doc_hash]] if doc_hash in base_index else None for doc_hash in doc_hashes]
+    for pos, bow in zip(new_positions, new_corpus):
+        bows[pos] = bow
+    corpus = BowCorpus.from_bows(bows)
+    cache.save(cache_key, hdp_model, dictionary, corpus, name=name, doc_hashes=doc_hashes, lineage=lineage_key,
+               info={"updated_from": base_key})
+    return hdp_model, dictionary, corpus
+
+
+def assign_dominant_topics(hdp_model, corpus, batched=True, batch_size=32, validate_sample=200, num_workers=None):
+    """
+    Assigns the dominant topic to each document of a bag-of-words corpus.
+    By default the documents are inferred in batches over a sparse doc-term matrix (see `utils.topic_inference`),
+    and the result is checked against per-document `hdp_model[bow]` on a random sample.
+    Args:
+        hdp_model (HdpModel): Fitted HDP model.
+        corpus (list of list of (int, int) or BowCorpus): Bag-of-words documents.
+        batched (bool, optional): Use batched inference; False infers one document at a time. Defaults to True.
+        batch_size (int, optional): Number of documents per inference batch. Defaults to 32.
+        validate_sample (int, optional): Number of documents checked against per-document inference,
+            0 to skip the check. Defaults to 200.
+        num_workers (int, optional): Number of worker processes for batched inference. Defaults to None (serial).
+    Returns:
+        list of int: Dominant topic ID per document, or -1 if no topic is assigned.
+    """
+    log.info("Assigning dominant topic for each document...")
+    if not batched:
+        return dominant_topics_per_doc(hdp_model, corpus)
+    dominant_topics = infer_dominant_topics(hdp_model, corpus, batch_size=batch_size, num_workers=num_workers)
+    validate_dominant_topics(hdp_model, corpus, dominant_topics, sample_size=validate_sample)
+    return dominant_topics.tolist()
+
+
 def filter_data_by_hdp_topic_analysis(jsonl_path, field_name, data_format, max_samples_per_topic=None, max_samples_total=None,
-                                      refit=False, debug=False, random_seed=None, output_path=None):
+                                      refit=False, debug=False, random_seed=None, output_path=None, num_workers=None,
+                                      incremental=False):
     """
     Perform HDP topic analysis on data, then randomly sample topics with more than max_samples_per_topic samples.
     Args:
@@ -190,15 +353,13 @@ def filter_data_by_hdp_topic_analysis(jsonl_path, field_name, data_format, max_s
         debug (bool): Enable debug mode
         random_seed (int): Random seed
         output_path (str): Output file path, auto-generated if None
+        num_workers (int): Number of worker processes for preprocessing, None for serial
+        incremental (bool): If the dataset has grown since the last run under the same file name, update the
+            previous HDP fit with the new documents instead of refitting (see `load_or_update_hdp`)
     Returns:
         str: Output file path
     """
     import random
-    import nltk
-    from gensim import corpora
-    from gensim.models import HdpModel
-    from nltk.corpus import stopwords
-    import joblib
     
     # Set random seed
     if random_seed is not None:
@@ -213,141 +374,30 @@ def filter_data_by_hdp_topic_analysis(jsonl_path, field_name, data_format, max_s
         log.info("No max sample count set")
         raise ValueError("At least one of max_samples_per_topic or max_samples_total must be set")
 
-    # Download NLTK stopwords
-    nltk.download('punkt', quiet=True)
-    nltk.download('stopwords', quiet=True)
-    
-    code_stop_words = CODE_STOP_WORDS
     base_name = os.path.splitext(os.path.basename(jsonl_path))[0]
-    
-    # 获取模型保存路径
-    fit_dir = os.path.join(os.path.dirname(__file__), "fit_results")
-    os.makedirs(fit_dir, exist_ok=True)
-    hdp_model_path = os.path.join(fit_dir, f"{base_name}_hdp_model.joblib")
-    hdp_dict_path = os.path.join(fit_dir, f"{base_name}_hdp_dictionary.joblib")
-    processed_docs_path = os.path.join(fit_dir, f"{base_name}_hdp_processed_docs.joblib")
-    
-    # Load original data
-    instr_list, _ = load_instructions_from_jsonl(jsonl_path, field_name, data_format)
-    
-    # Also read full JSONL data for later filtering
-    original_data = []
-    with open(jsonl_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                original_data.append(json.loads(line))
-    
-    log.info(f"Total original data count: {len(original_data)}")
-    
-    # Text preprocessing function
-    def preprocess(text):
-        stop_words = set(stopwords.words('english'))
-        code_tokens, word_tokens = edit_instruction_splitter(text)
-        word_tokens = [t for t in word_tokens if t.isalpha()]
-        word_tokens = [t for t in word_tokens if t not in stop_words]
-        code_tokens = [t for t in code_tokens if t.isidentifier()]
-        code_tokens = [t for t in code_tokens if t not in code_stop_words]
-        return code_tokens + word_tokens
-    
-    # If model exists and refit is not required, load directly
-    if os.path.exists(hdp_model_path) and os.path.exists(hdp_dict_path) \
-            and os.path.exists(processed_docs_path) and not refit:
-        log.info(f"Loaded existing HDP model: {hdp_model_path}")
-        hdp_model = joblib.load(hdp_model_path)
-        dictionary = joblib.load(hdp_dict_path)
-        processed_docs = joblib.load(processed_docs_path)
-        corpus = [dictionary.doc2bow(doc) for doc in tqdm(processed_docs, desc="Building HDP corpus")]
-    else:
-        log.info("Start preprocessing documents...")
-        processed_docs = [preprocess(doc) for doc in tqdm(instr_list, desc="Preprocessing instructions for HDP")]
-        dictionary = corpora.Dictionary(processed_docs)
-        corpus = [dictionary.doc2bow(doc) for doc in tqdm(processed_docs, desc="Building HDP corpus")]
-        log.info("Performing HDP topic analysis...")
-        hdp_model = HdpModel(corpus=corpus, id2word=dictionary, random_state=random_seed)
-        joblib.dump(hdp_model, hdp_model_path)
-        joblib.dump(dictionary, hdp_dict_path)
-        joblib.dump(processed_docs, processed_docs_path)
-    log.info(f"HDP model saved to: {hdp_model_path}")
-    
-    # Assign dominant topic for each document
-    log.info("Assigning dominant topic for each document...")
-    dominant_topics = []
-    for bow in tqdm(corpus, desc="Assigning dominant topics"):
-        topic_probs = hdp_model[bow]
-        if topic_probs:
-            dominant_topic = max(topic_probs, key=lambda x: x[1])[0]
-            dominant_topics.append(dominant_topic)
-        else:
-            dominant_topics.append(-1)  # No topic assigned
-    
-    # Count document number for each topic
-    topic_counts = Counter(dominant_topics)
-    log.info(f"Found {len(topic_counts)} topics")
-    
-    # Create mapping from topic to document indices
-    topic_to_indices = {}
-    for idx, topic_id in enumerate(dominant_topics):
-        topic_to_indices.setdefault(topic_id, []).append(idx)
-    
-    if max_samples_total:
-        sorted_topic_counts = sorted(topic_counts.items(), key=lambda x: x[1], reverse=True)
 
-    # Calculate target number to keep for each topic according to max_samples_total
-    if max_samples_total is not None:
-        total = sum(len(v) for v in topic_to_indices.values())
-        log.info(f"Original total sample count: {total}, target total: {max_samples_total}")
-
-        locked = {}
-        unlocked = dict(topic_to_indices)
-
-        while True:
-            log.info(f"Current locked topics: {len(locked)}, unlocked topics: {len(unlocked)}")
-            n_unlocked = len(unlocked)
-            if n_unlocked == 0:
-                break
-            target_per_topic = (max_samples_total - sum(len(v) for v in locked.values())) / n_unlocked
-
-            changed = False
-            for topic, indices in list(unlocked.items()):
-                log.info(f"Topic {topic}: current sample count {len(indices)}, target sample count {target_per_topic}")
-                if len(indices) <= target_per_topic:
-                    locked[topic] = indices
-                    del unlocked[topic]
-                    changed = True
-            if not changed:
-                break
-
-        quota = (max_samples_total - sum(len(v) for v in locked.values())) / len(unlocked)
-        topic_target_counts = {}
-        for topic, indices in locked.items():
-            topic_target_counts[topic] = len(indices)
-        for topic in unlocked:
-            topic_target_counts[topic] = int(quota)
-
-        diff = max_samples_total - sum(topic_target_counts.values())
-        if diff != 0:
-            keys = list(unlocked.keys())
-            for i in range(abs(diff)):
-                topic_target_counts[keys[i % len(keys)]] += (1 if diff > 0 else -1)
+    preprocessor = HdpPreprocessor()
+    cache_key = hdp_fit_key(hdp_data_id(jsonl_path, field_name, data_format), preprocessor.settings(), random_seed)
+
+    if incremental:
+        instr_list, _ = load_instructions_from_jsonl(jsonl_path, field_name, data_format)
+        lineage_id = {"lineage": base_name, "field_name": field_name, "data_format": data_format}
+        lineage_key = hdp_fit_key(lineage_id, preprocessor.settings(), random_seed)
+        hdp_model, _, corpus = load_or_update_hdp(
+            cache_key, lineage_key, instr_list, preprocessor, refit=refit, random_seed=random_seed,
+            name=base_name, num_workers=num_workers)
     else:
-        topic_target_counts = {
-            topic: min(len(indices), max_samples_per_topic)
-            for topic, indices in topic_to_indices.items()
-        }
+        def get_processed_docs():
+            instr_list, _ = load_instructions_from_jsonl(jsonl_path, field_name, data_format)
+            log.info("Start preprocessing documents...")
+            return preprocessor.map(instr_list, num_workers=num_workers)
+
+        hdp_model, _, corpus = load_or_fit_hdp(cache_key, get_processed_docs, refit=refit, random_seed=random_seed,
+                                               name=base_name)
+    log.info(f"Total original data count: {len(corpus)}")
     
-    # 采样 
-    filtered_indices = []
-    for topic_id, indices in topic_to_indices.items():
-        target_n = topic_target_counts[topic_id]
-        if len(indices) > target_n:
-            sampled_indices = random.sample(indices, target_n)
-        else:
-            sampled_indices = indices
-        filtered_indices.extend(sampled_indices)
-    log.info(f"Topic {topic_id}: {len(indices)} → keep {target_n}")
-    
-    filtered_data = [original_data[idx] for idx in sorted(filtered_indices)]
+    dominant_topics = assign_dominant_topics(hdp_model, corpus, num_workers=num_workers)
+    filtered_indices = set(sample_indices_by_topic(dominant_topics, max_samples_per_topic, max_samples_total))
     
     if output_path is None:
         instruct_gen_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -359,55 +409,12 @@ def filter_data_by_hdp_topic_analysis(jsonl_path, field_name, data_format, max_s
             suffix = f"topic_{max_samples_per_topic}"
         output_path = os.path.join(output_dir, f"{base_name}_topic_sampled_{suffix}.jsonl")
     
-    with open(output_path, 'w', encoding='utf-8') as f:
-        for item in filtered_data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    # Stream the input once more and keep only the selected records, instead of holding the full dataset
+    selected = (record for idx, record in enumerate(iter_records(jsonl_path)) if idx in filtered_indices)
+    write_records(selected, output_path)
     
     log.info(f"Filtered data saved to: {output_path}")
-
-
-def diff_analysis(old_code, new_code, context=3):
-    old_lines = old_code.splitlines()
-    new_lines = new_code.splitlines()
-
-    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
-    opcodes = matcher.get_opcodes()
-    modified = added = removed = 0
-    for tag, i1, i2, j1, j2 in opcodes:
-        if tag == 'replace':
-            modified += max(i2 - i1, j2 - j1)
-        elif tag == 'insert':
-            added += (j2 - j1)
-        elif tag == 'delete':
-            removed += (i2 - i1)
-
-    # Calculate hunk number
-    hunks = []
-    current_hunk = []
-    for tag, i1, i2, j1, j2 in opcodes:
-        if tag == 'equal':
-            equal_len = i2 - i1
-            if equal_len > 2 * context:
-                # If length exceeds 2 * context, split hunk
-                if current_hunk:
-                    hunks.append(current_hunk)
-                    current_hunk = []
-                continue
-        current_hunk.append((tag, i1, i2, j1, j2))
-
-    if current_hunk:
-        hunks.append(current_hunk)
-
-    diff_lines = list(difflib.unified_diff(old_lines, new_lines, n=context))
-    hunk_count = sum(1 for line in diff_lines if line.startswith('@@'))
-
-    return {
-        'added': added,
-        'removed': removed,
-        'modified': modified,
-        'hunk_num': len(hunks),
-        'diff_hunk_num': hunk_count,
-    }
+    return output_path
 
 
 def compute_diff_statistics(jsonl_path, figure_dir="statistic_figure", **kwargs):
@@ -417,12 +424,23 @@ def compute_diff_statistics(jsonl_path, figure_dir="statistic_figure", **kwargs)
     between old and new code using `diff_analysis`, and computes statistics such as the
     minimum, maximum, and median number of modified lines and diff hunks. It also generates
     and saves histograms for the distributions of modified lines and hunk numbers.
+    The statistics are accumulated in a streaming `DiffStatsAccumulator` (exact per-value histograms), so
+    memory does not grow with the number of samples. Several files are aggregated into one result by
+    merging their accumulators.
     Args:
-        jsonl_path (str): Path to the input JSONL file containing code diffs.
+        jsonl_path (str or list of str): Path(s) to the input JSONL file(s) containing code diffs.
         figure_dir (str, optional): Directory to save generated figures. Defaults to "statistic_figure".
         **kwargs: Additional keyword arguments:
             - bin_width_modified (int, optional): Bin width for modified lines histogram. Defaults to 5.
             - bin_width_hunk (int, optional): Bin width for hunk number histogram. Defaults to 1.
+            - max_modify_lines (int, optional): Threshold of the reported ratio of samples with more modified lines.
+              Defaults to `max_modify_lines` of the filter config (70 if unset).
+            - max_hunk_num (int, optional): Threshold of the reported ratio of samples with more hunks.
+              Defaults to `max_hunk_num` of the filter config (7 if unset).
+            - config_path (str, optional): Filter config to read the thresholds from. Defaults to `filter_config.yaml`.
+            - cache_path (str, optional): Path to a `DiffStatsCache` SQLite file shared with `filter_by_modify_lines`.
+              Defaults to None (no cache).
+            - num_workers (int, optional): Number of worker processes for diff analysis. Defaults to None (serial).
     Returns:
         dict: A dictionary containing statistics for modified lines and hunk numbers:
             {
@@ -430,69 +448,71 @@ def compute_diff_statistics(jsonl_path, figure_dir="statistic_figure", **kwargs)
                     "min": int,  # Minimum number of modified lines
                     "max": int,  # Maximum number of modified lines
                     "median": float,  # Median number of modified lines
+                    "gt{max_modify_lines}_count": int,  # Samples with more modified lines, e.g. "gt70_count"
+                    "gt{max_modify_lines}_ratio": float,
                     },
                 "hunk_num": {
                     "min": int,  # Minimum number of hunks
                     "max": int,  # Maximum number of hunks
                     "median": float,  # Median number of hunks
+                    "gt{max_hunk_num}_count": int,  # Samples with more hunks, e.g. "gt7_count"
+                    "gt{max_hunk_num}_ratio": float,
                     },
             }
 
     """
-    
-
-    # Read jsonl file
-    diff_stats_list = []
-    modified_list = []
-    hunk_num_list = []
-    hunk_num_list_1 = []
-
-    with open(jsonl_path, "r", encoding="utf-8") as f:
-        for line in tqdm(f, desc="Analyzing code diffs"):
-            data = json.loads(line)
-            old_code = data.get("old_code", "")
-            new_code = data.get("new_code", "")
-            diff_stats = diff_analysis(old_code, new_code)
-            diff_stats_list.append(diff_stats)
-            modified_list.append(diff_stats["modified"] + diff_stats["added"] + diff_stats["removed"])
-            hunk_num_list.append(diff_stats["hunk_num"])
-            hunk_num_list_1.append(diff_stats["diff_hunk_num"])
+    from utils.diff_histogram import DiffStatsAccumulator, diff_thresholds_from_config
+
+    thresholds = diff_thresholds_from_config(kwargs.get('config_path'))
+    if kwargs.get('max_modify_lines') is not None:
+        thresholds["modified"] = kwargs['max_modify_lines']
+    if kwargs.get('max_hunk_num') is not None:
+        thresholds["hunk_num"] = kwargs['max_hunk_num']
+    jsonl_paths = [jsonl_path] if isinstance(jsonl_path, str) else list(jsonl_path)
+
+    # Read jsonl files
+    def iter_code_pairs(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                data = json.loads(line)
+                yield data.get("old_code", ""), data.get("new_code", "")
+
+    stats_acc = DiffStatsAccumulator(thresholds)
+    with _open_diff_cache(kwargs.get('cache_path')) as cache:
+        for path in jsonl_paths:
+            file_acc = DiffStatsAccumulator(thresholds)
+            for diff_stats in iter_diff_stats(iter_code_pairs(path), num_workers=kwargs.get('num_workers'),
+                                              cache=cache):
+                file_acc.add(diff_stats)
+            stats_acc.merge(file_acc)
 
     # Calculate statistics
-    def get_stats(arr):
-        arr_np = np.array(arr)
-        return arr_np.min(), arr_np.max(), np.median(arr_np)
-
-    min_mod, max_mod, median_mod = get_stats(modified_list)
-    min_hunk, max_hunk, median_hunk = get_stats(hunk_num_list)
-    print(f"[Modified Lines] min: {min_mod}, max: {max_mod}, median: {median_mod}")
-    print(f"[Hunk Number] min: {min_hunk}, max: {max_hunk}, median: {median_hunk}")
-
-    # Calculate ratio: modified lines > 70 and hunks > 7
-    total = len(modified_list)
-    if total > 0:
-        mod_gt70_count = sum(1 for m in modified_list if m > 70)
-        hunk_gt7_count = sum(1 for h in hunk_num_list if h > 7)
-        mod_gt70_ratio = mod_gt70_count / total
-        hunk_gt7_ratio = hunk_gt7_count / total
-    else:
-        mod_gt70_count = hunk_gt7_count = 0
-        mod_gt70_ratio = hunk_gt7_ratio = 0.0
-
-    print(f"[Modified Lines > 70] ratio: {mod_gt70_ratio:.2%} ({mod_gt70_count}/{total})")
-    print(f"[Hunks > 7] ratio: {hunk_gt7_ratio:.2%} ({hunk_gt7_count}/{total})")
+    summary = stats_acc.summary()
+    total = stats_acc.total
+    mod_stats, hunk_stats = summary["modified"], summary["hunk_num"]
+    print(f"[Modified Lines] min: {mod_stats['min']}, max: {mod_stats['max']}, median: {mod_stats['median']}")
+    print(f"[Hunk Number] min: {hunk_stats['min']}, max: {hunk_stats['max']}, median: {hunk_stats['median']}")
+
+    # Calculate ratio: modified lines and hunks above the filtering thresholds
+    max_mod, max_hunk = thresholds["modified"], thresholds["hunk_num"]
+    print(f"[Modified Lines > {max_mod}] ratio: {mod_stats[f'gt{max_mod}_ratio']:.2%} "
+          f"({mod_stats[f'gt{max_mod}_count']}/{total})")
+    print(f"[Hunks > {max_hunk}] ratio: {hunk_stats[f'gt{max_hunk}_ratio']:.2%} "
+          f"({hunk_stats[f'gt{max_hunk}_count']}/{total})")
+
+    # Plot distribution from the aggregated histograms
+    import matplotlib.pyplot as plt
 
-    # Plot distribution
     fig_dir = figure_dir
     bin_width_modified = kwargs.get('bin_width_modified', 5)
     bin_width_hunk = kwargs.get('bin_width_hunk', 1)
     os.makedirs(fig_dir, exist_ok=True)
-    base_name = os.path.splitext(os.path.basename(jsonl_path))[0]
+    base_name = "+".join(os.path.splitext(os.path.basename(path))[0] for path in jsonl_paths)
 
     # Modified lines distribution
     plt.figure(figsize=(8, 5))
-    modified_bins = np.arange(0, max(modified_list) + bin_width_modified, bin_width_modified)
-    plt.hist(modified_list, bins=modified_bins, color="skyblue", edgecolor="black", linewidth=0.3)
+    modified_counts, modified_bins = stats_acc.histogram("modified", bin_width_modified)
+    plt.hist(modified_bins[:-1], bins=modified_bins, weights=modified_counts, color="skyblue", edgecolor="black", linewidth=0.3)
     plt.xlabel("Modified Lines")
     plt.ylabel("Number of Samples")
     # plt.title(f"{base_name} Modified Lines Distribution")
@@ -503,8 +523,8 @@ def compute_diff_statistics(jsonl_path, figure_dir="statistic_figure", **kwargs)
 
     # Hunk number distribution
     plt.figure(figsize=(8, 5))
-    hunk_bins = np.arange(0, max(hunk_num_list) + bin_width_hunk, bin_width_hunk)
-    plt.hist(hunk_num_list, bins=hunk_bins, color="salmon", edgecolor="black", linewidth=0.3)
+    hunk_counts, hunk_bins = stats_acc.histogram("hunk_num", bin_width_hunk)
+    plt.hist(hunk_bins[:-1], bins=hunk_bins, weights=hunk_counts, color="salmon", edgecolor="black", linewidth=0.3)
     plt.xlabel("Number of Hunks")
     plt.ylabel("Number of Samples")
     # plt.title(f"{base_name} Hunk Number Distribution")
@@ -513,22 +533,7 @@ def compute_diff_statistics(jsonl_path, figure_dir="statistic_figure", **kwargs)
     plt.savefig(os.path.join(fig_dir, f"{base_name}_hunk_num_hist.pdf"))
     plt.close()
 
-    return {
-        "modified": {
-            "min": min_mod,
-            "max": max_mod,
-            "median": median_mod,
-            "gt70_count": mod_gt70_count,
-            "gt70_ratio": mod_gt70_ratio,
-            },
-        "hunk_num": {
-            "min": min_hunk,
-            "max": max_hunk,
-            "median": median_hunk,
-            "gt7_count": hunk_gt7_count,
-            "gt7_ratio": hunk_gt7_ratio,
-            },
-    }
+    return summary
 
 
 def plot_verb_object_sunburst(
@@ -543,43 +548,37 @@ def plot_verb_object_sunburst(
     remove_border: bool = True,
     border_width: float = 0.5,
     border_color: str = "white",
+    batch_size: int = 256,
+    n_process: int = 1,
+    refit: bool = False,
+    cache_dir=None,
 ):
-    # 1. Load NLP model
-    try:
-        nlp = spacy.load(lang)
-    except OSError:
-        raise ValueError(f"spaCy model '{lang}' not found. Please run: python -m spacy download {lang}")
-    
-    # 2. Read jsonl data
-    instructions, _ = load_instructions_from_jsonl(jsonl_path, field_name, data_format)
-
-    # 3. Extract verb-object pairs
-    pairs = []
-    for instr in tqdm(instructions, desc="Extracting verb-object pairs"):
-        instr_text = edit_instruction_splitter(instr, tokenize=False)[1]  # Only process natural language part
-        doc = nlp(instr_text)
-        for token in doc:
-            if token.pos_ == "VERB":
-                for child in token.children:
-                    if child.dep_ in ("dobj", "obj"):  # Direct object
-                        verb = token.lemma_.lower()
-                        obj = child.lemma_.lower()
-                        pairs.append((verb, obj))
-
-    # 4. Count frequency
-    pair_counts = Counter(pairs)
+    import pandas as pd
+    import plotly.express as px
+    from utils.verb_object import load_or_extract_verb_object_counts, merge_verb_object_counts
+
+    # 1. Extract verb-object pairs of each dataset (a list of paths is plotted together). Counts are cached
+    #    per file content and spaCy model, so re-plotting with other top_n / drop_other settings skips parsing.
+    jsonl_paths = [jsonl_path] if isinstance(jsonl_path, str) else list(jsonl_path)
+    pair_counts = merge_verb_object_counts(
+        load_or_extract_verb_object_counts(path, field_name, data_format, lang=lang, batch_size=batch_size,
+                                           n_process=n_process, cache_dir=cache_dir, refit=refit)
+        for path in jsonl_paths
+    )
+
+    # 2. Count frequency
     data = [{"verb": v, "object": o, "count": c} for (v, o), c in pair_counts.items()]
     if not data:
         raise ValueError("No verb-object pairs extracted, please check data or language model.")
 
     df_counts = pd.DataFrame(data)
 
-    # 5. Select top_n_verbs verbs
+    # 3. Select top_n_verbs verbs
     verb_freq = df_counts.groupby("verb")["count"].sum().sort_values(ascending=False)
     top_verbs = verb_freq.head(top_n_verbs).index.tolist()
     df_top = df_counts[df_counts["verb"].isin(top_verbs)].copy()
 
-    # 6. For each verb, select top_n_objects_per_verb objects
+    # 4. For each verb, select top_n_objects_per_verb objects
     filtered_rows = []
     for verb in top_verbs:
         sub = df_top[df_top["verb"] == verb].sort_values("count", ascending=False)
@@ -595,7 +594,7 @@ def plot_verb_object_sunburst(
                 }))
     df_final = pd.concat(filtered_rows, ignore_index=True)
 
-    # 7. Plot sunburst and save image
+    # 5. Plot sunburst and save image
     fig = px.sunburst(
         df_final,
         path=["verb", "object"],
@@ -609,13 +608,14 @@ def plot_verb_object_sunburst(
         fig.update_traces(marker=dict(line=dict(width=border_width, color=border_color)))
     fig_dir = figure_dir
     os.makedirs(fig_dir, exist_ok=True)
-    base_name = os.path.splitext(os.path.basename(jsonl_path))[0]
+    base_name = "+".join(os.path.splitext(os.path.basename(path))[0] for path in jsonl_paths)
     fig_path = os.path.join(fig_dir, f"{base_name}_verb_object_sunburst.png")
     fig.write_image(fig_path)
     print(f"Sunburst plot saved to: {fig_path}")
 
 
 if __name__ == "__main__":
+    import argparse
     from utils.plot_and_save import plot_embedding_scatter, plot_embedding_scatter_with_labels
 
     # 1. 设置参数
@@ -627,6 +627,8 @@ if __name__ == "__main__":
     parser.add_argument("--label_file", type=str, help="Path to CSV file with commit and label columns")
     parser.add_argument("--refit", action="store_true", help="Force refit embeddings and models")
     parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    parser.add_argument("--batch_size", type=int, default=256, help="Number of instructions per spaCy batch")
+    parser.add_argument("--n_process", type=int, default=1, help="Number of spaCy parsing processes")
     args = parser.parse_args()
 
     jsonl_path = args.jsonl_path
@@ -647,4 +649,7 @@ if __name__ == "__main__":
         top_n_objects_per_verb=10,
         drop_other=True,
         remove_border=True,
+        batch_size=args.batch_size,
+        n_process=args.n_process,
+        refit=refit,
     )
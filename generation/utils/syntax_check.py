@@ -0,0 +1,302 @@
+import io
+import os
+import sys
+import ast
+import sqlite3
+import hashlib
+import keyword
+import logging
+import textwrap
+import tokenize
+import warnings
+from contextlib import nullcontext
+from functools import partial
+from itertools import tee
+from tqdm import tqdm
+
+from utils.parallel import imap_ordered, imap_ordered_cached
+
+
+log = logging.getLogger(__name__)
+
+# Bump when `python_syntax_ok` changes what it accepts, so that stale entries are not reused
+SYNTAX_CACHE_VERSION = b"syntax-v2"
+
+SYNTAX_CHECK_MODES = ("drop", "flag", "keep")
+
+# "module": the snippet parses on its own; "fragment": the snippet tokenizes as Python, so a window cut out of a
+# file (unbalanced brackets or blocks, an unindented first line, starting or ending inside a docstring) passes,
+# but prose, Python 2 print statements or other languages do not
+SYNTAX_CHECK_LEVELS = ("fragment", "module")
+
+# Record field set by the "flag" mode
+SYNTAX_VALID_FIELD = "syntax_valid"
+
+SYNTAX_CHECK_FIELDS = ("code_before_purify", "code_after_purify")
+
+# Opening brackets put in front of a fragment, so that the tokenizer ignores its indentation and unmatched closers
+_OPEN_BRACKETS = "(" * 16 + "\n"
+_FSTRING_START = getattr(tokenize, "FSTRING_START", None)  # Python 3.12+
+_FSTRING_END = getattr(tokenize, "FSTRING_END", None)
+_SKIPPED_TOKEN_TYPES = (tokenize.NL, tokenize.NEWLINE, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT)
+
+
+def default_syntax_cache_path():
+    """Default location of the syntax check cache, next to the HDP fit results."""
+    return os.path.join(os.path.dirname(__file__), "fit_results", "syntax_check_cache.sqlite")
+
+
+def syntax_check_id(level="fragment"):
+    """
+    Identifies the syntax check: the cache version, the check level and the Python grammar (major.minor) it
+    parses with.
+    """
+    return f"{SYNTAX_CACHE_VERSION.decode('ascii')}-{level}-py{sys.version_info[0]}.{sys.version_info[1]}"
+
+
+def check_syntax_mode(mode, level="fragment"):
+    """Raises ValueError for an unknown syntax check mode or level."""
+    if mode not in SYNTAX_CHECK_MODES:
+        raise ValueError(f"Unknown syntax check mode '{mode}'. Choose one of {SYNTAX_CHECK_MODES}.")
+    if level not in SYNTAX_CHECK_LEVELS:
+        raise ValueError(f"Unknown syntax check level '{level}'. Choose one of {SYNTAX_CHECK_LEVELS}.")
+
+
+def parses_as_module(code):
+    """
+    Returns True if a code snippet parses as a Python module (`compile` to an AST, nothing is executed).
+    A snippet that is indented as a whole, e.g. a method cut out of a class, is dedented first.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # e.g. invalid escape sequences
+            compile(code, "<snippet>", "exec", ast.PyCF_ONLY_AST, dont_inherit=True)
+        return True
+    except IndentationError:
+        dedented = textwrap.dedent(code)
+        return dedented != code and parses_as_module(dedented)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        # ValueError: null bytes; RecursionError / MemoryError: pathologically nested code
+        return False
+
+
+def _operand_kind(token):
+    # "name" (not a keyword), "number" or "string" for the tokens that cannot follow one another on a line
+    if token.type == tokenize.NAME:
+        return None if keyword.iskeyword(token.string) or keyword.issoftkeyword(token.string) else "name"
+    if token.type == tokenize.NUMBER:
+        return "number"
+    if token.type in (tokenize.STRING, _FSTRING_START):
+        return "string"
+    return None
+
+
+def _tokenizes(code):
+    prev_kind, prev_row = None, 0
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(_OPEN_BRACKETS + code).readline):
+            if token.type == tokenize.ERRORTOKEN and not token.string.isspace():
+                return False
+            if token.type in _SKIPPED_TOKEN_TYPES:
+                continue
+            kind = _operand_kind(token)
+            # e.g. "quick brown", 'print "hi"' or "1 2"; adjacent strings are concatenated
+            if kind and prev_kind and token.start[0] == prev_row and not kind == prev_kind == "string":
+                return False
+            prev_kind = "string" if token.type == _FSTRING_END else kind
+            prev_row = token.end[0]
+    except tokenize.TokenError as e:
+        # End of input inside brackets or a multi-line string; Python 3.12+ also raises it for an unterminated
+        # single-quoted string
+        message = str(e.args[0])
+        return "EOF in multi-line" in message or "unterminated triple-quoted" in message
+    except SyntaxError as e:
+        # Python 3.12+ raises on invalid tokens, and on closing brackets that do not match the ones put in front
+        return "parenthesis" in str(e.msg)
+    return True
+
+
+def tokenizes_as_python(code):
+    """
+    Returns True if a code snippet is a sequence of Python tokens: no invalid characters (e.g. "$", "?",
+    backticks), no unterminated single-quoted strings, and no two names, numbers or strings in a row on a line
+    (other than keywords and concatenated strings). Indentation, bracket balance and a string left open at the
+    end are not checked, since a snippet may start or end anywhere in a file; a snippet that starts inside a
+    triple-quoted string is checked from the closing quotes on.
+    """
+    if _tokenizes(code):
+        return True
+    return any(_tokenizes(code[end + 3:]) for end in (code.find('"""'), code.find("'''")) if end >= 0)
+
+
+def python_syntax_ok(code, level="fragment"):
+    """Returns True if a code snippet passes the syntax check of `level` ("fragment" or "module")."""
+    if parses_as_module(code):
+        return True
+    return level == "fragment" and tokenizes_as_python(code)
+
+
+class SyntaxCheckCache:
+    """
+    A persistent SQLite cache mapping hash(code, check level, Python version) to the result of `python_syntax_ok`.
+
+    Entries are looked up and inserted in batches, so a whole window of snippets costs one query.
+
+    Usage:
+        with SyntaxCheckCache(path) as cache:
+            keys = [cache.make_key(code) for code in codes]
+            found = cache.get_many(keys)
+            cache.put_many({key: valid, ...})
+    """
+
+    _MAX_QUERY_PARAMS = 500
+
+    def __init__(self, db_path=None, level="fragment"):
+        self.db_path = db_path or default_syntax_cache_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS syntax_valid (key BLOB PRIMARY KEY, valid INTEGER) WITHOUT ROWID")
+        self._conn.commit()
+        self._salt = syntax_check_id(level).encode("ascii")
+
+    def make_key(self, code):
+        """Return the 16-byte content hash of a snippet (and the check level and Python version)."""
+        h = hashlib.blake2b(self._salt, digest_size=16, person=SYNTAX_CACHE_VERSION)
+        h.update(code.encode("utf-8", "surrogatepass"))
+        return h.digest()
+
+    def get_many(self, keys):
+        """
+        Look up several keys at once.
+        Args:
+            keys (iterable of bytes): Keys from `make_key`.
+        Returns:
+            dict: key -> bool, for the keys found in the cache.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for start in range(0, len(keys), self._MAX_QUERY_PARAMS):
+            batch = keys[start:start + self._MAX_QUERY_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(f"SELECT key, valid FROM syntax_valid WHERE key IN ({placeholders})", batch)
+            for key, valid in rows:
+                found[key] = bool(valid)
+        return found
+
+    def put_many(self, entries):
+        """
+        Insert several entries at once.
+        Args:
+            entries (dict): key -> bool.
+        """
+        if not entries:
+            return
+        self._conn.executemany("INSERT OR REPLACE INTO syntax_valid (key, valid) VALUES (?, ?)",
+                               [(key, int(valid)) for key, valid in entries.items()])
+        self._conn.commit()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM syntax_valid").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def iter_syntax_checks(codes, level="fragment", num_workers=None, chunk_size=256, total=None, cache=None,
+                       desc="Checking Python syntax"):
+    """
+    Yields `python_syntax_ok` for an iterable of code snippets, in input order.
+    Snippets are checked with `utils.parallel.imap_ordered`; with a `cache`, through `imap_ordered_cached`,
+    so only the misses are parsed, once per distinct snippet of a window.
+    Args:
+        codes (iterable of str): Code snippets.
+        level (str, optional): Check level, see `SYNTAX_CHECK_LEVELS`. Defaults to "fragment".
+        num_workers (int, optional): Number of worker processes. None or 1 runs serially. Defaults to None.
+        chunk_size (int, optional): Number of snippets sent to a worker at a time. Defaults to 256.
+        total (int, optional): Total number of snippets, for the progress bar. Defaults to None.
+        cache (SyntaxCheckCache, optional): Persistent syntax check cache of the same level. Defaults to None.
+        desc (str, optional): Progress bar description.
+    Yields:
+        bool: Whether each snippet parses.
+    """
+    check = partial(python_syntax_ok, level=level)
+    if cache is None:
+        results = imap_ordered(check, codes, num_workers=num_workers, chunk_size=chunk_size)
+    else:
+        results = imap_ordered_cached(check, codes, cache, num_workers=num_workers, chunk_size=chunk_size)
+    yield from tqdm(results, total=total, desc=desc, unit="snippet")
+
+
+def iter_syntax_filtered(records, mode="drop", level="fragment", fields=SYNTAX_CHECK_FIELDS, num_workers=None,
+                         cache_path=None, stats=None):
+    """
+    Streams records through a Python syntax check of their code fields, in order.
+
+    Args:
+        records (iterable): Records (dict or TripletRecord); can be a generator.
+        mode (str, optional): "drop" yields only the records whose code fields all parse; "flag" yields every
+            record with `syntax_valid` set to the result; "keep" yields the records unchecked. Defaults to "drop".
+        level (str, optional): "fragment" (tokenizes as Python) or "module" (parses on its own), see
+            `python_syntax_ok`. Defaults to "fragment".
+        fields (tuple of str, optional): Code fields to check; a missing field counts as empty code.
+            Defaults to ("code_before_purify", "code_after_purify").
+        num_workers (int, optional): Number of worker processes. Defaults to None (serial).
+        cache_path (str, optional): Path of a `SyntaxCheckCache`. Defaults to None (no cache).
+        stats (dict, optional): Updated with the counts "seen" and "invalid" as records are consumed.
+    Yields:
+        The records, as selected by `mode`.
+    """
+    check_syntax_mode(mode, level)
+    if mode == "keep":
+        yield from records
+        return
+
+    stats = {} if stats is None else stats
+    stats.update(seen=0, invalid=0)
+    records, code_source = tee(records)
+    codes = (record.get(field) or "" for record in code_source for field in fields)
+
+    with (SyntaxCheckCache(cache_path, level=level) if cache_path else nullcontext()) as cache:
+        checks = iter_syntax_checks(codes, level=level, num_workers=num_workers, cache=cache)
+        for record in records:
+            valid = all([next(checks) for _ in fields])
+            stats["seen"] += 1
+            if not valid:
+                stats["invalid"] += 1
+            if mode == "flag":
+                record[SYNTAX_VALID_FIELD] = valid
+                yield record
+            elif valid:
+                yield record
+    action = "dropped" if mode == "drop" else "flagged"
+    log.info(f"{stats['invalid']} of {stats['seen']} samples fail the Python syntax check ({level}, {action})")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    from utils.triplet_record import iter_records, write_records
+
+    parser = argparse.ArgumentParser(description="Check that the code of each triplet parses as Python, ahead of "
+                                                 "dt_filtering.py.")
+    parser.add_argument("input_file", type=str, help="Path to the input JSONL (or Parquet) file of triplets.")
+    parser.add_argument("output_file", type=str, help="Path to the output JSONL (or Parquet) file.")
+    parser.add_argument("--mode", type=str, choices=["drop", "flag"], default="drop", help="Drop invalid samples, or flag them in 'syntax_valid'.")
+    parser.add_argument("--level", type=str, choices=["fragment", "module"], default="fragment", help="Check that the code tokenizes as Python (fragment) or parses on its own (module).")
+    parser.add_argument("--num_workers", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--no_cache", action="store_true", help="Do not use the syntax check cache.")
+    args = parser.parse_args()
+
+    write_records(iter_syntax_filtered(iter_records(args.input_file), mode=args.mode, level=args.level,
+                                       num_workers=args.num_workers,
+                                       cache_path=None if args.no_cache else default_syntax_cache_path()),
+                  args.output_file)
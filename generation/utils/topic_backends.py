@@ -0,0 +1,225 @@
+import time
+import logging
+import resource
+import numpy as np
+from tqdm import tqdm
+
+from utils.topic_inference import dominant_topics_from_gamma, TOPIC_PROB_EPS
+
+
+log = logging.getLogger(__name__)
+
+# "hdp" is the default; the others fit a fixed number of topics and can use several cores
+TOPIC_BACKENDS = ("hdp", "lda_multicore", "tfidf_kmeans")
+
+
+def check_topic_backend(topic_backend):
+    if topic_backend not in TOPIC_BACKENDS:
+        raise ValueError(f"Unknown topic_backend '{topic_backend}', expected one of {TOPIC_BACKENDS}")
+
+
+def lda_multicore_topics(processed_docs, num_topics=50, num_workers=None, passes=1, random_seed=None,
+                         chunk_size=2000):
+    """
+    Fits `gensim.models.LdaMulticore` with a fixed topic count and assigns the dominant topic of each document.
+    Args:
+        processed_docs (list of list of str): Preprocessed documents.
+        num_topics (int, optional): Number of topics. Defaults to 50.
+        num_workers (int, optional): Number of worker processes; None uses LdaMulticore's default (cores - 1).
+        passes (int, optional): Number of passes over the corpus. Defaults to 1.
+        random_seed (int, optional): Random seed of the model. Defaults to None.
+        chunk_size (int, optional): Number of documents per training and inference chunk. Defaults to 2000.
+    Returns:
+        numpy.ndarray: Dominant topic ID per document, or -1 if the document is empty or no topic reaches 0.01.
+    """
+    from gensim import corpora
+    from gensim.models import LdaMulticore
+
+    dictionary = corpora.Dictionary(processed_docs)
+    corpus = [dictionary.doc2bow(doc) for doc in tqdm(processed_docs, desc="Building LDA corpus")]
+    log.info(f"Fitting LdaMulticore with {num_topics} topics...")
+    lda_model = LdaMulticore(corpus=corpus, id2word=dictionary, num_topics=num_topics, workers=num_workers,
+                             passes=passes, chunksize=chunk_size, random_state=random_seed)
+
+    dominant = np.empty(len(corpus), dtype=np.int64)
+    for start in tqdm(range(0, len(corpus), chunk_size), desc="Assigning dominant topics (LDA)"):
+        chunk = corpus[start:start + chunk_size]
+        gamma, _ = lda_model.inference(chunk)
+        dominant[start:start + len(chunk)] = dominant_topics_from_gamma(gamma, TOPIC_PROB_EPS)
+    empty = np.array([len(bow) == 0 for bow in corpus], dtype=bool)
+    dominant[empty] = -1
+    return dominant
+
+
+def tfidf_kmeans_topics(processed_docs, num_topics=50, random_seed=None, batch_size=4096):
+    """
+    Clusters documents by their sparse TF-IDF vectors with `sklearn.cluster.MiniBatchKMeans`; clusters act as topics.
+    Args:
+        processed_docs (list of list of str): Preprocessed documents.
+        num_topics (int, optional): Number of clusters. Defaults to 50.
+        random_seed (int, optional): Random seed of the clustering. Defaults to None.
+        batch_size (int, optional): Mini-batch size. Defaults to 4096.
+    Returns:
+        numpy.ndarray: Cluster ID per document, or -1 if the document is empty.
+    """
+    try:
+        from sklearn.cluster import MiniBatchKMeans
+        from sklearn.feature_extraction.text import TfidfVectorizer
+    except ImportError:
+        raise ImportError("topic_backend 'tfidf_kmeans' requires scikit-learn. Please run: pip install scikit-learn")
+
+    # The documents are already tokenized, so the vectorizer only counts the given tokens
+    vectorizer = TfidfVectorizer(analyzer=lambda tokens: tokens, lowercase=False)
+    doc_term = vectorizer.fit_transform(processed_docs)
+    nonempty = np.flatnonzero(doc_term.getnnz(axis=1))
+    dominant = np.full(len(processed_docs), -1, dtype=np.int64)
+    if len(nonempty) == 0:
+        return dominant
+    num_clusters = min(num_topics, len(nonempty))
+    log.info(f"Clustering {len(nonempty)} TF-IDF vectors into {num_clusters} clusters...")
+    kmeans = MiniBatchKMeans(n_clusters=num_clusters, batch_size=batch_size, random_state=random_seed, n_init=3)
+    dominant[nonempty] = kmeans.fit_predict(doc_term[nonempty])
+    return dominant
+
+
+def backend_dominant_topics(topic_backend, processed_docs, num_topics=50, num_workers=None, random_seed=None):
+    """
+    Assigns a topic to each document with one of the non-HDP backends (HDP goes through `load_or_fit_hdp`).
+    Returns:
+        list of int: Topic ID per document, or -1 if no topic is assigned.
+    """
+    check_topic_backend(topic_backend)
+    if topic_backend == "lda_multicore":
+        workers = num_workers if num_workers and num_workers > 1 else None
+        return lda_multicore_topics(processed_docs, num_topics, num_workers=workers, random_seed=random_seed).tolist()
+    if topic_backend == "tfidf_kmeans":
+        return tfidf_kmeans_topics(processed_docs, num_topics, random_seed=random_seed).tolist()
+    raise ValueError("The 'hdp' backend is fitted with load_or_fit_hdp")
+
+
+def _reset_peak_rss():
+    # Reset the peak RSS (VmHWM) of this process; Linux only. Returns False if unsupported.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _proc_status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _run_backend(backend, processed_docs, num_topics, num_workers, random_seed):
+    # Runs in a fresh worker process, so that its memory peak belongs to this backend only
+    from utils.statistic_funcs import _fit_hdp, assign_dominant_topics
+
+    if _reset_peak_rss():
+        rss_before = _proc_status_kb("VmRSS")
+    else:
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # coarser: high-water mark so far
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    start = time.perf_counter()
+    if backend == "hdp":
+        hdp_model, _, corpus = _fit_hdp(processed_docs, random_seed)
+        topics = assign_dominant_topics(hdp_model, corpus, validate_sample=0)
+    else:
+        topics = backend_dominant_topics(backend, processed_docs, num_topics, num_workers, random_seed)
+    seconds = time.perf_counter() - start
+    # Sizes are in KB on Linux; children are the LdaMulticore worker processes
+    peak = _proc_status_kb("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Only LdaMulticore runs worker processes; other short-lived children (e.g. a `lscpu` call) would only
+    # report the forked size of this process
+    workers_peak = children_peak if backend == "lda_multicore" and children_peak > children_before else 0
+    return topics, seconds, max(0, peak - rss_before) / 1024, workers_peak / 1024
+
+
+def benchmark_topic_backends(jsonl_path, field_name, data_format, max_samples_total=10000, backends=TOPIC_BACKENDS,
+                             num_topics=50, num_workers=None, random_seed=42):
+    """
+    Compares topic backends on one dataset: each backend assigns topics to the same preprocessed documents,
+    the same quota-balancing sampler selects `max_samples_total` samples, and the selection is compared
+    with the one of the HDP backend (Jaccard overlap of the selected index sets).
+    Each backend runs in its own process, so the memory figures are not mixed up between backends.
+    Args:
+        jsonl_path (str): Input JSONL or Parquet file, e.g. a `*_diff_filtered` output of dt_filtering.
+        field_name (str or list): Field name(s) to extract instruction content.
+        data_format (str): The construction format of the input dataset ("sharegpt" or "general").
+        max_samples_total (int, optional): Number of samples to select. Defaults to 10000.
+        backends (iterable of str, optional): Backends to compare; "hdp" is always run first as the baseline.
+        num_topics (int, optional): Number of topics of the fixed-size backends. Defaults to 50.
+        num_workers (int, optional): Number of worker processes. Defaults to None.
+        random_seed (int, optional): Random seed of the models and of the sampler. Defaults to 42.
+    Returns:
+        dict: backend -> {"fit_seconds", "peak_rss_growth_mb", "workers_peak_rss_mb", "num_topics", "jaccard_vs_hdp"}.
+            `peak_rss_growth_mb` is the peak memory of the backend run above the memory of its process before
+            the run; `workers_peak_rss_mb` is the largest peak of its own worker processes (LdaMulticore), if any.
+    """
+    import random
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from utils.hdp_preprocess import HdpPreprocessor
+    from utils.load_instruct_from_file import load_instructions_from_jsonl
+    from utils.topic_sampler import sample_indices_by_topic
+
+    instr_list, _ = load_instructions_from_jsonl(jsonl_path, field_name, data_format)
+    processed_docs = HdpPreprocessor().map(instr_list, num_workers=num_workers)
+
+    backends = ["hdp"] + [b for b in backends if b != "hdp"]
+    results = {}
+    baseline = None
+    for backend in backends:
+        check_topic_backend(backend)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            topics, seconds, rss_growth, workers_peak = executor.submit(
+                _run_backend, backend, processed_docs, num_topics, num_workers, random_seed).result()
+
+        random.seed(random_seed)
+        selected = set(sample_indices_by_topic(topics, max_samples_total=max_samples_total))
+        if baseline is None:
+            baseline = selected
+        results[backend] = {
+            "fit_seconds": round(seconds, 2),
+            "peak_rss_growth_mb": round(rss_growth, 1),
+            "workers_peak_rss_mb": round(workers_peak, 1),
+            "num_topics": len(set(topics) - {-1}),
+            "jaccard_vs_hdp": round(len(selected & baseline) / max(1, len(selected | baseline)), 4),
+        }
+        log.info(f"{backend}: {results[backend]}")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import yaml
+
+    parser = argparse.ArgumentParser(description="Benchmark topic backends against the HDP baseline. "
+                                                 "Run from the generation directory: python -m utils.topic_backends")
+    parser.add_argument("--config", type=str, required=True, help="Path to the filter_config.yaml file.")
+    parser.add_argument("--input", type=str, default=None,
+                        help="Dataset to benchmark on (default: jsonl_path of the config), e.g. a *_diff_filtered file.")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    settings = config.get("filter_settings") or {}
+
+    results = benchmark_topic_backends(
+        args.input or config["jsonl_path"], config["field_name"], config["data_format"],
+        max_samples_total=settings.get("max_samples_total", 10000),
+        num_topics=settings.get("num_topics", 50),
+        num_workers=settings.get("num_workers", 1),
+        random_seed=config.get("random_seed", 42),
+    )
+    print(f"{'backend':<15}{'fit (s)':>10}{'peak RSS +MB':>14}{'workers MB':>12}{'topics':>8}{'Jaccard vs HDP':>16}")
+    for backend, r in results.items():
+        print(f"{backend:<15}{r['fit_seconds']:>10}{r['peak_rss_growth_mb']:>14}{r['workers_peak_rss_mb']:>12}"
+              f"{r['num_topics']:>8}{r['jaccard_vs_hdp']:>16}")
+    print(json.dumps(results))
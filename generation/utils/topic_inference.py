@@ -0,0 +1,211 @@
+import logging
+import numpy as np
+from functools import partial
+from tqdm import tqdm
+
+from utils.bow_corpus import BowCorpus
+from utils.parallel import imap_ordered
+
+
+log = logging.getLogger(__name__)
+
+# Same settings as `gensim.models.hdpmodel.lda_e_step` and `HdpModel.__getitem__`
+E_STEP_MAX_ITER = 100
+E_STEP_MEAN_CHANGE_THRESH = 1e-5
+TOPIC_PROB_EPS = 0.01
+
+
+def corpus_to_csr(corpus, num_terms):
+    """
+    Converts a bag-of-words corpus to a sparse CSR document-term matrix.
+    Args:
+        corpus (list of list of (int, int) or BowCorpus): Bag-of-words documents, as returned by `Dictionary.doc2bow`.
+        num_terms (int): Number of terms (columns).
+    Returns:
+        scipy.sparse.csr_matrix: Matrix of shape (len(corpus), num_terms) holding the word counts.
+    """
+    from scipy.sparse import csr_matrix
+
+    if isinstance(corpus, BowCorpus):
+        return corpus.to_csr(num_terms)
+    indptr = np.zeros(len(corpus) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(bow) for bow in corpus])
+    indices = np.fromiter((word_id for bow in corpus for word_id, _ in bow), dtype=np.int32, count=indptr[-1])
+    counts = np.fromiter((count for bow in corpus for _, count in bow), dtype=np.float64, count=indptr[-1])
+    return csr_matrix((counts, indices, indptr), shape=(len(corpus), num_terms))
+
+
+def _dirichlet_expectation_2d(alpha):
+    from scipy.special import psi
+
+    return psi(alpha) - psi(alpha.sum(axis=1))[:, np.newaxis]
+
+
+def batch_lda_e_step(doc_term, alpha, beta, max_iter=E_STEP_MAX_ITER, mean_change_thresh=E_STEP_MEAN_CHANGE_THRESH):
+    """
+    Runs the LDA E-step of `gensim.models.hdpmodel.lda_e_step` on a batch of documents at once.
+
+    The words of each document are laid out in a zero-padded (num_docs, max_doc_len, num_topics) block of beta,
+    so one iteration is a pair of stacked matrix products for the whole batch instead of a Python loop over
+    documents. Padding has zero counts and zero beta, so it does not change the result. Each document stops
+    updating once its own mean absolute change drops below `mean_change_thresh`, exactly as the per-document
+    loop does; converged documents are dropped from the working arrays in batches.
+
+    Args:
+        doc_term (scipy.sparse.csr_matrix): Word counts of shape (num_docs, num_terms). Documents of similar
+            length should be batched together to keep the padding small.
+        alpha (numpy.ndarray): LDA alpha of shape (num_topics,).
+        beta (numpy.ndarray): LDA beta (topic-word matrix) of shape (num_topics, num_terms).
+        max_iter (int, optional): Maximum number of iterations. Defaults to 100.
+        mean_change_thresh (float, optional): Convergence threshold. Defaults to 1e-5.
+    Returns:
+        numpy.ndarray: Gamma of shape (num_docs, num_topics). Rows of empty documents are zero.
+    """
+    num_docs, num_topics = doc_term.shape[0], len(alpha)
+    gamma = np.zeros((num_docs, num_topics))
+    doc_lens = np.diff(doc_term.indptr)
+    nonempty = np.flatnonzero(doc_lens)
+    if len(nonempty) == 0:
+        return gamma
+
+    # Padded per-document blocks: counts (docs, len) and beta of the document words (docs, len, topics)
+    doc_term, doc_lens = doc_term[nonempty], doc_lens[nonempty]
+    rows = np.repeat(np.arange(len(nonempty)), doc_lens)
+    cols = np.arange(len(rows)) - np.repeat(doc_term.indptr[:-1], doc_lens)
+    counts = np.zeros((len(nonempty), doc_lens.max()))
+    counts[rows, cols] = doc_term.data
+    betad = np.zeros((len(nonempty), doc_lens.max(), num_topics))
+    betad[rows, cols] = beta[:, doc_term.indices].T
+
+    def phinorm(exp_elog_theta):
+        # expElogtheta_d . beta[:, w] for every word w of every document d
+        return np.matmul(betad, exp_elog_theta[:, :, np.newaxis])[:, :, 0] + 1e-100
+
+    active = np.arange(len(nonempty))  # documents still in the working arrays
+    pending = np.ones(len(active), dtype=bool)  # of those, the ones that have not converged yet
+    gamma_batch = np.ones((len(nonempty), num_topics))
+    active_gamma = gamma_batch
+    exp_elog_theta = np.exp(_dirichlet_expectation_2d(active_gamma))
+    norm = phinorm(exp_elog_theta)
+    for _ in range(max_iter):
+        new_gamma = alpha + exp_elog_theta * np.matmul((counts / norm)[:, np.newaxis, :], betad)[:, 0, :]
+        converged = pending & (np.abs(new_gamma - active_gamma).mean(axis=1) < mean_change_thresh)
+        active_gamma = new_gamma
+        exp_elog_theta = np.exp(_dirichlet_expectation_2d(active_gamma))
+        if converged.any():
+            # Converged documents keep their gamma. Their rows are still computed (and ignored) until at most
+            # half of the rows are pending, then the working arrays are compacted; copying them on every
+            # convergence would cost more than the wasted rows.
+            gamma_batch[active[converged]] = active_gamma[converged]
+            pending &= ~converged
+            if not pending.any():
+                break
+            if pending.sum() * 2 <= len(pending):
+                active, active_gamma, exp_elog_theta = active[pending], active_gamma[pending], exp_elog_theta[pending]
+                counts, betad = counts[pending], betad[pending]
+                pending = np.ones(len(active), dtype=bool)
+        norm = phinorm(exp_elog_theta)
+    else:
+        gamma_batch[active[pending]] = active_gamma[pending]
+
+    gamma[nonempty] = gamma_batch
+    return gamma
+
+
+def dominant_topics_from_gamma(gamma, eps=TOPIC_PROB_EPS):
+    """
+    Returns the dominant topic of each row of gamma, as `max(hdp_model[bow])` does:
+    the topic of highest normalized probability, or -1 if the document is empty or no topic reaches `eps`.
+    """
+    totals = gamma.sum(axis=1, keepdims=True)
+    probs = np.divide(gamma, totals, out=np.zeros_like(gamma), where=totals != 0)
+    dominant = probs.argmax(axis=1)
+    dominant[probs.max(axis=1, initial=0.0) < eps] = -1
+    return dominant
+
+
+def _lda_params(hdp_model):
+    # The LDA equivalent used by `HdpModel.__getitem__`; set once the model is trained
+    alpha = getattr(hdp_model, "lda_alpha", None)
+    beta = getattr(hdp_model, "lda_beta", None)
+    if alpha is None or beta is None:
+        alpha, beta = hdp_model.hdp_to_lda()
+    return alpha, beta
+
+
+def _dominant_topics_of_batch(batch, eps=TOPIC_PROB_EPS):
+    # `batch` is (doc_term, alpha, beta) with beta restricted to the columns of doc_term, so that a batch
+    # is cheap to send to a worker process
+    doc_term, alpha, beta = batch
+    return dominant_topics_from_gamma(batch_lda_e_step(doc_term, alpha, beta), eps)
+
+
+def infer_dominant_topics(hdp_model, corpus, batch_size=32, eps=TOPIC_PROB_EPS, num_workers=None):
+    """
+    Assigns the dominant topic of every document with batched inference over a sparse doc-term matrix.
+    Args:
+        hdp_model (HdpModel): Fitted HDP model.
+        corpus (list of list of (int, int) or BowCorpus): Bag-of-words documents.
+        batch_size (int, optional): Number of documents per inference batch. Small batches keep the padded
+            beta block of a batch in CPU cache across iterations. Defaults to 32.
+        eps (float, optional): Topics below this probability are ignored, as in `hdp_model[bow]`. Defaults to 0.01.
+        num_workers (int, optional): Number of worker processes, None or 1 for serial. Defaults to None.
+    Returns:
+        numpy.ndarray: Dominant topic ID per document, or -1 if no topic is assigned.
+    """
+    from scipy.sparse import csr_matrix
+
+    alpha, beta = _lda_params(hdp_model)
+    doc_term = corpus_to_csr(corpus, beta.shape[1])
+    # Batch documents of similar length together, so that little padding is needed
+    order = np.argsort(np.diff(doc_term.indptr), kind="stable")
+    batches = [order[start:start + batch_size] for start in range(0, len(corpus), batch_size)]
+
+    def batch_inputs():
+        for batch in batches:
+            batch_doc_term = doc_term[batch]
+            # Keep only the columns of beta used by the batch, and renumber the words accordingly
+            used, local_indices = np.unique(batch_doc_term.indices, return_inverse=True)
+            batch_doc_term = csr_matrix((batch_doc_term.data, local_indices, batch_doc_term.indptr),
+                                        shape=(batch_doc_term.shape[0], len(used)))
+            yield batch_doc_term, alpha, beta[:, used]
+
+    dominant = np.empty(len(corpus), dtype=np.int64)
+    results = imap_ordered(partial(_dominant_topics_of_batch, eps=eps), batch_inputs(), num_workers=num_workers,
+                           chunk_size=8)
+    for batch, batch_dominant in zip(batches, tqdm(results, total=len(batches), desc="Assigning dominant topics (batched)")):
+        dominant[batch] = batch_dominant
+    return dominant
+
+
+def dominant_topics_per_doc(hdp_model, corpus):
+    """Assigns the dominant topic of every document with `hdp_model[bow]`, one document at a time."""
+    dominant_topics = []
+    for bow in tqdm(corpus, desc="Assigning dominant topics"):
+        topic_probs = hdp_model[bow]
+        if topic_probs:
+            dominant_topics.append(max(topic_probs, key=lambda x: x[1])[0])
+        else:
+            dominant_topics.append(-1)  # No topic assigned
+    return dominant_topics
+
+
+def validate_dominant_topics(hdp_model, corpus, dominant_topics, sample_size=200, random_seed=0):
+    """
+    Checks batched dominant topics against the per-document `hdp_model[bow]` result on a random sample.
+    Returns:
+        float: Fraction of sampled documents whose dominant topics agree.
+    """
+    if len(corpus) == 0 or sample_size <= 0:
+        return 1.0
+    rng = np.random.default_rng(random_seed)
+    sample = rng.choice(len(corpus), size=min(sample_size, len(corpus)), replace=False)
+    expected = dominant_topics_per_doc(hdp_model, [corpus[i] for i in sample])
+    mismatches = [(int(i), int(dominant_topics[i]), ref) for i, ref in zip(sample, expected) if dominant_topics[i] != ref]
+    agreement = 1.0 - len(mismatches) / len(sample)
+    if mismatches:
+        log.warning(f"Batched topic inference disagrees with per-document inference on {len(mismatches)} of "
+                    f"{len(sample)} sampled documents (doc, batched, per-doc): {mismatches[:10]}")
+    else:
+        log.info(f"Batched topic inference agrees with per-document inference on {len(sample)} sampled documents")
+    return agreement
@@ -0,0 +1,125 @@
+import math
+import random
+import logging
+from collections import Counter
+
+
+log = logging.getLogger(__name__)
+
+
+def topic_quotas(topic_counts, max_samples_total=None, max_samples_per_topic=None):
+    """
+    Computes how many documents to keep per topic.
+
+    With `max_samples_total`, quotas are allocated by water-filling: topics smaller than the common level are
+    kept whole, and the rest of the budget is split evenly across the larger topics. The level is found in one
+    pass over the topics sorted by size. The budget left over by rounding down goes one document at a time to
+    the larger topics, in the order of `topic_counts`. If the budget covers every topic, all documents are kept.
+    Otherwise each topic is capped at `max_samples_per_topic`, or kept whole if that is None too.
+
+    Args:
+        topic_counts (dict): Topic ID -> number of documents, in order of first appearance (e.g. a `Counter`).
+        max_samples_total (int, optional): Total number of documents to keep.
+        max_samples_per_topic (int, optional): Maximum number of documents to keep per topic.
+    Returns:
+        dict: Topic ID -> number of documents to keep, in the order of `topic_counts`.
+    """
+    if max_samples_total is None:
+        if max_samples_per_topic is None:
+            return dict(topic_counts)
+        return {topic: min(count, max_samples_per_topic) for topic, count in topic_counts.items()}
+
+    # Smallest prefix (by size) of locked topics such that the next topic is above the level of the rest
+    sizes = sorted(topic_counts.values())
+    num_topics = len(sizes)
+    num_locked, locked_total = 0, 0
+    while num_locked < num_topics and sizes[num_locked] * (num_topics - num_locked) <= max_samples_total - locked_total:
+        locked_total += sizes[num_locked]
+        num_locked += 1
+    if num_locked == num_topics:
+        return dict(topic_counts)
+
+    # Topics of the same size as the first unlocked one are above the level as well
+    level_size = sizes[num_locked]
+    num_unlocked = num_topics - num_locked
+    quota, remainder = divmod(max_samples_total - locked_total, num_unlocked)
+    quotas = {}
+    for topic, count in topic_counts.items():
+        if count < level_size:
+            quotas[topic] = count
+        else:
+            quotas[topic] = quota + (1 if remainder > 0 else 0)
+            remainder -= 1
+    log.info(f"Topic quotas: {num_locked} topics kept whole ({locked_total} samples), "
+             f"{num_unlocked} topics sampled down to about {quota} samples each")
+    return quotas
+
+
+def _unit(rng):
+    # Uniform in (0, 1); `random()` can return 0.0
+    return 1.0 - rng.random()
+
+
+def _skip(rng, weight):
+    # Number of documents to skip before the next one enters a full reservoir
+    if weight >= 1.0:
+        return 0
+    return int(math.log(_unit(rng)) / math.log1p(-weight))
+
+
+def reservoir_sample_by_topic(doc_topics, quotas, rng=random):
+    """
+    Selects up to `quotas[topic]` documents uniformly at random per topic, in one pass over (doc_id, topic)
+    pairs. Only the selected document IDs are held in memory, one reservoir per topic.
+    Args:
+        doc_topics (iterable of (int, int)): (doc_id, topic) pairs, e.g. `enumerate(dominant_topics)`.
+        quotas (dict): Topic ID -> number of documents to keep (see `topic_quotas`). Topics not in `quotas`
+            are dropped.
+        rng (random.Random, optional): Random number generator. Defaults to the global `random` state.
+    Returns:
+        list of int: Sorted IDs of the selected documents.
+    """
+    # Algorithm L: once a reservoir is full, the position of the next accepted document is drawn directly,
+    # so the random number generator is only called O(k log(n / k)) times per topic
+    reservoirs = {topic: [] for topic in quotas if quotas[topic] > 0}
+    seen = dict.fromkeys(reservoirs, 0)
+    next_accept = {}  # topic -> position of the next document to enter the full reservoir
+    weights = {}
+    for doc_id, topic in doc_topics:
+        reservoir = reservoirs.get(topic)
+        if reservoir is None:
+            continue
+        n = seen[topic]
+        seen[topic] = n + 1
+        k = quotas[topic]
+        if n < k:
+            reservoir.append(doc_id)
+            if n + 1 == k:
+                weights[topic] = math.exp(math.log(_unit(rng)) / k)
+                next_accept[topic] = k + _skip(rng, weights[topic])
+        elif n == next_accept[topic]:
+            reservoir[rng.randrange(k)] = doc_id
+            weights[topic] *= math.exp(math.log(_unit(rng)) / k)
+            next_accept[topic] = n + 1 + _skip(rng, weights[topic])
+    return sorted(doc_id for reservoir in reservoirs.values() for doc_id in reservoir)
+
+
+def sample_indices_by_topic(dominant_topics, max_samples_per_topic=None, max_samples_total=None, rng=random):
+    """
+    Randomly samples document indices so that topics are balanced (see `topic_quotas`).
+    Args:
+        dominant_topics (list of int): Dominant topic ID per document.
+        max_samples_per_topic (int, optional): Maximum samples to keep per topic.
+        max_samples_total (int, optional): Total number of samples to keep.
+        rng (random.Random, optional): Random number generator. Defaults to the global `random` state.
+    Returns:
+        list of int: Sorted indices of the selected documents.
+    """
+    topic_counts = Counter(dominant_topics)
+    log.info(f"Found {len(topic_counts)} topics")
+    if max_samples_total is not None:
+        log.info(f"Original total sample count: {len(dominant_topics)}, target total: {max_samples_total}")
+    quotas = topic_quotas(topic_counts, max_samples_total, max_samples_per_topic)
+    for topic, count in topic_counts.items():
+        log.debug(f"Topic {topic}: {count} → keep {quotas[topic]}")
+    return reservoir_sample_by_topic(enumerate(dominant_topics), quotas, rng)
@@ -0,0 +1,230 @@
+import json
+from dataclasses import dataclass, field, fields as dataclass_fields
+
+from array import array
+
+from utils.columnar_io import is_parquet_path, iter_parquet_rows, fetch_parquet_rows, parquet_num_rows, write_parquet
+
+
+class _Missing:
+    """Marks a slot whose field is absent from the source record, so that an explicit JSON null is kept."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<missing>"
+
+    def __reduce__(self):
+        return "_MISSING"  # Unpickles to the same instance, so identity checks hold in worker processes
+
+
+_MISSING = _Missing()
+
+
+@dataclass(slots=True)
+class TripletRecord:
+    """
+    A slotted record for code edit triplets as they move through the pipeline.
+
+    The slots follow the order in which the pipeline adds fields (separation, code purification,
+    instruction purification, mixing), so `to_dict` reproduces the JSON key order of the original files.
+    Fields that are absent in the source record stay unset and are omitted on output, while a null field is
+    kept as None. Any field without a slot (e.g. `response_1`, `sample_index`) is kept in `extra`, so nothing
+    is lost on a round trip.
+    """
+    commit: object = _MISSING
+    code_snippet: object = _MISSING
+    code_before: object = _MISSING
+    code_after: object = _MISSING
+    instruct_descriptive: object = _MISSING
+    instruct_lazy: object = _MISSING
+    code_before_purify: object = _MISSING
+    code_after_purify: object = _MISSING
+    instruct_descriptive_purify: object = _MISSING
+    instruct_lazy_purify: object = _MISSING
+    instruct_purify: object = _MISSING
+    instr_type: object = _MISSING
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data, fields=None):
+        """
+        Build a record from a decoded JSON object.
+
+        Args:
+            data (dict): Decoded JSON object.
+            fields (iterable of str, optional): If given, only these fields are kept (projection).
+                Defaults to None, which keeps every field.
+
+        Returns:
+            TripletRecord: The constructed record.
+        """
+        if fields is not None:
+            data = {k: data[k] for k in fields if k in data}
+        record = cls()
+        for key, value in data.items():
+            record.set(key, value)
+        return record
+
+    @classmethod
+    def from_json(cls, line, fields=None):
+        """
+        Decode a record straight from a JSON line (str or bytes).
+
+        Args:
+            line (str or bytes): One JSONL line.
+            fields (iterable of str, optional): Fields to keep. Defaults to None (keep all).
+
+        Returns:
+            TripletRecord: The decoded record.
+        """
+        return cls.from_dict(json.loads(line), fields=fields)
+
+    def get(self, key, default=None):
+        """Dict-style access, so records can be passed where dicts were used before."""
+        if key in _SLOT_NAMES:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        return self.extra.get(key, default)
+
+    def set(self, key, value):
+        if key in _SLOT_NAMES:
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        if key in _SLOT_NAMES:
+            return getattr(self, key) is not _MISSING
+        return key in self.extra
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def to_dict(self):
+        """Return the record as a plain dict, omitting absent fields."""
+        data = {}
+        for name in _SLOT_NAMES:
+            value = getattr(self, name)
+            if value is not _MISSING:
+                data[name] = value
+        data.update(self.extra)
+        return data
+
+    def to_json(self, ensure_ascii=False):
+        return json.dumps(self.to_dict(), ensure_ascii=ensure_ascii)
+
+
+_SLOT_NAMES = tuple(f.name for f in dataclass_fields(TripletRecord) if f.name != "extra")
+
+
+def iter_records(file_path, fields=None):
+    """
+    Iterate over a JSONL or Parquet file of triplets, yielding one `TripletRecord` per record.
+
+    JSONL lines are read as bytes and decoded directly, without an intermediate str copy of the whole file.
+    Parquet files are streamed by record batch, and only the projected columns are read from disk.
+
+    Args:
+        file_path (str): Path to the JSONL or Parquet (`.parquet`) file.
+        fields (iterable of str, optional): Fields to keep in each record. Defaults to None (keep all).
+
+    Yields:
+        TripletRecord: The decoded records, in file order.
+    """
+    if fields is not None:
+        fields = tuple(fields)
+    if is_parquet_path(file_path):
+        for row in iter_parquet_rows(file_path, columns=fields):
+            yield TripletRecord.from_dict(row)
+        return
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield TripletRecord.from_json(line, fields=fields)
+
+
+def read_records(file_path, fields=None):
+    """Read a JSONL or Parquet file of triplets into a list of `TripletRecord`."""
+    return list(iter_records(file_path, fields=fields))
+
+
+def write_records(records, file_path, ensure_ascii=False):
+    """
+    Write records (TripletRecord or dict) to a JSONL file, or to Parquet if the path ends with `.parquet`.
+
+    Records are consumed one at a time, so `records` can be a generator over a larger-than-memory stream.
+
+    Args:
+        records (iterable): Records to write.
+        file_path (str): Path to the output JSONL or Parquet file.
+        ensure_ascii (bool, optional): Passed to `json.dumps` for JSONL output. Defaults to False.
+
+    Returns:
+        list of int: The locator of each written record, for use with `fetch_records`:
+            the byte offset of its line for JSONL, or its row index for Parquet.
+    """
+    locators = []
+    if is_parquet_path(file_path):
+        def rows():
+            for record in records:
+                locators.append(len(locators))
+                yield record.to_dict() if isinstance(record, TripletRecord) else record
+
+        write_parquet(rows(), file_path)
+        return locators
+    with open(file_path, 'wb') as f:
+        for record in records:
+            if isinstance(record, TripletRecord):
+                record = record.to_dict()
+            locators.append(f.tell())
+            f.write((json.dumps(record, ensure_ascii=ensure_ascii) + '\n').encode('utf-8'))
+    return locators
+
+
+def record_locators(file_path):
+    """
+    Scan a JSONL or Parquet file once for the locators of its records, without decoding them.
+
+    Args:
+        file_path (str): Path to the JSONL or Parquet file.
+
+    Returns:
+        Sequence of int: The locator of each record, in file order, for use with `fetch_records`:
+            the byte offset of each non-blank line for JSONL (as a compact `array`), or the row indices
+            (a `range`) for Parquet.
+    """
+    if is_parquet_path(file_path):
+        return range(parquet_num_rows(file_path))
+    locators = array('q')
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                locators.append(f.tell() - len(line))
+    return locators
+
+
+def fetch_records(file_path, locators, fields=None):
+    """
+    Fetch selected records from a JSONL or Parquet file by the locators returned from `write_records`.
+
+    Args:
+        file_path (str): Path to the JSONL or Parquet file.
+        locators (iterable of int): Byte offsets (JSONL) or row indices (Parquet), in ascending order.
+        fields (iterable of str, optional): Fields to keep in each record. Defaults to None (keep all).
+
+    Yields:
+        TripletRecord: The selected records, in the order of `locators`.
+    """
+    if is_parquet_path(file_path):
+        for row in fetch_parquet_rows(file_path, locators):
+            yield TripletRecord.from_dict(row, fields=fields)
+        return
+    with open(file_path, 'rb') as f:
+        for offset in locators:
+            f.seek(offset)
+            yield TripletRecord.from_json(f.readline(), fields=fields)
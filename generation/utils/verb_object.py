@@ -0,0 +1,196 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from collections import Counter
+from tqdm import tqdm
+
+from utils.code_splitter import edit_instruction_splitter
+from utils.hdp_cache import file_content_hash
+from utils.load_instruct_from_file import load_instructions_from_jsonl
+
+
+log = logging.getLogger(__name__)
+
+# Bump when the extraction rules or the layout of a cache file change, so that old counts are not reused
+VERB_OBJECT_CACHE_VERSION = "verb-object-v1"
+
+# Pipeline components that verb-object extraction needs: POS tags (tagger or morphologizer, mapped to
+# coarse tags by the attribute ruler), dependencies (parser), lemmas (lemmatizer), and the shared embedding
+# layers they listen to. Everything else (e.g. ner) is disabled.
+VERB_OBJECT_PIPES = ("tok2vec", "transformer", "tagger", "morphologizer", "attribute_ruler", "parser", "lemmatizer")
+
+
+def load_verb_object_nlp(lang="en_core_web_sm"):
+    """
+    Loads a spaCy pipeline with only the components that `count_verb_object_pairs` needs enabled.
+    Args:
+        lang (str, optional): Name of the installed spaCy pipeline. Defaults to "en_core_web_sm".
+    Returns:
+        spacy.language.Language: The pipeline.
+    Raises:
+        ValueError: If the pipeline is not installed.
+    """
+    import spacy
+
+    try:
+        nlp = spacy.load(lang)
+    except OSError:
+        raise ValueError(f"spaCy model '{lang}' not found. Please run: python -m spacy download {lang}")
+    unused = [name for name in nlp.pipe_names if name not in VERB_OBJECT_PIPES]
+    if unused:
+        nlp.select_pipes(disable=unused)
+    log.info(f"spaCy pipeline {lang}: running {nlp.pipe_names}")
+    return nlp
+
+
+def verb_object_pairs(doc):
+    """Returns the (verb lemma, direct object lemma) pairs of a parsed document, lowercased."""
+    pairs = []
+    for token in doc:
+        if token.pos_ == "VERB":
+            for child in token.children:
+                if child.dep_ in ("dobj", "obj"):  # Direct object
+                    pairs.append((token.lemma_.lower(), child.lemma_.lower()))
+    return pairs
+
+
+def count_verb_object_pairs(texts, nlp, batch_size=256, n_process=1, total=None):
+    """
+    Parses texts in batches with `nlp.pipe` and counts their verb-object pairs.
+    Args:
+        texts (iterable of str): Texts to parse; can be a generator.
+        nlp (spacy.language.Language): Pipeline, e.g. from `load_verb_object_nlp`.
+        batch_size (int, optional): Number of texts per batch. Defaults to 256.
+        n_process (int, optional): Number of processes parsing batches. Defaults to 1.
+        total (int, optional): Number of texts, for the progress bar. Defaults to `len(texts)` if available.
+    Returns:
+        Counter: (verb, object) -> count.
+    """
+    if total is None and hasattr(texts, "__len__"):
+        total = len(texts)
+    pair_counts = Counter()
+    docs = nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+    for doc in tqdm(docs, total=total, desc="Extracting verb-object pairs", unit="docs"):
+        pair_counts.update(verb_object_pairs(doc))
+    return pair_counts
+
+
+def default_verb_object_cache_dir():
+    """Default location of the verb-object count cache, under `utils/fit_results`."""
+    return os.path.join(os.path.dirname(__file__), "fit_results", "verb_object_cache")
+
+
+def spacy_model_id(lang="en_core_web_sm"):
+    """
+    Identifies a spaCy pipeline by name and version without loading it.
+    Args:
+        lang (str, optional): Name of an installed spaCy pipeline, or path to a saved one. Defaults to "en_core_web_sm".
+    Returns:
+        dict: {"model", "model_version", "spacy_version"}.
+    Raises:
+        ValueError: If the pipeline is not installed.
+    """
+    import spacy
+    from spacy import util
+
+    if util.is_package(lang):
+        model_version = util.get_package_version(lang)
+    elif os.path.isfile(os.path.join(lang, "meta.json")):
+        model_version = util.load_meta(os.path.join(lang, "meta.json")).get("version")
+    else:
+        raise ValueError(f"spaCy model '{lang}' not found. Please run: python -m spacy download {lang}")
+    return {"model": lang, "model_version": model_version, "spacy_version": spacy.__version__}
+
+
+def verb_object_cache_key(jsonl_path, field_name, data_format, lang="en_core_web_sm"):
+    """
+    Returns the cache key of the verb-object counts of a dataset: a hash of the file content, the fields read
+    from it and the spaCy pipeline (name and version), so a changed file or model misses the cache.
+    """
+    if isinstance(field_name, str):
+        field_name = [field_name]
+    key_data = {
+        "version": VERB_OBJECT_CACHE_VERSION,
+        "content": file_content_hash(jsonl_path),
+        "field_name": list(field_name),
+        "data_format": data_format,
+        **spacy_model_id(lang),
+    }
+    payload = json.dumps(key_data, sort_keys=True, ensure_ascii=True)
+    return hashlib.blake2b(payload.encode("ascii"), digest_size=16).hexdigest()
+
+
+def save_verb_object_counts(pair_counts, file_path, info=None):
+    """
+    Writes verb-object counts as JSON, in their counting order. The file is written to a temporary file and
+    renamed into place, so an interrupted run never leaves a partial file behind.
+    Args:
+        pair_counts (Counter): (verb, object) -> count.
+        file_path (str): Output JSON path.
+        info (dict, optional): Extra fields recorded in the file, e.g. the source dataset.
+    """
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    data = {**(info or {}), "pairs": [[verb, obj, count] for (verb, obj), count in pair_counts.items()]}
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", prefix=".tmp-", suffix=".json")
+    try:
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_verb_object_counts(file_path):
+    """Reads verb-object counts written by `save_verb_object_counts` into a Counter."""
+    with open(file_path, encoding="utf-8") as f:
+        data = json.load(f)
+    return Counter({(verb, obj): count for verb, obj, count in data["pairs"]})
+
+
+def merge_verb_object_counts(counts_list):
+    """Sums the verb-object counts of several datasets into one Counter."""
+    merged = Counter()
+    for pair_counts in counts_list:
+        merged.update(pair_counts)
+    return merged
+
+
+def load_or_extract_verb_object_counts(jsonl_path, field_name, data_format, lang="en_core_web_sm", batch_size=256,
+                                       n_process=1, cache_dir=None, refit=False):
+    """
+    Returns the verb-object counts of the instructions of a dataset, from the cache if the same file content
+    was parsed with the same spaCy pipeline before. Otherwise the instructions are parsed with
+    `count_verb_object_pairs` and the counts are cached.
+    Args:
+        jsonl_path (str): Path to the dataset.
+        field_name (str or list): Field name(s) to extract instruction content.
+        data_format (str): The construction format of the input dataset ("sharegpt" or "general").
+        lang (str, optional): spaCy pipeline. Defaults to "en_core_web_sm".
+        batch_size (int, optional): Number of texts per spaCy batch. Defaults to 256.
+        n_process (int, optional): Number of spaCy parsing processes. Defaults to 1.
+        cache_dir (str, optional): Cache directory. Defaults to `utils/fit_results/verb_object_cache`.
+        refit (bool, optional): Parse again even if cached counts exist. Defaults to False.
+    Returns:
+        Counter: (verb, object) -> count.
+    """
+    cache_dir = cache_dir or default_verb_object_cache_dir()
+    cache_path = os.path.join(cache_dir, f"{verb_object_cache_key(jsonl_path, field_name, data_format, lang)}.json")
+    if not refit and os.path.exists(cache_path):
+        log.info(f"Loaded cached verb-object counts of {jsonl_path} from {cache_path}")
+        return load_verb_object_counts(cache_path)
+
+    nlp = load_verb_object_nlp(lang)
+    instructions, _ = load_instructions_from_jsonl(jsonl_path, field_name, data_format)
+    # Only the natural language part is parsed
+    instr_texts = (edit_instruction_splitter(instr, tokenize=False)[1] for instr in instructions)
+    pair_counts = count_verb_object_pairs(instr_texts, nlp, batch_size=batch_size, n_process=n_process,
+                                          total=len(instructions))
+    save_verb_object_counts(pair_counts, cache_path, info={"source": os.path.basename(jsonl_path),
+                                                           "num_docs": len(instructions), **spacy_model_id(lang)})
+    log.info(f"Verb-object counts saved to: {cache_path}")
+    return pair_counts